@@ -0,0 +1,25 @@
+from pathlib import Path
+
+import numpy as np
+
+
+def save_arrays(path: Path, collection_hash: str, **arrays: np.ndarray):
+    """
+    Writes arrays as an npz file along with the collection hash they were
+    built for. The file is written aside and renamed, as segments
+    """
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, collection_hash=np.array(collection_hash), **arrays)
+    tmp_path.replace(path)
+
+
+def read_arrays_hash(path: Path) -> str | None:
+    """
+    Returns the collection hash arrays were written for, None if there is no valid file
+    """
+    try:
+        with np.load(path) as data:
+            return str(data["collection_hash"])
+    except Exception as _:
+        return None
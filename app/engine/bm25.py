@@ -1,78 +1,1018 @@
+import base64
+from collections import Counter
+import heapq
+import secrets
 
 from collection.models.document import Document
-from app.engine.indexer import DocumentInfoDTO, Indexer
+from app.engine.cache import QueryCache
+from app.engine.facets import FacetIndex
+from app.engine.fields import FieldIndex
+from app.engine.impacts import ImpactIndex
+from app.engine.indexer import Indexer
+from app.engine.memory import MemoryIndex
+from app.engine.positions import PositionIndex, words_hold_phrase
+from app.engine.pruning import ScoreBounds, find_postings
+from app.engine.scoring import B, K1, bm25_idf, bm25_scores
+from app.engine.segment import Segment
+from app.engine.segmented import SegmentedIndex
+from app.engine.snippets import make_snippet
+from app.engine.spelling import SpellingIndex
+from app.engine.suggest import SuggestIndex
 
-import math
+from pathlib import Path
+
+import numpy as np
 
 from utils.logger import LOGGER
 
 
 class BM25():
     # parameters
-    k1 = 1.2
-    b = 0.75
+    k1 = K1
+    b = B
+    # relative slack on bounds, sums of bounds are not rounded as scores are
+    PRUNING_EPSILON = 1e-9
 
     indexer: Indexer
+    # set when serving from arrays instead of duckdb:
+    # loaded in memory or mapped from the segment file
+    memory_index: MemoryIndex | Segment | None = None
+    # set when serving from quantized impacts instead of frequencies
+    impact_index: ImpactIndex | None = None
+    # filters bitmaps over memory_index or impact_index documents, set along with them
+    facet_index: FacetIndex | None = None
+    # BM25F weight of each field, "body" being the inverted index
+    field_weights: dict[str, float] = {}
+    # fields postings over memory_index documents, set along with it when weighted
+    field_index: FieldIndex | None = None
+    # skip documents that can't make the top k, memory_index only
+    dynamic_pruning: bool = False
+    # words scores upper bounds over memory_index, computed along IDFs
+    score_bounds: ScoreBounds | None = None
+    # set when serving from the segmented index, kept up to date while running
+    segmented_index: SegmentedIndex | None = None
+    # words positions to match phrases and cut snippets, not kept for the segmented index
+    position_index: PositionIndex | None = None
+    # completions of the lexicon and titles, as of the last index build
+    suggest_index: SuggestIndex | None = None
+    # deletes of the lexicon words, to correct misspelled query words
+    spelling_index: SpellingIndex | None = None
+    # best documents of recent queries, per index generation
+    query_cache: QueryCache
+    # ranked documents of paginated queries, by ranking id
+    cursors: QueryCache
+    # documents ranked at once for paginated queries, doubled when scrolled past
+    cursor_depth: int
+    # rankings kept for pagination at once
+    MAX_CURSORS: int = 10000
+
+    # IDF tables, computed once per index generation (collection hash)
+    # word -> idf when serving from db, idf per term id of memory_index otherwise
+    idfs: dict[str, float] = {}
+    memory_idfs: np.ndarray | None = None
+    # idf per term id of field_index, documents holding the word in any field
+    field_idfs: np.ndarray | None = None
+    # highest normalized body frequency of each term of memory_index, to bound BM25F scores
+    body_max_frequencies: np.ndarray | None = None
+    idfs_collection_hash: str | None = None
+
+    def __init__(self, indexer: Indexer, serving_mode: str = "db", ingest_interval: int = 30, dynamic_pruning: bool = False, cache_size: int = 0, cache_ttl: float = 0, cursor_depth: int = 300, cursor_ttl: float = 600, field_weights: dict[str, float] | None = None):
+        """
+        serving_mode is one of:
+        - db: queries run against duckdb tables
+        - memory: index is loaded in memory arrays
+        - segment: index is mapped from the segment file written by the indexer
+        - segmented: index is split in segments, collection changes are
+          ingested every ingest_interval seconds
+        - impact: postings hold BM25 scores quantized at build time, mapped
+          from the impacts file written by the indexer
+
+        dynamic_pruning retrieves the top k documents without scoring all
+        of them when serving from memory or segment
+
+        cache_size queries results are cached for cache_ttl seconds (0 keeps
+        them until evicted), 0 disables the cache
 
-    def __init__(self, indexer: Indexer):
+        paginated queries rank cursor_depth documents at once, cursors
+        expire after cursor_ttl seconds
+
+        field_weights scores documents with BM25F over their "body", "title",
+        "tags" and "author" fields when serving from memory or segment, a
+        field missing from it is not scored, plain BM25 over the body when
+        no field other than the body is weighted
+        """
         LOGGER.info("Initializing BM25...")
         self.indexer = indexer
+        self.dynamic_pruning = dynamic_pruning
+        self.query_cache = QueryCache(cache_size, cache_ttl)
+        self.cursors = QueryCache(self.MAX_CURSORS, cursor_ttl)
+        self.cursor_depth = cursor_depth
+        self.field_weights = field_weights or {}
+
+        try:
+            if serving_mode == "memory":
+                self.memory_index = MemoryIndex(self.indexer.connection)
+            elif serving_mode == "segment":
+                segment = Segment(Path(self.indexer.SEGMENT_PATH))
+                if segment.collection_hash != self.indexer.collection_hash:
+                    raise Exception("segment is outdated")
+                self.memory_index = segment
+            elif serving_mode == "segmented":
+                self.segmented_index = SegmentedIndex(
+                    self.indexer, ingest_interval)
+            elif serving_mode == "impact":
+                impact_index = ImpactIndex(Path(self.indexer.IMPACTS_PATH))
+                if impact_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("impacts are outdated")
+                self.impact_index = impact_index
+        except Exception as e:
+            LOGGER.warn(
+                f"Could not load {serving_mode} index, serving from db: {e}")
+
+        if self.indexer.facets and (self.memory_index is not None or self.impact_index is not None):
+            try:
+                facet_index = FacetIndex(Path(self.indexer.FACETS_PATH))
+                if facet_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("facets are outdated")
+                self.facet_index = facet_index
+            except Exception as e:
+                LOGGER.warn(
+                    f"Could not load facets, filtering from db: {e}")
+
+        if self.indexer.fields and self.memory_index is not None and any(weight > 0 for field, weight in self.field_weights.items() if field != "body"):
+            try:
+                field_index = FieldIndex(Path(self.indexer.FIELDS_PATH))
+                if field_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("fields are outdated")
+                self.field_index = field_index
+            except Exception as e:
+                LOGGER.warn(
+                    f"Could not load fields, scoring the body only: {e}")
+
+        if self.segmented_index is None and self.indexer.positions:
+            try:
+                position_index = PositionIndex(
+                    Path(self.indexer.POSITIONS_PATH))
+                if position_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("positions are outdated")
+                self.position_index = position_index
+            except Exception as e:
+                LOGGER.warn(
+                    f"Could not load positions, matching phrases from documents: {e}")
+
+        if self.indexer.suggestions:
+            try:
+                suggest_index = SuggestIndex(
+                    Path(self.indexer.SUGGEST_PATH), self.indexer.parser)
+                if suggest_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("suggestions are outdated")
+                self.suggest_index = suggest_index
+            except Exception as e:
+                LOGGER.warn(f"Could not load suggestions: {e}")
+
+        if self.indexer.spelling:
+            try:
+                spelling_index = SpellingIndex(Path(self.indexer.SPELLING_PATH))
+                if spelling_index.collection_hash != self.indexer.collection_hash:
+                    raise Exception("spelling is outdated")
+                self.spelling_index = spelling_index
+            except Exception as e:
+                LOGGER.warn(f"Could not load spelling, not correcting words: {e}")
         LOGGER.ok("BM25 Initialized")
 
+    def compute_idf(self, n_documents: int | np.ndarray, collection_documents_number: int | None = None) -> float | np.ndarray:
+        """
+        IDF given the number of documents containing a word, also over arrays.
+        Collection size defaults to the indexer one
+        """
+        if collection_documents_number is None:
+            collection_documents_number = self.indexer.collection_documents_number
+        return bm25_idf(n_documents, collection_documents_number)
+
+    def refresh_idfs(self):
+        """
+        Computes IDF tables if the index generation changed since last computed
+        """
+        if self.idfs_collection_hash == self.indexer.collection_hash:
+            return
+
+        LOGGER.info("Computing IDF table...")
+        if self.memory_index is not None:
+            self.memory_idfs = self.compute_idf(
+                self.memory_index.document_frequencies)
+            if self.field_index is not None:
+                self.field_idfs = self.compute_idf(
+                    self.field_index.document_frequencies)
+                if self.dynamic_pruning:
+                    self.body_max_frequencies = self.max_body_frequencies()
+            elif self.dynamic_pruning:
+                terms, doc_ids, frequencies = self.memory_index.all_postings()
+                self.score_bounds = ScoreBounds(self.memory_index.document_frequencies, doc_ids, self.postings_scores(
+                    self.memory_idfs[terms], frequencies, self.memory_index.doc_lengths[doc_ids]))
+        else:
+            self.idfs = {word: float(self.compute_idf(n_documents)) for word,
+                         n_documents in self.indexer.get_words_document_frequencies().items()}
+        self.idfs_collection_hash = self.indexer.collection_hash
+        LOGGER.ok("IDF table computed")
+
     def idf(self, word: str) -> float:
         """
-        Calculates IDF for word
+        Returns IDF for word from the IDF table
+        """
+        self.refresh_idfs()
+        idf = self.idfs.get(word, None)
+        if idf is None:
+            # not in lexicon
+            return float(self.compute_idf(0))
+        return idf
+
+    def compute_documents_scores(self, query_words: list[str], words_scores: dict | None = None, words_counts: dict[tuple[str, int], int] | None = None) -> dict[tuple[str, int], float]:
+        """
+        Scores every document containing a query word, one db query per word
+        unless its postings are cached.
+
+        Postings of all words are scored as arrays, then summed per document
+        in query words order. Words scores are kept in words_scores if given,
+        to be reused by other queries of a batch. The number of distinct
+        query words each document holds is kept in words_counts if given
+        """
+        document_ids: list[np.ndarray] = []
+        scores: list[np.ndarray] = []
+        keys: list[tuple[np.ndarray, np.ndarray, np.ndarray]] = []
+        # whether postings are the first ones of their word
+        distinct: list[np.ndarray] = []
+        for i, word in enumerate(query_words):
+            word_scores = words_scores.get(
+                word, None) if words_scores is not None else None
+            if word_scores is None:
+                ids, frequencies, lengths, codes, indexes, names = self.indexer.get_word_postings(
+                    word)
+                word_scores = (ids, self.postings_scores(
+                    self.idf(word), frequencies, lengths), codes, indexes, names)
+                if words_scores is not None:
+                    words_scores[word] = word_scores
+            ids, word_postings_scores, codes, indexes, names = word_scores
+            document_ids.append(ids)
+            scores.append(word_postings_scores)
+            keys.append((codes, indexes, names))
+            distinct.append(np.full(len(ids), word not in query_words[:i]))
+        if sum(len(ids) for ids in document_ids) == 0:
+            return {}
+
+        all_ids = np.concatenate(document_ids)
+        matched, first, inverse = np.unique(
+            all_ids, return_index=True, return_inverse=True)
+        docs_scores = np.bincount(inverse, weights=np.concatenate(scores))
+
+        # (collection name, index) of matched documents, from their first posting
+        names = np.concatenate([names[codes]
+                               for codes, _, names in keys])[first]
+        indexes = np.concatenate([indexes for _, indexes, _ in keys])[first]
+        docs = list(zip(names.tolist(), indexes.tolist()))
+        if words_counts is not None:
+            counts = np.bincount(inverse, weights=np.concatenate(distinct))
+            words_counts.update(zip(docs, counts.astype(np.int64).tolist()))
+        return dict(zip(docs, docs_scores.tolist()))
+
+    def postings_scores(self, idf: float | np.ndarray, frequencies: np.ndarray, doc_lengths: np.ndarray) -> np.ndarray:
+        """
+        Scores of postings given their word IDF, frequencies and documents lengths
+        """
+        return bm25_scores(idf, frequencies, doc_lengths, self.indexer.average_document_length, self.k1, self.b)
+
+    def compute_documents_scores_in_memory(self, query_words: list[str], mask: np.ndarray | None = None, words_scores: dict | None = None) -> dict[tuple[str, int], float]:
+        """
+        Same as compute_documents_scores but over the memory index arrays.
+
+        Each word postings are scored as a whole and accumulated into a
+        dense array holding one score per document. Only documents set in
+        mask are returned, if given. Words scores are kept in words_scores
+        if given, as in compute_documents_scores
+        """
+        self.refresh_idfs()
+        index = self.memory_index
+        scores = np.zeros(index.documents_number, dtype=np.float64)
+        for word in query_words:
+            term = index.words.get(word, None)
+            if term is None:
+                continue
+            word_scores = words_scores.get(
+                word, None) if words_scores is not None else None
+            if word_scores is None:
+                doc_ids, frequencies = index.postings(word)
+                word_scores = (doc_ids, self.postings_scores(
+                    self.memory_idfs[term], frequencies, index.doc_lengths[doc_ids]))
+                if words_scores is not None:
+                    words_scores[word] = word_scores
+
+            # doc ids are unique within a word postings
+            doc_ids, word_postings_scores = word_scores
+            scores[doc_ids] += word_postings_scores
+
+        if mask is not None:
+            scores[~mask] = 0
+        matched = np.flatnonzero(scores)
+        return {index.doc_keys[i]: score for i, score in zip(matched.tolist(), scores[matched].tolist())}
+
+    def kth_score(self, scores: np.ndarray, k: int) -> float:
+        """
+        k-th highest of scores, 0 if there are less than k
+        """
+        if len(scores) < k:
+            return 0.0
+        return float(np.partition(scores, len(scores) - k)[len(scores) - k])
+
+    def compute_documents_scores_pruned(self, query_words: list[str], k: int, mask: np.ndarray | None = None) -> dict[tuple[str, int], float]:
+        """
+        Same top k documents and scores as compute_documents_scores_in_memory,
+        skipping documents that can't make it into the top k (block-max
+        MaxScore over score_bounds). We do:
+
+        - sort words by their maximum score, highest first
+        - score whole postings of words while the remaining words could still
+          lift a document not yet seen over the threshold, the k-th best
+          partial score so far
+        - for the remaining words only look candidates up within postings,
+          after dropping candidates whose partial score plus the block-max
+          bounds of the remaining words can't reach the threshold
+        - score surviving candidates again in query words order, so that
+          scores are exactly the exhaustive ones
+
+        Documents tying with the k-th one are returned as well.
+        """
+        self.refresh_idfs()
+        index = self.memory_index
+        bounds = self.score_bounds
+        slack = 1 - self.PRUNING_EPSILON
+
+        # word -> occurrences within query, each adds the word score again
+        occurrences = Counter(word for word in query_words if word in index.words)
+        words = sorted(occurrences, key=lambda word: occurrences[word] *
+                       bounds.term_max[index.words[word]], reverse=True)
+        postings = {word: index.postings(word) for word in words}
+        # remaining[i] bounds the score added by words from the i-th on
+        remaining = np.cumsum([occurrences[word] * bounds.term_max[index.words[word]]
+                              for word in reversed(words)])[::-1].tolist() + [0.0]
+
+        # essential words, scored as a whole
+        scores = np.zeros(index.documents_number, dtype=np.float64)
+        threshold = 0.0
+        essential = 0
+        while essential < len(words) and remaining[essential] >= threshold * slack:
+            word = words[essential]
+            doc_ids, frequencies = postings[word]
+            scores[doc_ids] += occurrences[word] * self.postings_scores(
+                self.memory_idfs[index.words[word]], frequencies, index.doc_lengths[doc_ids])
+            if mask is not None:
+                scores[doc_ids] *= mask[doc_ids]
+            essential += 1
+            threshold = self.kth_score(scores[scores > 0], k)
+
+        # other words, looked up for candidates only
+        candidates = np.flatnonzero(scores)
+        partial = scores[candidates]
+        others = words[essential:]
+        if len(others) > 0:
+            blocks = np.array([occurrences[word] * bounds.documents_bounds(
+                index.words[word], candidates) for word in others])
+            # rest[i] bounds the score added by other words from the i-th on
+            rest = np.cumsum(blocks[::-1], axis=0)[::-1]
+        for i, word in enumerate(others):
+            keep = partial + rest[i] >= threshold * slack
+            candidates, partial, rest = candidates[keep], partial[keep], rest[:, keep]
+
+            doc_ids, frequencies = postings[word]
+            positions, found = find_postings(doc_ids, candidates)
+            partial[found] += occurrences[word] * self.postings_scores(
+                self.memory_idfs[index.words[word]], frequencies[positions], index.doc_lengths[candidates[found]])
+            threshold = max(threshold, self.kth_score(partial, k))
+        candidates = candidates[partial >= threshold * slack]
+
+        # exhaustive scores of survivors
+        final = np.zeros(len(candidates), dtype=np.float64)
+        for word in query_words:
+            if word not in postings:
+                continue
+            doc_ids, frequencies = postings[word]
+            positions, found = find_postings(doc_ids, candidates)
+            final[found] += self.postings_scores(
+                self.memory_idfs[index.words[word]], frequencies[positions], index.doc_lengths[candidates[found]])
+        LOGGER.ok(
+            f"Pruned scoring kept {len(candidates)} documents, {essential} / {len(words)} words scored as a whole")
+        return {index.doc_keys[i]: score for i, score in zip(candidates.tolist(), final.tolist())}
+
+    def normalized_frequencies(self, frequencies: np.ndarray, lengths: np.ndarray, average_length: float) -> np.ndarray:
+        """
+        Frequencies of words within a field, normalized by the field length
+        within each document
+        """
+        return frequencies / (1 - self.b + self.b * (lengths / average_length))
+
+    def max_body_frequencies(self) -> np.ndarray:
+        """
+        Highest normalized body frequency of each term of memory_index, 0 for terms without postings
+        """
+        index = self.memory_index
+        terms, doc_ids, frequencies = index.all_postings()
+        normalized = self.normalized_frequencies(
+            frequencies, index.doc_lengths[doc_ids], self.indexer.average_document_length)
+        counts = index.document_frequencies
+        maxima = np.zeros(len(counts), dtype=np.float64)
+        non_empty = counts > 0
+        if non_empty.any():
+            maxima[non_empty] = np.maximum.reduceat(
+                normalized, (np.cumsum(counts) - counts)[non_empty])
+        return maxima
+
+    def word_fields_postings(self, word: str) -> list[tuple[str, float, np.ndarray, np.ndarray, np.ndarray, float]]:
+        """
+        Postings of word within each weighted field holding it, as (field,
+        weight, doc_ids, frequencies, field length of each document, average
+        field length), body first
+        """
+        index, fields = self.memory_index, self.field_index
+        postings = []
+        body = index.postings(word)
+        if body is not None and self.field_weights.get("body", 0) > 0:
+            postings.append(("body", self.field_weights["body"], *body,
+                            index.doc_lengths, self.indexer.average_document_length))
+        for field in fields.FIELDS:
+            field_postings = fields.postings(field, word)
+            if field_postings is not None and self.field_weights.get(field, 0) > 0:
+                postings.append((field, self.field_weights[field], *field_postings,
+                                fields.doc_lengths[field], fields.average_lengths[field]))
+        return postings
+
+    def field_idf(self, word: str) -> float:
+        """
+        IDF of a word of memory_index or field_index, over documents holding it in any field
+        """
+        term = self.field_index.words.get(word, None)
+        if term is not None:
+            return self.field_idfs[term]
+        return self.memory_idfs[self.memory_index.words[word]]
+
+    def fields_scores(self, word: str, documents: np.ndarray, postings: list[tuple[str, float, np.ndarray, np.ndarray, np.ndarray, float]]) -> np.ndarray:
+        """
+        BM25F scores of word for sorted documents, 0 for documents not holding
+        it, given its word_fields_postings. Normalized frequencies of the
+        fields are weighted and summed before being saturated once, so that
+        a word repeated across fields doesn't count as many words
+        """
+        frequencies = np.zeros(len(documents), dtype=np.float64)
+        for _, weight, doc_ids, field_frequencies, lengths, average_length in postings:
+            positions, found = find_postings(doc_ids, documents)
+            frequencies[found] += weight * self.normalized_frequencies(
+                field_frequencies[positions], lengths[documents[found]], average_length)
+        return self.field_idf(word) * (frequencies * (self.k1 + 1) / (frequencies + self.k1))
+
+    def compute_documents_scores_fields(self, query_words: list[str], mask: np.ndarray | None = None, words_scores: dict | None = None) -> dict[tuple[str, int], float]:
+        """
+        Same as compute_documents_scores_in_memory but scoring words with
+        BM25F over the fields of field_index, weighted by field_weights
         """
-        n_documents = self.indexer.get_number_documents_containing_word(word)
-        return math.log((self.indexer.collection_documents_number - n_documents + 0.5) / (n_documents + 0.5) + 1)
+        self.refresh_idfs()
+        index = self.memory_index
+        scores = np.zeros(index.documents_number, dtype=np.float64)
+        for word in query_words:
+            word_scores = words_scores.get(
+                word, None) if words_scores is not None else None
+            if word_scores is None:
+                postings = self.word_fields_postings(word)
+                if len(postings) == 0:
+                    continue
+                documents = np.unique(np.concatenate(
+                    [doc_ids for _, _, doc_ids, _, _, _ in postings]))
+                word_scores = (documents, self.fields_scores(
+                    word, documents, postings))
+                if words_scores is not None:
+                    words_scores[word] = word_scores
+
+            documents, word_documents_scores = word_scores
+            scores[documents] += word_documents_scores
+
+        if mask is not None:
+            scores[~mask] = 0
+        matched = np.flatnonzero(scores)
+        return {index.doc_keys[i]: score for i, score in zip(matched.tolist(), scores[matched].tolist())}
+
+    def compute_documents_scores_fields_pruned(self, query_words: list[str], k: int, mask: np.ndarray | None = None) -> dict[tuple[str, int], float]:
+        """
+        Same top k documents and scores as compute_documents_scores_fields,
+        resolved from the short fields first. We do:
+
+        - score documents holding a query word within title, tags or author,
+          looking their body frequencies up instead of scanning body postings
+        - bound the score of every other document, holding query words in
+          the body only, with the highest normalized body frequency of each
+          word held by such documents
+        - if the k-th score beats that bound the top k is found, otherwise
+          every document is scored
+
+        Documents tying with the k-th one are returned as well.
+        """
+        self.refresh_idfs()
+        index = self.memory_index
+        slack = 1 - self.PRUNING_EPSILON
+        postings = {word: self.word_fields_postings(word)
+                    for word in set(query_words)}
+
+        fields_doc_ids = [doc_ids for word_postings in postings.values()
+                          for field, _, doc_ids, _, _, _ in word_postings if field != "body"]
+        candidates = np.unique(np.concatenate(fields_doc_ids)) if len(
+            fields_doc_ids) > 0 else np.zeros(0, dtype=np.int64)
+        if mask is not None:
+            candidates = candidates[mask[candidates]]
+        scores = np.zeros(len(candidates), dtype=np.float64)
+        for word in query_words:
+            if len(postings[word]) > 0:
+                scores += self.fields_scores(word, candidates, postings[word])
+        threshold = self.kth_score(scores, k)
+
+        # highest score of documents holding query words in the body only,
+        # words whose body documents are all candidates add nothing
+        left = 0.0
+        for word in query_words:
+            if len(postings[word]) == 0 or postings[word][0][0] != "body":
+                continue
+            _, weight, doc_ids, _, _, _ = postings[word][0]
+            _, found = find_postings(doc_ids, candidates)
+            if np.count_nonzero(found) == (np.count_nonzero(mask[doc_ids]) if mask is not None else len(doc_ids)):
+                continue
+            frequency = weight * \
+                self.body_max_frequencies[index.words[word]]
+            left += self.field_idf(word) * (frequency *
+                                            (self.k1 + 1) / (frequency + self.k1))
 
-    def word_score(self, word: str, document_word_frequency: int, document_words_length: int) -> float:
+        if left == 0 or left < threshold * slack:
+            keep = scores >= threshold * slack
+            LOGGER.ok(
+                f"Fields scoring kept {int(keep.sum())} documents without scanning the body")
+            return {index.doc_keys[i]: score for i, score in zip(candidates[keep].tolist(), scores[keep].tolist())}
+        LOGGER.ok("Fields scoring can't bound the top k, scoring every document")
+        return self.compute_documents_scores_fields(query_words, mask)
+
+    def compute_documents_scores_impacts(self, query_words: list[str], k: int | None, mask: np.ndarray | None = None) -> dict[tuple[str, int], float]:
         """
-        Calculates score for the single word
+        Score-at-a-time ranking over the impact index, returning the top k
+        documents by quantized score (all of them if k is None). We do:
+
+        - halve an impact threshold at each round, starting from the highest
+          impact of the query words
+        - add to integer accumulators the postings of each word with an
+          impact over the threshold, a prefix of its impact ordered postings
+        - after each round, if the k-th accumulator beats the next one by
+          more than the highest impacts left, the top k can't change and we stop
+        - complete the top k accumulators with the postings left
         """
-        idf = self.idf(word)
-        top = document_word_frequency * (self.k1 + 1)
-        bottom = document_word_frequency + self.k1 * \
-            (1 - self.b + self.b * (document_words_length /
-                                    self.indexer.average_document_length))
-        return idf * (top / bottom)
+        index = self.impact_index
+        occurrences = Counter(
+            word for word in query_words if word in index.words)
+
+        # word -> (doc_ids, impacts times occurrences) ordered by impact,
+        # impacts are negated so that they are sorted ascending
+        postings: dict[str, tuple[np.ndarray, np.ndarray]] = {}
+        for word, n in occurrences.items():
+            doc_ids, impacts = index.postings(word)
+            postings[word] = (doc_ids, impacts.astype(np.int64) * -n)
+        # postings of each word already added
+        added = {word: 0 for word in postings}
+
+        accumulators = np.zeros(index.documents_number, dtype=np.int64)
+        threshold = max((-int(impacts[0]) for _, impacts in postings.values() if len(impacts) > 0), default=0)
+        while threshold > 0:
+            threshold //= 2
+            for word, (doc_ids, impacts) in postings.items():
+                end = int(np.searchsorted(impacts, -threshold, side="right")
+                          ) if threshold > 0 else len(impacts)
+                round_doc_ids = doc_ids[added[word]:end]
+                round_impacts = impacts[added[word]:end]
+                if mask is not None:
+                    inside = mask[round_doc_ids]
+                    round_doc_ids, round_impacts = round_doc_ids[inside], round_impacts[inside]
+                # doc ids are unique within a word postings
+                accumulators[round_doc_ids] -= round_impacts
+                added[word] = end
+
+            if k is None:
+                continue
+            # highest impact a document can still get
+            left = sum(-int(impacts[added[word]]) for word, (_, impacts) in postings.items()
+                       if added[word] < len(impacts))
+            touched = accumulators[accumulators > 0]
+            if len(touched) <= k:
+                continue
+            top = np.partition(touched, len(touched) - k - 1)
+            if top[len(touched) - k] > top[len(touched) - k - 1] + left:
+                break
+
+        if k is None:
+            matched = np.flatnonzero(accumulators)
+        else:
+            touched = accumulators[accumulators > 0]
+            kth = np.partition(touched, len(touched) - k)[
+                len(touched) - k] if len(touched) > k else 1
+            matched = np.flatnonzero(accumulators >= kth)
+
+            # add postings left of the top k documents
+            top_k = np.zeros(index.documents_number, dtype=bool)
+            top_k[matched] = True
+            for word, (doc_ids, impacts) in postings.items():
+                left_doc_ids = doc_ids[added[word]:]
+                hits = top_k[left_doc_ids]
+                accumulators[left_doc_ids[hits]] -= impacts[added[word]:][hits]
+
+        scores = accumulators[matched] * index.scale
+        return {index.doc_keys[i]: score for i, score in zip(matched.tolist(), scores.tolist())}
+
+    def compute_documents_scores_segmented(self, query_words: list[str], words_counts: dict[tuple[str, int], int] | None = None) -> dict[tuple[str, int], float]:
+        """
+        Same as compute_documents_scores_in_memory but fanned out over the
+        live segments of the segmented index.
+
+        Deleted documents postings are dropped, so that document frequencies,
+        collection size and average length are the ones of live documents.
+        The number of distinct query words each document holds is kept in
+        words_counts if given, as in compute_documents_scores
+        """
+        segments, documents_number, average_document_length = self.segmented_index.snapshot()
+
+        # word -> [(segment position, doc_ids, term_frequencies)] of live documents
+        words_postings: dict[str, list[tuple[int, np.ndarray, np.ndarray]]] = {}
+        # distinct query words held by each document of each segment
+        counts = [np.zeros(live.segment.documents_number, dtype=np.int64)
+                  for live in segments]
+        for word in set(query_words):
+            words_postings[word] = []
+            for i, live in enumerate(segments):
+                postings = live.segment.postings(word)
+                if postings is None:
+                    continue
+                doc_ids, frequencies = postings
+                alive = ~live.deleted[doc_ids]
+                words_postings[word].append(
+                    (i, doc_ids[alive], frequencies[alive]))
+                counts[i][doc_ids[alive]] += 1
+
+        scores = [np.zeros(live.segment.documents_number, dtype=np.float64)
+                  for live in segments]
+        for word in query_words:
+            postings = words_postings[word]
+            idf = self.compute_idf(
+                sum(len(doc_ids) for _, doc_ids, _ in postings), documents_number)
+            for i, doc_ids, frequencies in postings:
+                top = frequencies * (self.k1 + 1)
+                bottom = frequencies + self.k1 * \
+                    (1 - self.b + self.b * (segments[i].segment.doc_lengths[doc_ids] /
+                                            average_document_length))
+                scores[i][doc_ids] += idf * (top / bottom)
+
+        docs_scores: dict[tuple[str, int], float] = {}
+        for live, segment_scores, segment_counts in zip(segments, scores, counts):
+            matched = np.flatnonzero(segment_scores)
+            docs_scores.update((live.segment.doc_keys[i], score) for i, score in zip(
+                matched.tolist(), segment_scores[matched].tolist()))
+            if words_counts is not None:
+                words_counts.update((live.segment.doc_keys[i], count) for i, count in zip(
+                    matched.tolist(), segment_counts[matched].tolist()))
+        return docs_scores
+
+    def word_documents(self, word: str) -> np.ndarray:
+        """
+        Sorted doc ids of impact_index or memory_index documents holding
+        word, within any weighted field when scoring with BM25F
+        """
+        if self.impact_index is not None:
+            postings = self.impact_index.postings(word)
+            # impact ordered
+            return np.sort(postings[0]) if postings is not None else np.zeros(0, dtype=np.int64)
+        if self.field_index is not None:
+            postings = self.word_fields_postings(word)
+            return np.unique(np.concatenate([doc_ids for _, _, doc_ids, _, _, _ in postings])) if postings else np.zeros(0, dtype=np.int64)
+        postings = self.memory_index.postings(word)
+        return postings[0] if postings is not None else np.zeros(0, dtype=np.int64)
+
+    def conjunctive_documents(self, query_words: list[str], mask: np.ndarray | None = None) -> np.ndarray:
+        """
+        Sorted doc ids of the documents holding every query word, among the
+        ones set in mask if given. Words are intersected rarest first:
+        documents left are binary searched within the doc ids of the next
+        word, instead of merging whole posting lists, so that long lists of
+        common words cost a lookup per document still matching
+        """
+        groups = sorted((self.word_documents(word)
+                        for word in dict.fromkeys(query_words)), key=len)
+        if len(groups) == 0:
+            return np.zeros(0, dtype=np.int64)
+
+        documents = groups[0]
+        if mask is not None:
+            documents = documents[mask[documents]]
+        for doc_ids in groups[1:]:
+            if len(documents) == 0:
+                break
+            _, found = find_postings(doc_ids, documents)
+            documents = documents[found]
+        return documents
+
+    def holding_every_word(self, query_words: list[str], words_counts: dict[tuple[str, int], int]) -> set[tuple[str, int]]:
+        """
+        Documents holding every query word, given the number of distinct
+        query words each scored document holds
+        """
+        n_words = len(set(query_words))
+        return {doc for doc, count in words_counts.items() if count == n_words}
+
+    def compute_documents_scores_conjunctive(self, query_words: list[str], documents: np.ndarray, k: int) -> dict[tuple[str, int], float]:
+        """
+        Scores of sorted documents only, as given by conjunctive_documents,
+        same as scoring every document holding any word would give them.
+        Postings of each word are looked up for the documents, impacts are
+        added for the top k of them
+        """
+        if self.impact_index is not None:
+            mask = np.zeros(self.impact_index.documents_number, dtype=bool)
+            mask[documents] = True
+            return self.compute_documents_scores_impacts(query_words, k, mask)
+
+        self.refresh_idfs()
+        index = self.memory_index
+        scores = np.zeros(len(documents), dtype=np.float64)
+        for word in query_words:
+            if self.field_index is not None:
+                postings = self.word_fields_postings(word)
+                if len(postings) > 0:
+                    scores += self.fields_scores(word, documents, postings)
+                continue
+            term = index.words.get(word, None)
+            if term is None:
+                continue
+            doc_ids, frequencies = index.postings(word)
+            positions, found = find_postings(doc_ids, documents)
+            scores[found] += self.postings_scores(
+                self.memory_idfs[term], frequencies[positions], index.doc_lengths[documents[found]])
+        return {index.doc_keys[i]: score for i, score in zip(documents.tolist(), scores.tolist())}
+
+    def phrases_documents(self, phrases: list[tuple[list[str], int]], mask: np.ndarray | None = None) -> np.ndarray:
+        """
+        Doc ids of position_index documents holding every phrase, among the
+        ones set in mask if given
+        """
+        documents = np.flatnonzero(mask) if mask is not None else None
+        for words, slop in phrases:
+            documents = self.position_index.phrase_documents(
+                words, slop, documents)
+        return documents
+
+    def filter_phrases(self, docs_scores: dict[tuple[str, int], float], phrases: list[tuple[list[str], int]]) -> dict[tuple[str, int], float]:
+        """
+        Keeps scored documents holding every phrase, looked up in positions
+        when available, otherwise documents are read and parsed again
+        """
+        if self.position_index is not None:
+            matches = set(self.position_index.doc_keys[i]
+                          for i in self.phrases_documents(phrases).tolist())
+            return {doc: score for doc, score in docs_scores.items() if doc in matches}
+
+        new_docs_scores: dict[tuple[str, int], float] = {}
+        for doc, score in docs_scores.items():
+            d = self.indexer.document_store.get(doc[0], doc[1])
+            if d is None:
+                continue
+            words = self.indexer.parser.parse_text_to_words(d.metadata.text)
+            if all(words_hold_phrase(words, phrase, slop) for phrase, slop in phrases):
+                new_docs_scores[doc] = score
+        return new_docs_scores
 
     def get_collection_documents(self, indexes: list[tuple[tuple[str, int], int]]) -> list[Document]:
         """
-        Reads collection
-        Can be improved by ready chunks, and indexing using matched indexes
+        Reads matched documents from the document store, one record each
 
         list holds: tuple[tuple[collection_name, index], score]
 
         We need to preserve the order coming from list
         """
-        LOGGER.info("Loading documents from disk...")
-        # build list of collections name
-        collection_names_indexes: list[str] = []
-        for idx in indexes:
-            collection_name = idx[0][0]
+        LOGGER.info("Loading documents from store...")
+        documents: list[Document] = [self.indexer.document_store.get(
+            collection_name, index) for (collection_name, index), _ in indexes]
+        LOGGER.ok("Documents loaded from store")
+        return documents
+
+    def snippets(self, query_words: list[str], documents: list[tuple[tuple[str, int], Document]]) -> list[dict]:
+        """
+        Best matching part of the text of each document and characters of
+        the query words within it, see make_snippet. Documents are given
+        along with their (collection_name, index), as results are. Words of
+        a document and their characters are read from positions, that must
+        be loaded
+        """
+        if self.position_index is None:
+            raise Exception("snippets are read from positions, none loaded")
+        words = list(dict.fromkeys(query_words))
+        snippets: list[dict] = []
+        for key, doc in documents:
+            doc_id = self.position_index.keys[key]
+            positions, indexes = self.position_index.document_positions(
+                doc_id, words)
+            snippets.append(make_snippet(
+                doc.metadata.text, self.position_index.word_offsets(doc_id), positions, indexes))
+        return snippets
 
-            if collection_name in collection_names_indexes:
+    def expand_words(self, query_words: list[str]) -> list[str]:
+        """
+        Query words, each missing from the lexicon replaced by its nearest
+        word of the lexicon, the most frequent one at the same distance, so
+        that "eldn ring" matches "elden ring". Words ingested by the
+        segmented index are kept as typed
+        """
+        if self.spelling_index is None:
+            return query_words
+        segments = self.segmented_index.snapshot()[
+            0] if self.segmented_index is not None else []
+        expanded: list[str] = []
+        for word in query_words:
+            if any(word in live.segment.words for live in segments):
+                expanded.append(word)
                 continue
-            collection_names_indexes.append(collection_name)
-
-        # now load one collection at a time and build list
-        documents: list[Document] = [None for _ in indexes]
-        # insert
-        for coll_name in collection_names_indexes:
-            collection: list[Document] = self.indexer.read_collection_by_name(
-                coll_name)
-
-            # we should index only matched document with its respective collection
-            for i, indx in enumerate(indexes):
-                if indx[0][0] == coll_name and indx[0][1] < len(collection):
-                    documents[i] = collection[indx[0][1]]
-        LOGGER.ok("Documents loaded from disk")
-        return documents
+            correction = self.spelling_index.correction(word)
+            if correction is not None:
+                LOGGER.info(f"Correcting {word} to {correction}")
+                word = correction
+            expanded.append(word)
+        return expanded
 
-    def query_sources_documents(self, query_words: list[str], number_returned_documents: int, platform: str, category: str, status: str, tags: list[str]) -> list[Document]:
+    def generation(self) -> str | int:
         """
-        Calculates matches and return best matched documents
+        Identifies the index queries are served from, changes whenever results may
+        """
+        if self.segmented_index is not None:
+            return self.segmented_index.generation
+        return self.indexer.collection_hash
+
+    def query_sources_documents(self, query_words: list[str], number_returned_documents: int, platform: str, category: str, status: str, tags: list[str], phrases: list[tuple[list[str], int]] | None = None, conjunctive: bool = False) -> list[tuple[tuple[str, int], Document]]:
+        """
+        Returns best matched documents along with their (collection_name,
+        index), from the query cache when the same query words, filters,
+        phrases, mode and number of documents were asked for already.
+        Documents must hold each of phrases, given as (words, slop), and
+        every query word when conjunctive as long as enough documents do,
+        see rank_documents
+        """
+        platform, category, status, tags = self.normalize_filters(
+            platform, category, status, tags)
+        phrases = self.normalize_phrases(phrases)
+        key = self.query_key(query_words, number_returned_documents,
+                             platform, category, status, tags, phrases, conjunctive)
+
+        # read before computing, so results of a newer index are dropped, never kept stale
+        generation = self.generation()
+        documents = self.query_cache.get(key, generation)
+        if documents is not None:
+            LOGGER.ok(f"Query served from cache: {len(documents)} documents")
+            return list(documents)
+
+        documents = self.compute_query_sources_documents(
+            query_words, number_returned_documents, platform, category, status, tags, phrases, conjunctive)
+        self.query_cache.put(key, generation, documents)
+        return list(documents)
+
+    def query_page_sources_documents(self, query_words: list[str], page_size: int, platform: str, category: str, status: str, tags: list[str], phrases: list[tuple[list[str], int]] | None = None, conjunctive: bool = False, cursor: str | None = None) -> tuple[list[tuple[tuple[str, int], Document]], str | None] | None:
+        """
+        Returns a page of best matched documents, along with their
+        (collection_name, index), and the cursor of the next page, None when
+        there are no more. Without cursor the first page is returned,
+        otherwise the query is the one the cursor was made for and given
+        query words and filters are ignored.
+
+        The first page ranks cursor_depth documents, kept server side under
+        a ranking id, so that next pages are a slice of them. Scrolling past
+        them ranks the query again twice as deep. When conjunctive, whether
+        enough documents hold every word is decided on the first page size,
+        as query_sources_documents does on its number of documents, so that
+        the first page is the same as the best page_size documents.
+
+        Returns None if the cursor is invalid, expired or the index changed.
+        """
+        generation = self.generation()
+        if cursor is None:
+            query = (query_words, *self.normalize_filters(platform,
+                     category, status, tags), self.normalize_phrases(phrases), conjunctive, page_size)
+            ranking_id = secrets.token_urlsafe(12)
+            offset = 0
+            depth = max(self.cursor_depth, page_size)
+            ranked = self.rank_documents(query[0], depth, *query[1:])
+        else:
+            try:
+                ranking_id, offset = base64.urlsafe_b64decode(
+                    cursor.encode("ascii")).decode("ascii").split(":")
+                offset = int(offset)
+            except Exception as _:
+                return None
+            if offset < 0:
+                return None
+            entry = self.cursors.get(ranking_id, generation)
+            if entry is None:
+                return None
+            query, ranked, depth = entry
+
+        end = offset + page_size
+        if end > len(ranked) and len(ranked) == depth:
+            depth = max(2 * depth, end)
+            ranked = self.rank_documents(query[0], depth, *query[1:])
+        self.cursors.put(ranking_id, generation, (query, ranked, depth))
+
+        # a full ranking may have more documents past it
+        next_cursor = None
+        if end < len(ranked) or (end == len(ranked) == depth):
+            next_cursor = base64.urlsafe_b64encode(
+                f"{ranking_id}:{end}".encode("ascii")).decode("ascii")
+        page = ranked[offset:end]
+        return list(zip((key for key, _ in page), self.get_collection_documents(page))), next_cursor
+
+    def query_batch_sources_documents(self, queries: list[tuple[list[str], int, str, str, str, list[str], list[tuple[list[str], int]], bool]]) -> list[list[tuple[tuple[str, int], Document]]]:
+        """
+        Same as query_sources_documents for many queries at once, each given
+        as (query_words, number_returned_documents, platform, category,
+        status, tags, phrases, conjunctive). We do:
+
+        - answer repeated queries and cached ones once
+        - score every word once for all queries, where documents are scored
+          exhaustively (db and memory without pruning)
+        - hydrate the union of the matched documents once
+        """
+        generation = self.generation()
+        # key -> normalized query, in order of first appearance
+        keys: list[tuple] = []
+        normalized: dict[tuple, tuple] = {}
+        for query_words, number_returned_documents, platform, category, status, tags, phrases, conjunctive in queries:
+            platform, category, status, tags = self.normalize_filters(
+                platform, category, status, tags)
+            phrases = self.normalize_phrases(phrases)
+            key = self.query_key(query_words, number_returned_documents,
+                                 platform, category, status, tags, phrases, conjunctive)
+            keys.append(key)
+            normalized.setdefault(
+                key, (query_words, number_returned_documents, platform, category, status, tags, phrases, conjunctive))
+
+        results: dict[tuple, list[tuple[tuple[str, int], Document]]] = {}
+        matches: dict[tuple, list[tuple[tuple[str, int], float]]] = {}
+        words_scores: dict = {}
+        for key, query in normalized.items():
+            documents = self.query_cache.get(key, generation)
+            if documents is not None:
+                results[key] = documents
+                continue
+            matches[key] = self.rank_documents(*query, words_scores=words_scores)
+
+        # hydrate each matched document once
+        union = list({doc: score for key_matches in matches.values()
+                     for doc, score in key_matches}.items())
+        documents_by_key = dict(zip((doc for doc, _ in union),
+                                self.get_collection_documents(union)))
+        for key, key_matches in matches.items():
+            results[key] = [(doc, documents_by_key[doc])
+                            for doc, _ in key_matches]
+            self.query_cache.put(key, generation, results[key])
+        LOGGER.ok(
+            f"Batch of {len(queries)} queries computed: {len(matches)} scored, {len(union)} documents loaded")
+        return [list(results[key]) for key in keys]
+
+    def normalize_filters(self, platform: str, category: str, status: str, tags: list[str]) -> tuple[str | None, str | None, str | None, list[str]]:
+        """
+        Filters are matched lowercase, tags in any order, as attributes of
+        documents are stored (see Indexer.document_attributes)
+        """
+        return (platform.lower() if platform else None,
+                category.lower() if category else None,
+                status.lower() if status else None,
+                sorted({tag.lower() for tag in tags or []}))
+
+    def normalize_phrases(self, phrases: list[tuple[list[str], int]] | None) -> list[tuple[list[str], int]]:
+        """
+        Phrases are matched in any order, once each
+        """
+        return [(list(words), slop) for words, slop in sorted({(tuple(words), slop) for words, slop in phrases or []})]
+
+    def query_key(self, query_words: list[str], number_returned_documents: int, platform: str, category: str, status: str, tags: list[str], phrases: list[tuple[list[str], int]], conjunctive: bool = False) -> tuple:
+        """
+        Query cache key of normalized filters and phrases, words order doesn't change scores
+        """
+        return (tuple(sorted(Counter(query_words).items())),
+                platform, category, status, tuple(tags),
+                tuple((tuple(words), slop) for words, slop in phrases), conjunctive, number_returned_documents)
+
+    def compute_query_sources_documents(self, query_words: list[str], number_returned_documents: int, platform: str, category: str, status: str, tags: list[str], phrases: list[tuple[list[str], int]] | None = None, conjunctive: bool = False) -> list[tuple[tuple[str, int], Document]]:
+        """
+        Returns best matched documents, loaded from the document store,
+        along with their (collection_name, index)
+        """
+        ranked = self.rank_documents(
+            query_words, number_returned_documents, platform, category, status, tags, phrases, conjunctive)
+        return list(zip((key for key, _ in ranked), self.get_collection_documents(ranked)))
+
+    def rank_documents(self, query_words: list[str], number_returned_documents: int, platform: str, category: str, status: str, tags: list[str], phrases: list[tuple[list[str], int]] | None = None, conjunctive: bool = False, conjunctive_minimum: int | None = None, words_scores: dict | None = None) -> list[tuple[tuple[str, int], float]]:
+        """
+        Calculates matches and return best matched documents keys and scores
 
         Given that we have query words as inputs and that the iteration
         has to move for a document over all query words but we have an inverted
@@ -84,25 +1024,93 @@ class BM25():
         - Each document score we add it to the dictionary, new entry we set old entry we add
         - At the end all documents that have query words have been fetched and scored
         - We keep top x results
+
+        When conjunctive, only documents holding every query word are scored
+        if at least conjunctive_minimum of them do (number_returned_documents
+        if not given), otherwise documents holding any of them are. Serving
+        from arrays with filters and phrases applied while scoring, posting
+        lists are intersected before scoring. Otherwise documents holding
+        every word are kept once filters and phrases are applied, counted
+        while scoring when serving from db or segments
         """
+        # filters are normalized once here, the db, bitmaps and document
+        # store compare them as they are
+        platform, category, status, tags = self.normalize_filters(
+            platform, category, status, tags)
+
         # compute documents score
         # dictionary is (collection_name, index) -> score
         LOGGER.info("Computing words scores...")
 
-        # dict is (collection name, index -> score)
-        docs_scores: dict[tuple[str, int], int] = {}
-        for word in query_words:
-            documents: list[DocumentInfoDTO] = self.indexer.get_documents_for_word(
-                word)
-
-            for doc in documents:
-                score = self.word_score(
-                    word, doc.word_frequency_within_document, doc.words_length)
-                key = (doc.collection_name, doc.index)
-                if key in docs_scores:
-                    docs_scores[key] += score
+        # filters and phrases are applied while scoring when bitmaps and
+        # positions are available
+        phrases = phrases or []
+        filtered = False
+        phrased = len(phrases) == 0
+        conjunctive_documents = None
+        minimum = conjunctive_minimum if conjunctive_minimum is not None else number_returned_documents
+        # documents holding every word, kept once filters and phrases are
+        # applied when they can't be before scoring
+        every_word = None
+        if self.segmented_index is None and (self.impact_index is not None or self.memory_index is not None):
+            filtered = self.facet_index is not None
+            mask = self.facet_index.mask(
+                platform, category, status, tags) if filtered else None
+            if not phrased and self.position_index is not None:
+                phrase_mask = np.zeros(
+                    self.position_index.documents_number, dtype=bool)
+                phrase_mask[self.phrases_documents(phrases, mask)] = True
+                mask = phrase_mask
+                phrased = True
+            # the top k can't be picked before filters are applied
+            can_prune = (filtered or not (platform or category or status or tags)) and phrased
+
+            if conjunctive and can_prune and number_returned_documents > 0:
+                documents = self.conjunctive_documents(query_words, mask)
+                if len(documents) >= minimum:
+                    LOGGER.ok(
+                        f"Scoring {len(documents)} documents holding every word")
+                    conjunctive_documents = documents
                 else:
-                    docs_scores[key] = score
+                    LOGGER.info(
+                        f"Only {len(documents)} documents hold every word, scoring documents holding any")
+            elif conjunctive and number_returned_documents > 0:
+                doc_keys = (self.impact_index or self.memory_index).doc_keys
+                every_word = set(doc_keys[i] for i in self.conjunctive_documents(
+                    query_words, mask).tolist())
+
+        if conjunctive_documents is not None:
+            docs_scores = self.compute_documents_scores_conjunctive(
+                query_words, conjunctive_documents, number_returned_documents)
+        elif self.segmented_index is not None:
+            words_counts = {} if conjunctive else None
+            docs_scores = self.compute_documents_scores_segmented(
+                query_words, words_counts)
+            if conjunctive:
+                every_word = self.holding_every_word(query_words, words_counts)
+        elif self.impact_index is not None:
+            docs_scores = self.compute_documents_scores_impacts(
+                query_words, number_returned_documents if can_prune and number_returned_documents > 0 else None, mask)
+        elif self.field_index is not None:
+            if self.dynamic_pruning and can_prune and number_returned_documents > 0:
+                docs_scores = self.compute_documents_scores_fields_pruned(
+                    query_words, number_returned_documents, mask)
+            else:
+                docs_scores = self.compute_documents_scores_fields(
+                    query_words, mask, words_scores)
+        elif self.memory_index is not None:
+            if self.dynamic_pruning and can_prune and number_returned_documents > 0:
+                docs_scores = self.compute_documents_scores_pruned(
+                    query_words, number_returned_documents, mask)
+            else:
+                docs_scores = self.compute_documents_scores_in_memory(
+                    query_words, mask, words_scores)
+        else:
+            words_counts = {} if conjunctive else None
+            docs_scores = self.compute_documents_scores(
+                query_words, words_scores, words_counts)
+            if conjunctive:
+                every_word = self.holding_every_word(query_words, words_counts)
 
         if len(docs_scores) == 0:
             LOGGER.warn("No documents scores")
@@ -113,38 +1121,31 @@ class BM25():
         LOGGER.ok(f"Getting best {number_returned_documents} matches...")
         LOGGER.ok(f"With filters: {platform}, {category}, {status}, {tags}")
 
-        docs_scores = self.indexer.filter_documents(
-            docs_scores, platform, category, status, tags)
+        if not phrased:
+            docs_scores = self.filter_phrases(docs_scores, phrases)
+        # the db doesn't hold documents ingested by the segmented index
+        if self.segmented_index is not None:
+            docs_scores = self.indexer.filter_documents_in_store(
+                docs_scores, platform, category, status, tags)
+        elif not filtered:
+            docs_scores = self.indexer.filter_documents(
+                docs_scores, platform, category, status, tags)
 
-        matches: list[tuple[tuple[str, int], int]] = []
-        for doc, score in docs_scores.items():
-            if len(matches) == 0:
-                matches.append((doc, score))
-                continue
+        if every_word is not None and number_returned_documents > 0:
+            documents = {doc: score for doc, score in docs_scores.items()
+                         if doc in every_word}
+            if len(documents) >= minimum:
+                LOGGER.ok(
+                    f"Keeping {len(documents)} documents holding every word")
+                docs_scores = documents
+            else:
+                LOGGER.info(
+                    f"Only {len(documents)} documents hold every word, keeping documents holding any")
 
-            for i in range(len(matches)):
-                if matches[i][1] > score:
-                    # append and break if it is the last and not yet at capacity
-                    if len(matches) - 1 == i and len(matches) < number_returned_documents:
-                        matches.append((doc, score))
-                        break
-                    continue
-
-                # otherwise slide array
-                tmp = matches[i]
-                matches[i] = (doc, score)
-
-                for j in range(i + 1, len(matches)):
-                    next_tmp = matches[j]
-                    matches[j] = tmp
-                    tmp = next_tmp
-
-                # if not max capacity append
-                if len(matches) < number_returned_documents:
-                    matches.append(tmp)
-                break
+        # ties keep scoring order
+        matches: list[tuple[tuple[str, int], float]] = heapq.nlargest(
+            number_returned_documents, docs_scores.items(), key=lambda match: match[1])
 
-        # return best from disk given collection name and index
         LOGGER.ok(
             f"Query Matches Computed, documents matched: {len(matches)} / {number_returned_documents}")
-        return self.get_collection_documents(matches)
+        return matches
@@ -0,0 +1,267 @@
+from collections import Counter, OrderedDict
+import threading
+import time
+from typing import Any, Hashable
+
+import numpy as np
+
+from utils.logger import LOGGER
+
+
+class QueryCache():
+    """
+    LRU of query results, entries expire ttl seconds after being stored.
+
+    Entries belong to an index generation: when the generation a lookup is
+    made for differs from the one entries were stored for, all of them are
+    dropped, so that results never outlive the index they were computed on.
+    """
+    max_size: int
+    ttl: float
+
+    generation: Hashable | None = None
+    # key -> (stored at, value), least recently used first
+    entries: OrderedDict
+
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, max_size: int, ttl: float = 0):
+        """
+        max_size 0 disables the cache, ttl 0 keeps entries until evicted
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def switch_generation(self, generation: Hashable):
+        """
+        Drops entries of another index generation, lock must be held
+        """
+        if generation != self.generation:
+            if len(self.entries) > 0:
+                LOGGER.info(
+                    f"Index generation changed, dropping {len(self.entries)} cached queries")
+            self.entries.clear()
+            self.generation = generation
+
+    def get(self, key: Hashable, generation: Hashable) -> Any | None:
+        """
+        Returns value stored for key, None if missing or expired
+        """
+        if self.max_size <= 0:
+            return None
+        with self.lock:
+            self.switch_generation(generation)
+            entry = self.entries.get(key, None)
+            if entry is not None and self.ttl > 0 and time.monotonic() - entry[0] > self.ttl:
+                del self.entries[key]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, generation: Hashable, value: Any):
+        """
+        Stores value for key, evicting least recently used entries over max_size.
+        Entries of another generation are dropped, a value stored for an older
+        one is dropped in turn by the next lookup
+        """
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.switch_generation(generation)
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "ttl": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+
+class PostingsCache():
+    """
+    Posting lists read from the db, held as arrays and bounded in bytes.
+
+    Eviction is frequency aware: lookups of each word are counted, whether
+    cached or not, and the least looked up words are evicted first, least
+    recently used first among ties. A word is not cached if it would evict
+    words looked up more often, so that a burst of rare words doesn't flush
+    the head of the lexicon. Counts are halved every AGING_LOOKUPS lookups,
+    so that words no more asked for end up evicted.
+    """
+    AGING_LOOKUPS: int = 10000
+
+    max_bytes: int
+    size_bytes: int = 0
+    # word -> (weight, value), least recently used first
+    entries: OrderedDict
+    # word -> lookups, halved over time
+    lookups: Counter
+    total_lookups: int = 0
+
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, max_bytes: int):
+        """
+        max_bytes 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lookups = Counter()
+        self.lock = threading.Lock()
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.lookups.clear()
+            self.size_bytes = 0
+
+    def get(self, key: Hashable) -> Any | None:
+        """
+        Returns value stored for key, None if missing
+        """
+        if self.max_bytes <= 0:
+            return None
+        with self.lock:
+            self.lookups[key] += 1
+            self.total_lookups += 1
+            if self.total_lookups % self.AGING_LOOKUPS == 0:
+                self.lookups = Counter({k: n // 2 for k, n in self.lookups.items() if n > 1})
+
+            entry = self.entries.get(key, None)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: Hashable, value: tuple[np.ndarray, ...]):
+        """
+        Stores arrays of key, weighted by their bytes, unless it would evict
+        more frequently looked up keys
+        """
+        if self.max_bytes <= 0:
+            return
+        weight = sum(array.nbytes for array in value)
+        with self.lock:
+            if key in self.entries or weight > self.max_bytes:
+                return
+
+            victims: list[Hashable] = []
+            freed = 0
+            if self.size_bytes + weight > self.max_bytes:
+                # stable sort keeps recency order among same counts
+                frequency = self.lookups[key]
+                for victim in sorted(self.entries, key=lambda k: self.lookups[k]):
+                    if self.lookups[victim] > frequency:
+                        return
+                    victims.append(victim)
+                    freed += self.entries[victim][0]
+                    if self.size_bytes - freed + weight <= self.max_bytes:
+                        break
+
+            for victim in victims:
+                del self.entries[victim]
+            self.size_bytes += weight - freed
+            self.entries[key] = (weight, value)
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            }
+
+
+class DocumentCache():
+    """
+    LRU of parsed documents bounded in bytes, each weighted by the size of
+    its JSON record.
+
+    Entries are stored along with the generation of the file they were read
+    from, a lookup for another generation drops them.
+    """
+    max_bytes: int
+    size_bytes: int = 0
+    # key -> (generation, weight, value), least recently used first
+    entries: OrderedDict
+
+    hits: int = 0
+    misses: int = 0
+
+    def __init__(self, max_bytes: int):
+        """
+        max_bytes 0 disables the cache
+        """
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key: Hashable, generation: Hashable) -> Any | None:
+        """
+        Returns value stored for key, None if missing or of another generation
+        """
+        if self.max_bytes <= 0:
+            return None
+        with self.lock:
+            entry = self.entries.get(key, None)
+            if entry is not None and entry[0] != generation:
+                del self.entries[key]
+                self.size_bytes -= entry[1]
+                entry = None
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry[2]
+
+    def put(self, key: Hashable, generation: Hashable, weight: int, value: Any):
+        """
+        Stores value for key, evicting least recently used entries over max_bytes
+        """
+        if self.max_bytes <= 0 or weight > self.max_bytes:
+            return
+        with self.lock:
+            previous = self.entries.pop(key, None)
+            if previous is not None:
+                self.size_bytes -= previous[1]
+            self.entries[key] = (generation, weight, value)
+            self.size_bytes += weight
+            while self.size_bytes > self.max_bytes:
+                _, (_, evicted, _) = self.entries.popitem(last=False)
+                self.size_bytes -= evicted
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.entries),
+                "bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups > 0 else 0.0,
+            }
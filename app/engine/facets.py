@@ -0,0 +1,89 @@
+from pathlib import Path
+
+import numpy as np
+from duckdb import DuckDBPyConnection
+
+from app.engine.arrays import save_arrays
+from utils.logger import LOGGER
+
+
+class FacetIndex():
+    """
+    Bitmap of the documents holding each filter value (platform, category,
+    status and tag), so that filters are a few word-wide ANDs.
+
+    Bits follow the dense document ids of MemoryIndex (documents ordered by
+    document_id), packed into rows of u64 words, one row per value.
+    """
+    FACETS: list[str] = ["platform", "category", "status", "tag"]
+
+    collection_hash: str
+    documents_number: int
+    # (facet, value) -> row of bitmaps
+    values: dict[tuple[str, str], int]
+    bitmaps: np.ndarray
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Loading facets {path}...")
+        with np.load(path) as data:
+            self.collection_hash = str(data["collection_hash"])
+            self.documents_number = int(data["documents_number"])
+            self.values = {tuple(key.split("\t", 1)): row for row,
+                           key in enumerate(data["keys"].tolist())}
+            self.bitmaps = data["bitmaps"]
+        LOGGER.ok(f"Facets loaded: {len(self.values)} values")
+
+    @classmethod
+    def build(cls, con: DuckDBPyConnection, path: Path, collection_hash: str):
+        """
+        Writes bitmaps of every filter value of the documents tables
+        """
+        LOGGER.info(f"Writing facets {path}...")
+        document_ids = con.execute(
+            "SELECT document_id FROM documents ORDER BY document_id").fetchnumpy()["document_id"].astype(np.int64)
+        words = (len(document_ids) + 63) // 64
+
+        # facet value -> dense document ids holding it
+        rows = {
+            "platform": con.execute("SELECT document_id, platform FROM document_platforms").fetchall(),
+            "category": con.execute("SELECT document_id, category FROM documents WHERE category IS NOT NULL").fetchall(),
+            "status": con.execute("SELECT document_id, status FROM documents WHERE status IS NOT NULL").fetchall(),
+            "tag": con.execute("SELECT document_id, tag FROM document_tags").fetchall(),
+        }
+        keys: list[str] = []
+        bitmaps: list[np.ndarray] = []
+        for facet in cls.FACETS:
+            documents: dict[str, list[int]] = {}
+            for document_id, value in rows[facet]:
+                documents.setdefault(value, []).append(document_id)
+            for value, ids in sorted(documents.items()):
+                bits = np.zeros(words * 64, dtype=bool)
+                bits[np.searchsorted(document_ids, np.array(ids, dtype=np.int64))] = True
+                keys.append(f"{facet}\t{value}")
+                bitmaps.append(np.packbits(bits, bitorder="little").view("<u8"))
+
+        save_arrays(path, collection_hash,
+                    documents_number=np.array(len(document_ids)),
+                    keys=np.array(keys, dtype=str),
+                    bitmaps=np.array(bitmaps, dtype="<u8").reshape(len(keys), words))
+        LOGGER.ok(f"Facets written: {len(keys)} values")
+
+    def mask(self, platform: str, category: str, status: str, tags: list[str]) -> np.ndarray | None:
+        """
+        Returns whether each document matches all filters, None without
+        filters. Filters are normalized (see BM25.normalize_filters)
+        """
+        filters = [(facet, value) for facet, value in [
+            ("platform", platform), ("category", category), ("status", status)] if value]
+        filters.extend(("tag", tag) for tag in tags or [])
+        if len(filters) == 0:
+            return None
+
+        words = np.full(self.bitmaps.shape[1], np.uint64(0xFFFFFFFFFFFFFFFF))
+        for key in filters:
+            row = self.values.get(key, None)
+            if row is None:
+                # value no document holds
+                return np.zeros(self.documents_number, dtype=bool)
+            words &= self.bitmaps[row]
+        return np.unpackbits(words.view(np.uint8), count=self.documents_number, bitorder="little").astype(bool)
@@ -0,0 +1,119 @@
+from pathlib import Path
+
+import numpy as np
+from duckdb import DuckDBPyConnection
+
+from app.engine.arrays import save_arrays
+from utils.logger import LOGGER
+
+
+class FieldIndex():
+    """
+    Postings of the short fields of documents (title, tags with genres and
+    author) indexed on their own, so that BM25F can weigh words of a title
+    above words of the body text. The body is the inverted index itself.
+
+    Postings are stored CSR style per field, over a vocabulary shared by
+    all fields. For field f and term t:
+    - doc_ids[f][offsets[f][t]:offsets[f][t + 1]] are the documents holding it
+    - frequencies[f][...] are the word frequencies within the field
+
+    Doc ids are the dense ids of MemoryIndex (documents ordered by document_id).
+    """
+    FIELDS: list[str] = ["title", "tags", "author"]
+
+    collection_hash: str
+    documents_number: int
+    # word -> term id
+    words: dict[str, int]
+    # documents holding each term in any field, body included
+    document_frequencies: np.ndarray
+
+    # field -> postings, words length of each document and its average
+    offsets: dict[str, np.ndarray]
+    doc_ids: dict[str, np.ndarray]
+    frequencies: dict[str, np.ndarray]
+    doc_lengths: dict[str, np.ndarray]
+    average_lengths: dict[str, float]
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Loading fields {path}...")
+        with np.load(path) as data:
+            self.collection_hash = str(data["collection_hash"])
+            self.documents_number = int(data["documents_number"])
+            self.words = {word: term for term,
+                          word in enumerate(data["words"].tolist())}
+            self.document_frequencies = data["document_frequencies"]
+            self.offsets = {f: data[f"{f}_offsets"] for f in self.FIELDS}
+            self.doc_ids = {f: data[f"{f}_doc_ids"] for f in self.FIELDS}
+            self.frequencies = {f: data[f"{f}_frequencies"]
+                                for f in self.FIELDS}
+            self.doc_lengths = {f: data[f"{f}_doc_lengths"]
+                                for f in self.FIELDS}
+        self.average_lengths = {f: float(lengths.mean()) if len(lengths) > 0 else 0.0
+                                for f, lengths in self.doc_lengths.items()}
+        LOGGER.ok(
+            f"Fields loaded: {len(self.words)} words, {sum(len(ids) for ids in self.doc_ids.values())} postings")
+
+    @classmethod
+    def build(cls, con: DuckDBPyConnection, path: Path, collection_hash: str):
+        """
+        Writes postings of every field of the field_postings table
+        """
+        LOGGER.info(f"Writing fields {path}...")
+        document_ids = con.execute(
+            "SELECT document_id FROM documents ORDER BY document_id").fetchnumpy()["document_id"].astype(np.int64)
+        rows = con.execute(
+            "SELECT field, word, document_id, frequency FROM field_postings").fetchnumpy()
+        words, terms = np.unique(rows["word"].astype(str), return_inverse=True)
+        doc_ids = np.searchsorted(
+            document_ids, rows["document_id"].astype(np.int64))
+        frequencies = rows["frequency"].astype(np.int32)
+
+        # a word counts once per document, whatever the fields holding it
+        document_frequencies = dict(con.execute("""
+SELECT word, COUNT(DISTINCT document_id)
+FROM (
+	SELECT word, document_id FROM field_postings
+	UNION ALL
+	SELECT l.word, p.document_id
+	FROM postings p
+	JOIN lexicon l ON l.word_id = p.lexicon_id
+	WHERE l.word IN (SELECT word FROM field_postings)
+)
+GROUP BY word
+""").fetchall())
+
+        arrays = {
+            "documents_number": np.array(len(document_ids)),
+            "words": words,
+            "document_frequencies": np.array([document_frequencies[w] for w in words.tolist()], dtype=np.int64),
+        }
+        fields = rows["field"].astype(str)
+        for field in cls.FIELDS:
+            inside = fields == field
+            field_terms, field_doc_ids = terms[inside], doc_ids[inside]
+            order = np.lexsort((field_doc_ids, field_terms))
+            offsets = np.zeros(len(words) + 1, dtype=np.int64)
+            np.cumsum(np.bincount(field_terms, minlength=len(words)),
+                      out=offsets[1:])
+            arrays[f"{field}_offsets"] = offsets
+            arrays[f"{field}_doc_ids"] = field_doc_ids[order].astype(np.int32)
+            arrays[f"{field}_frequencies"] = frequencies[inside][order]
+            arrays[f"{field}_doc_lengths"] = np.bincount(
+                field_doc_ids, weights=frequencies[inside], minlength=len(document_ids))
+
+        save_arrays(path, collection_hash, **arrays)
+        LOGGER.ok(f"Fields written: {len(words)} words, {len(terms)} postings")
+
+    def postings(self, field: str, word: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Returns (doc_ids, frequencies) of word within field, None if no document holds it there
+        """
+        term = self.words.get(word, None)
+        if term is None:
+            return None
+        start, end = self.offsets[field][term], self.offsets[field][term + 1]
+        if start == end:
+            return None
+        return self.doc_ids[field][start:end], self.frequencies[field][start:end]
@@ -0,0 +1,118 @@
+from pathlib import Path
+import struct
+
+import numpy as np
+
+from app.engine.memory import MemoryIndex
+from app.engine.sections import SectionedFile, doc_keys_sections, read_header, write_sections
+from utils.logger import LOGGER
+
+
+# magic, version, impact bits, terms, documents, postings, scale, collection hash
+HEADER = struct.Struct("<8sIIIIQd64s")
+MAGIC = b"SGIMPACT"
+VERSION = 1
+# sections stored after the header, each with u64 start and end offsets
+SECTIONS = [
+    "words",
+    "collections",
+    "doc_collections",
+    "doc_indexes",
+    "posting_offsets",
+    "doc_ids",
+    "impacts",
+]
+IMPACT_DTYPES = {8: "<u1", 16: "<u2"}
+
+
+def write_impacts(path: Path, index: MemoryIndex, scores: np.ndarray, bits: int, collection_hash: str):
+    """
+    Writes the index with quantized scores in place of frequencies:
+
+    - the score of each posting is mapped linearly to 1..2^bits - 1, the
+      highest score of the index being the top value
+    - postings of each word are ordered by impact, highest first, then by doc id
+    - documents keys are stored as in segments
+    """
+    LOGGER.info(f"Writing {bits} bits impacts {path}...")
+    top = (1 << bits) - 1
+    scale = float(scores.max()) / top if len(scores) > 0 else 1.0
+    impacts = np.clip(np.rint(scores / scale), 1, top).astype(np.int64)
+
+    # order within each word by impact descending, then doc id
+    terms, doc_ids, _ = index.all_postings()
+    order = np.lexsort((doc_ids, -impacts, terms))
+
+    words = sorted(index.words, key=index.words.get)
+
+    sections = {
+        "words": "\n".join(words).encode("utf-8"),
+        **doc_keys_sections(index.doc_keys),
+        "posting_offsets": index.term_offsets.astype("<u8").tobytes(),
+        "doc_ids": doc_ids[order].astype("<u4").tobytes(),
+        "impacts": impacts[order].astype(IMPACT_DTYPES[bits]).tobytes(),
+    }
+
+    size = write_sections(path, HEADER.pack(MAGIC, VERSION, bits, len(words), index.documents_number,
+                          len(doc_ids), scale, collection_hash.encode("ascii")), SECTIONS, sections)
+    LOGGER.ok(
+        f"Impacts written: {size} bytes, {len(doc_ids)} postings")
+
+
+def read_impacts_header(path: Path) -> tuple[int, str] | None:
+    """
+    Returns impact bits and collection hash impacts were written for, None if there are no valid impacts
+    """
+    header = read_header(path, HEADER, MAGIC, VERSION)
+    if header is None:
+        return None
+    _, _, bits, _, _, _, _, collection_hash = header
+    return bits, collection_hash.decode("ascii")
+
+
+class ImpactIndex(SectionedFile):
+    """
+    Read only view over an impacts file mapped in memory. Postings hold
+    integer impacts, score of a document is the sum of its impacts times
+    scale, so no BM25 formula runs at query time.
+    """
+    HEADER = HEADER
+    MAGIC = MAGIC
+    VERSION = VERSION
+    SECTIONS = SECTIONS
+    KIND = "an impacts file"
+
+    bits: int
+    scale: float
+    collection_hash: str
+
+    words: dict[str, int]
+    doc_keys: list[tuple[str, int]]
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Mapping impacts {path}...")
+        super().__init__(path)
+        _, _, self.bits, n_terms, n_documents, _, self.scale, collection_hash = self.header
+        self.collection_hash = collection_hash.decode("ascii")
+        self.words = self.section_words(n_terms)
+
+        self.posting_offsets = self.section_array("posting_offsets", "<u8")
+        self.doc_ids = self.section_array("doc_ids", "<u4")
+        self.impacts = self.section_array("impacts", IMPACT_DTYPES[self.bits])
+
+        self.doc_keys = self.section_doc_keys(n_documents)
+        LOGGER.ok(f"Impacts mapped: {n_terms} words, {n_documents} documents")
+
+    @property
+    def documents_number(self) -> int:
+        return len(self.doc_keys)
+
+    def postings(self, word: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Returns (doc_ids, impacts) of word ordered by impact, None if word is not in the lexicon
+        """
+        term = self.words.get(word, None)
+        if term is None:
+            return None
+        start, end = self.posting_offsets[term:term + 2]
+        return self.doc_ids[start:end], self.impacts[start:end]
@@ -1,22 +1,63 @@
 
-from collections import Counter
+from collections import Counter, deque
+from concurrent.futures import Future, ProcessPoolExecutor
+from functools import partial
+from itertools import chain
 import hashlib
 import json
+import multiprocessing
+import os
 from pathlib import Path
+from typing import Iterable, Iterator
 import duckdb
+import numpy as np
 from pydantic import BaseModel, ValidationError
 from duckdb import DuckDBPyConnection
 
+from app.engine.arrays import read_arrays_hash
+from app.engine.cache import PostingsCache
+from app.engine.facets import FacetIndex
+from app.engine.fields import FieldIndex
+from app.engine.impacts import read_impacts_header, write_impacts
+from app.engine.memory import MemoryIndex
 from app.engine.parser import Parser
+from app.engine.positions import PositionIndex, read_positions_hash, write_positions
+from app.engine.scoring import bm25_idf, bm25_scores
+from app.engine.segment import read_segment_hash, write_segment
+from app.engine.spelling import SpellingIndex
+from app.engine.store import DocumentStore
+from app.engine.suggest import SuggestIndex
 from collection.models.document import Document
 from utils.logger import LOGGER
 
 
 # document for document informations
 class DocumentRef(BaseModel):
+    document_id: int
+    # Document.id and hash of its content, to detect changes on update
+    id: str
+    content_hash: str
+
+    file_name: str
     collection_name: str
     index: int
     words_length: int
+    # as displayed, for completions
+    title: str
+
+    # filter attributes, lowercased
+    platforms: list[str]
+    category: str | None
+    status: str | None
+    tags: list[str]
+
+
+# collection file informations, to detect changes without parsing it
+class CollectionFile(BaseModel):
+    name: str
+    size: int
+    mtime_ns: int
+    content_hash: str
 
 
 # postings for word-document informations
@@ -33,56 +74,207 @@ class Lexicon(BaseModel):
     postings: list[Postings]
 
 
-class DocumentInfoDTO(BaseModel):
-    collection_name: str
-    index: int
-    word_frequency_within_document: int
-    words_length: int
+def parse_documents_chunk(parser: Parser, chunk: list[tuple[int, str, dict[str, str]]]) -> tuple[list[tuple[int, int]], dict[str, list[tuple[int, int]]], list[tuple[str, str, int, int]]]:
+    """
+    Tokenizes, stems and counts words of a chunk of (document_id, text,
+    field -> field text). Kept at module level so that it can run within
+    build worker processes.
+
+    Returns (document_id, words_length) of each document, the partial
+    word -> [(document_id, frequency)] postings map of the chunk and the
+    (field, word, document_id, frequency) postings of the fields
+    """
+    words_lengths: list[tuple[int, int]] = []
+    words_postings: dict[str, list[tuple[int, int]]] = {}
+    fields_postings: list[tuple[str, str, int, int]] = []
+    for document_id, text, fields in chunk:
+        words = parser.parse_text_to_words(text)
+        words_lengths.append((document_id, len(words)))
+
+        for word, freq in Counter(words).items():
+            if word in words_postings:
+                words_postings[word].append((document_id, freq))
+            else:
+                words_postings[word] = [(document_id, freq)]
+
+        for field, field_text in fields.items():
+            for word, freq in Counter(parser.parse_text_to_words(field_text)).items():
+                fields_postings.append((field, word, document_id, freq))
+    return words_lengths, words_postings, fields_postings
+
+
+def parse_documents_words(parser: Parser, chunk: list[tuple[int, str]]) -> list[tuple[int, list[str], list[tuple[int, int]]]]:
+    """
+    Tokenizes and stems words of a chunk of (doc id, text), in text order,
+    along with the characters of text each word was parsed from. Kept at
+    module level so that it can run within build worker processes.
+    """
+    return [(doc_id, *parser.parse_text_to_words_offsets(text)) for doc_id, text in chunk]
 
 
 class Indexer():
     # constans
     COLLECTION_FOLDER: str = "collection"
     DATABASE_PATH: str = "app/engine/db/main.duckdb"
+    SEGMENT_PATH: str = "app/engine/db/main.segment"
+    FACETS_PATH: str = "app/engine/db/main.facets.npz"
+    FIELDS_PATH: str = "app/engine/db/main.fields.npz"
+    SUGGEST_PATH: str = "app/engine/db/main.suggest.npz"
+    SPELLING_PATH: str = "app/engine/db/main.spelling.npz"
+    IMPACTS_PATH: str = "app/engine/db/main.impacts"
+    POSITIONS_PATH: str = "app/engine/db/main.positions"
+    # bumped when tables layout changes, older dbs are rebuilt
+    INDEX_VERSION: int = 4
+    # above this ratio of added and removed documents we rebuild the index
+    INCREMENTAL_UPDATE_MAX_RATIO: float = 0.5
+    # documents parsed per build task
+    BUILD_CHUNK_SIZE: int = 500
+    # estimated memory held by a SPIMI block word and posting
+    SPIMI_WORD_BYTES: int = 200
+    SPIMI_POSTING_BYTES: int = 100
 
     # modules
     connection: DuckDBPyConnection
     parser: Parser
+    # documents read by index, kept in sync with collection files
+    document_store: DocumentStore
+
+    # processes used to parse documents on build
+    build_workers: int
+    # MB of postings held in memory on build, 0 keeps all of them
+    build_memory_budget: int
+    # keep a segment file of the index next to the db
+    segment: bool
+    # keep BM25 scores quantized on impact_bits next to the db
+    impacts: bool
+    impact_bits: int
+    # keep words positions within documents next to the db, for phrases
+    positions: bool
+    # keep filters bitmaps next to the db, to filter while scoring
+    facets: bool
+    # keep fields postings next to the db, to score with BM25F
+    fields: bool
+    # keep completions of words and titles next to the db
+    suggestions: bool
+    # keep deletes of the lexicon words next to the db, to correct words
+    spelling: bool
+    # posting lists of words looked up in the db, cleared on rebuild
+    postings_cache: PostingsCache
 
     # collection related info
     collection_hash: str
     collection_documents_number = 0
     average_document_length = 0
 
-    def __init__(self, parser: Parser):
+    def __init__(self, parser: Parser, build_workers: int = 1, build_memory_budget: int = 0, segment: bool = False, postings_cache_size: int = 0, document_cache_size: int = 0, positions: bool = False, impacts: bool = False, impact_bits: int = 8, facets: bool = False, fields: bool = False, suggestions: bool = False, spelling: bool = False):
         if not parser:
             raise Exception("Parser and db connection are needed")
         self.parser = parser
+        # MB of posting lists cached, 0 disables the cache
+        self.postings_cache = PostingsCache(postings_cache_size * 1024 * 1024)
+        # 0 uses all cores
+        self.build_workers = build_workers if build_workers > 0 else (
+            os.cpu_count() or 1)
+        self.build_memory_budget = build_memory_budget
+        self.segment = segment
+        self.positions = positions
+        self.impacts = impacts
+        self.impact_bits = impact_bits
+        self.facets = facets
+        self.fields = fields
+        self.suggestions = suggestions
+        self.spelling = spelling
 
         # connect to db
         db_path = Path(self.DATABASE_PATH)
         # make folder if missing
         db_path.parent.mkdir(parents=True, exist_ok=True)
         self.connection = duckdb.connect(db_path)
+        # MB of parsed documents cached
+        self.document_store = DocumentStore(document_cache_size * 1024 * 1024)
 
         LOGGER.info("Initializing indexer...")
 
-        # load collection json
-        LOGGER.info("Reading collection...")
-        collection = self.read_collection_files()
+        # compare collection files with the ones of last build
+        LOGGER.info("Checking collection files...")
+        manifest = None
+        if self.load_collection_related_information():
+            manifest = self.load_collection_manifest()
+        files, changed = self.scan_collection_files(manifest or {})
 
-        if len(collection) == 0:
+        if len(files) == 0:
             LOGGER.error("Collection is empty")
             LOGGER.warn("Not initializing indexer")
             self.connection.close()
             return
-        LOGGER.ok("Collection read")
 
-        if self.load_collection_related_information():
-            if not self.has_collection_changed(collection):
-                # build index
+        if manifest is not None:
+            if len(changed) == 0:
+                # keep mtimes of touched but unchanged files
+                self.save_collection_manifest(files)
                 LOGGER.ok("Collection hasn't changed skipping index build")
+                self.refresh_document_store(files)
+                if self.facets:
+                    self.refresh_facets()
+                if self.fields:
+                    self.refresh_fields()
+                if self.suggestions:
+                    self.refresh_suggestions()
+                if self.spelling:
+                    self.refresh_spelling()
+                if self.segment:
+                    self.refresh_segment()
+                if self.impacts:
+                    self.refresh_impacts()
+                if self.positions:
+                    self.refresh_positions()
+                return
+
+            # apply only documents of files that changed since last build
+            LOGGER.info(f"Reading changed collection files: {changed}")
+            collection = self.read_collection_files(changed)
+            LOGGER.info("Updating Inverted Index...")
+            previous_hash = self.collection_hash
+            if self.update_inverted_index(collection, changed, files):
+                LOGGER.ok("Inverted Index updated")
+                self.refresh_document_store(files, collection)
+                if self.facets:
+                    self.refresh_facets()
+                if self.fields:
+                    self.refresh_fields()
+                if self.suggestions:
+                    self.refresh_suggestions()
+                if self.spelling:
+                    self.refresh_spelling()
+                if self.segment:
+                    self.refresh_segment()
+                if self.impacts:
+                    self.refresh_impacts()
+                if self.positions:
+                    self.refresh_positions(
+                        collection, changed, previous_hash)
+                LOGGER.ok("Indexer Initialized")
                 return
+            LOGGER.warn("Inverted Index can't be updated, rebuilding it")
+
+        # load collection json, one file at a time while parsing it when
+        # memory is bounded
+        LOGGER.info("Reading collection...")
+        collection: dict[str, list[Document]] | None = None
+        if self.build_memory_budget > 0:
+            collection_files = self.iterate_collection_files()
+            first_file = next(collection_files, None)
+            empty = first_file is None
+        else:
+            collection = self.read_collection_files()
+            empty = len(collection) == 0
+
+        if empty:
+            LOGGER.error("Collection is empty")
+            LOGGER.warn("Not initializing indexer")
+            self.connection.close()
+            return
+        LOGGER.ok("Collection read")
 
         # build index
         LOGGER.info("Building Inverted Index...")
@@ -92,10 +284,16 @@ class Indexer():
         self.clear_db()
         LOGGER.ok("DB Cleared")
 
-        # we build the index by building Lexicon and Postings classes
-        lexicon_list = self.build_inverted_index(collection)
+        # we build the index by building Lexicon and Postings classes,
+        # or as staged runs when memory is bounded
+        if self.build_memory_budget > 0:
+            documents = self.build_inverted_index_spimi(
+                self.connection, chain([first_file], collection_files))
+        else:
+            documents, lexicon_list, fields_postings = self.build_inverted_index(
+                collection.items())
         # compute hash
-        self.collection_hash = self.hash_collection(collection)
+        self.collection_hash = self.hash_manifest(files)
         # save collection related info to db for quick reload
         self.save_collection_related_informations()
 
@@ -103,31 +301,302 @@ class Indexer():
         # create tables
         self.create_inverted_index_tables(self.connection)
         # populate tables
-        self.insert_lexicon(self.connection, lexicon_list)
+        if self.build_memory_budget > 0:
+            self.insert_staged_postings(self.connection, documents)
+        else:
+            self.insert_lexicon(self.connection, documents,
+                                lexicon_list, fields_postings)
+        self.save_collection_manifest(files)
         LOGGER.ok("Inverted Index built")
+        self.refresh_document_store(files, collection)
+        if self.facets:
+            self.refresh_facets()
+        if self.fields:
+            self.refresh_fields()
+        if self.suggestions:
+            self.refresh_suggestions()
+        if self.spelling:
+            self.refresh_spelling()
+        if self.segment:
+            self.refresh_segment()
+        if self.impacts:
+            self.refresh_impacts()
+        if self.positions:
+            self.refresh_positions(collection)
         LOGGER.ok("Indexer Initialized")
 
-    def has_collection_changed(self, collection: list[list[Document]]):
+    def refresh_segment(self):
         """
-        Returns true if the collection has changed, as we need to trigger the inverted index rebuild
+        Writes the segment file of the index if missing or written for
+        another collection
         """
-        hash = self.hash_collection(collection)
-        return hash != self.collection_hash
+        path = Path(self.SEGMENT_PATH)
+        if read_segment_hash(path) == self.collection_hash:
+            LOGGER.ok("Segment is up to date")
+            return
+        write_segment(path, MemoryIndex(self.connection), self.collection_hash)
 
-    def hash_collection(self, collection: list[list[Document]]) -> str:
+    def refresh_impacts(self):
         """
-        Compute a deterministic hash for a collection of documents.
+        Writes BM25 scores of every posting quantized on impact_bits if
+        missing or written for another collection or number of bits
         """
-        json_string = "".join(
-            doc.model_dump_json() for file_docs in collection for doc in file_docs
-        )
-        return hashlib.sha256(json_string.encode("utf-8")).hexdigest()
+        path = Path(self.IMPACTS_PATH)
+        if read_impacts_header(path) == (self.impact_bits, self.collection_hash):
+            LOGGER.ok("Impacts are up to date")
+            return
+        index = MemoryIndex(self.connection)
+        terms, doc_ids, frequencies = index.all_postings()
+        scores = bm25_scores(bm25_idf(index.document_frequencies, self.collection_documents_number)[
+            terms], frequencies, index.doc_lengths[doc_ids], self.average_document_length)
+        write_impacts(path, index, scores, self.impact_bits,
+                      self.collection_hash)
+
+    def refresh_positions(self, collection: dict[str, list[Document]] | None = None, changed: list[str] | None = None, previous_hash: str | None = None):
+        """
+        Writes words positions of the documents if missing or written for
+        another collection. Positions are not kept in the db, documents are
+        parsed again in index order, using documents of collection when
+        already read. Given the files changed since the collection of
+        previous_hash, positions of documents of the other files are copied
+        from the positions written for it instead.
+
+        Failing to write positions doesn't stop the indexer, phrases are
+        then matched from documents
+        """
+        path = Path(self.POSITIONS_PATH)
+        positions_hash = read_positions_hash(path)
+        if positions_hash == self.collection_hash:
+            LOGGER.ok("Positions are up to date")
+            return
+        index = MemoryIndex(self.connection)
+
+        if changed is not None and positions_hash is not None and positions_hash == previous_hash:
+            try:
+                self.write_documents_positions(
+                    path, index, collection, PositionIndex(path), changed)
+                return
+            except Exception as e:
+                LOGGER.warn(
+                    f"Could not copy positions of unchanged files, parsing every document: {e}")
+        try:
+            self.write_documents_positions(path, index, collection)
+        except Exception as e:
+            LOGGER.error(f"Could not write positions: {e}")
+
+    def write_documents_positions(self, path: Path, index: MemoryIndex, collection: dict[str, list[Document]] | None = None, kept: PositionIndex | None = None, changed: list[str] | None = None):
+        """
+        Writes positions of the documents of index, parsed in chunks, except
+        documents of files not in changed which are copied from kept
+        """
+        copied: dict[int, int] = {}
+        if kept is not None:
+            kept_words, kept_terms, kept_starts = kept.documents_terms()
+            kept_words = np.array(kept_words, dtype=object)
+
+        chunks: list[list[tuple[int, str]]] = []
+        for doc_id, (collection_name, idx) in enumerate(index.doc_keys):
+            if kept is not None and collection_name not in changed:
+                # unchanged files keep their documents at the same index
+                copied[doc_id] = kept.keys[(collection_name, idx)]
+                continue
+            if collection is not None and collection_name in collection:
+                doc = collection[collection_name][idx]
+            else:
+                # read past the documents cache, every document is read once
+                store_file = self.document_store.open(collection_name)
+                doc = store_file.get(idx) if store_file is not None else None
+            if len(chunks) == 0 or len(chunks[-1]) == self.BUILD_CHUNK_SIZE:
+                chunks.append([])
+            chunks[-1].append(
+                (doc_id, doc.metadata.text if doc is not None else ""))
+        if kept is not None:
+            LOGGER.info(
+                f"Copying positions of {len(copied)} documents, parsing {len(index.doc_keys) - len(copied)}")
+
+        def documents_words() -> Iterator[tuple[int, list[str], list[tuple[int, int]]]]:
+            parsed = (item for result in self.parse_chunks(
+                chunks, parse_documents_words) for item in result)
+            for doc_id in range(len(index.doc_keys)):
+                if doc_id not in copied:
+                    yield next(parsed)
+                    continue
+                kept_id = copied[doc_id]
+                terms = kept_terms[kept_starts[kept_id]:kept_starts[kept_id + 1]]
+                yield doc_id, kept_words[terms].tolist(), kept.word_offsets(kept_id).tolist()
+
+        write_positions(path, index, documents_words(), self.collection_hash)
+
+    def refresh_facets(self):
+        """
+        Writes facets bitmaps of the documents if missing or written for
+        another collection
+        """
+        path = Path(self.FACETS_PATH)
+        if read_arrays_hash(path) == self.collection_hash:
+            LOGGER.ok("Facets are up to date")
+            return
+        FacetIndex.build(self.connection, path, self.collection_hash)
+
+    def refresh_fields(self):
+        """
+        Writes fields postings of the documents if missing or written for
+        another collection
+        """
+        path = Path(self.FIELDS_PATH)
+        if read_arrays_hash(path) == self.collection_hash:
+            LOGGER.ok("Fields are up to date")
+            return
+        FieldIndex.build(self.connection, path, self.collection_hash)
+
+    def refresh_suggestions(self):
+        """
+        Writes completions of the lexicon and titles if missing or written
+        for another collection
+        """
+        path = Path(self.SUGGEST_PATH)
+        if read_arrays_hash(path) == self.collection_hash:
+            LOGGER.ok("Suggestions are up to date")
+            return
+        SuggestIndex.build(self.connection, path,
+                           self.collection_hash, self.parser)
+
+    def refresh_spelling(self):
+        """
+        Writes deletes of the lexicon words if missing or written for
+        another collection
+        """
+        path = Path(self.SPELLING_PATH)
+        if read_arrays_hash(path) == self.collection_hash:
+            LOGGER.ok("Spelling is up to date")
+            return
+        SpellingIndex.build(self.connection, path, self.collection_hash)
+
+    def refresh_document_store(self, files: list[CollectionFile], collection: dict[str, list[Document]] | None = None):
+        """
+        Writes store files of collection files whose content changed since
+        they were written, using documents of collection when already read
+        """
+        for f in files:
+            if self.document_store.content_hash(f.name) == f.content_hash:
+                continue
+            documents = collection[f.name] if collection is not None and f.name in collection else self.read_collection_by_name(
+                f.name)
+            self.document_store.write(f.name, documents, f.content_hash)
+        self.document_store.remove_others([f.name for f in files])
+
+    def scan_collection_files(self, manifest: dict[str, CollectionFile]) -> tuple[list[CollectionFile], list[str]]:
+        """
+        Compares collection files against the manifest of last build.
+        Files with same size and mtime are trusted without reading them,
+        the others are hashed.
+
+        Returns current files and names of files added, modified or deleted.
+        """
+        files: list[CollectionFile] = []
+        changed: list[str] = []
+        for json_file in sorted(Path(self.COLLECTION_FOLDER).glob("*.json")):
+            stat = json_file.stat()
+            name = json_file.stem
+            entry = manifest.get(name, None)
+            if entry and entry.size == stat.st_size and entry.mtime_ns == stat.st_mtime_ns:
+                files.append(entry)
+                continue
+
+            content_hash = self.hash_file(json_file)
+            files.append(CollectionFile(
+                name=name, size=stat.st_size, mtime_ns=stat.st_mtime_ns, content_hash=content_hash))
+            if not entry or entry.content_hash != content_hash:
+                changed.append(name)
+
+        # deleted files
+        names = [f.name for f in files]
+        changed.extend(name for name in manifest if name not in names)
+        return files, changed
+
+    def hash_file(self, path: Path) -> str:
+        """
+        Compute the hash of a file bytes
+        """
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                sha.update(chunk)
+        return sha.hexdigest()
+
+    def hash_manifest(self, files: list[CollectionFile]) -> str:
+        """
+        Compute a deterministic hash for the whole collection from its files hashes
+        """
+        manifest_string = "".join(
+            f"{f.name}:{f.content_hash};" for f in sorted(files, key=lambda f: f.name))
+        return hashlib.sha256(manifest_string.encode("utf-8")).hexdigest()
+
+    def load_collection_manifest(self) -> dict[str, CollectionFile] | None:
+        """
+        Loads collection files of last build, None if there is no manifest
+        """
+        try:
+            rows = self.connection.execute(
+                "SELECT name, size, mtime_ns, content_hash FROM collection_manifest").fetchall()
+        except Exception as _:
+            return None
+
+        return {r[0]: CollectionFile(name=r[0], size=r[1], mtime_ns=r[2], content_hash=r[3]) for r in rows}
+
+    def save_collection_manifest(self, files: list[CollectionFile]):
+        """
+        Saves collection files informations to db
+        """
+        self.connection.execute("""
+CREATE TABLE IF NOT EXISTS collection_manifest (
+	name VARCHAR PRIMARY KEY,
+	size BIGINT NOT NULL,
+	mtime_ns BIGINT NOT NULL,
+	content_hash VARCHAR NOT NULL
+)
+""")
+
+        self.connection.execute("DELETE FROM collection_manifest")
+        self.connection.executemany(
+            "INSERT INTO collection_manifest VALUES (?, ?, ?, ?)",
+            [(f.name, f.size, f.mtime_ns, f.content_hash) for f in files])
+
+    def hash_document(self, document: Document) -> str:
+        """
+        Compute a deterministic hash of a single document content
+        """
+        return hashlib.sha256(document.model_dump_json().encode("utf-8")).hexdigest()
+
+    def document_attributes(self, document: Document) -> dict:
+        """
+        Filter attributes of a document, lowercased as filters compare them
+        """
+        metadata = document.metadata
+        return {
+            "platforms": [p.lower() for p in metadata.platforms or []],
+            "category": metadata.category.lower() if metadata.category else None,
+            "status": metadata.status.lower() if metadata.status else None,
+            "tags": [t.lower() for t in metadata.tags or []],
+        }
+
+    def document_fields(self, document: Document) -> dict[str, str]:
+        """
+        Text of each field of a document indexed on its own, as FieldIndex.FIELDS
+        """
+        metadata = document.metadata
+        return {
+            "title": metadata.title,
+            "tags": " ".join((metadata.tags or []) + (metadata.genre or [])),
+            "author": metadata.author,
+        }
 
     def clear_db(self):
         """
         Clears db: close connection, delete file, re-establish connection
         """
         self.connection.close()
+        self.postings_cache.clear()
 
         db_path = Path(self.DATABASE_PATH)
         if db_path.exists():
@@ -155,6 +624,8 @@ class Indexer():
                 "average_document_length", None)
             self.collection_hash = info.get("collection_hash", None)
 
+            if info.get("index_version", None) != self.INDEX_VERSION:
+                return False
             if not self.collection_documents_number or not self.average_document_length or not self.collection_hash:
                 return False
             return True
@@ -169,7 +640,8 @@ class Indexer():
         info = {
             "collection_documents_number": self.collection_documents_number,
             "average_document_length": self.average_document_length,
-            "collection_hash": self.collection_hash
+            "collection_hash": self.collection_hash,
+            "index_version": self.INDEX_VERSION
         }
 
         # create table if not there
@@ -184,107 +656,277 @@ CREATE TABLE IF NOT EXISTS collection_info (
         self.connection.execute(
             "INSERT INTO collection_info VALUES (?)", [json.dumps(info)])
 
-    def build_inverted_index(self, collection: list[list[Document]]) -> list[Lexicon]:
+    def split_collection(self, collection: Iterable[tuple[str, list[Document]]], documents: list[DocumentRef]) -> Iterator[list[tuple[int, str, dict[str, str]]]]:
         """
-        Naive inverted index algorithm. We do:
+        Splits texts of the documents of collection, given as (file name,
+        documents) one file at a time, in chunks of (document_id, text,
+        fields texts) of BUILD_CHUNK_SIZE documents. Refs of the documents of
+        a chunk are appended to documents before it is yielded, their
+        words_length is set once parsed.
 
-        - build a dict of word -> Lexicon so that we efficiently add words
-        - add Postings and Document to each word
+        While we do so we also compute collection_documents_number
+        """
+        # may hold values loaded from a previous build
+        self.collection_documents_number = 0
+        chunk: list[tuple[int, str, dict[str, str]]] = []
+        for file_name, col in collection:
+            LOGGER.info(f"Processing sub-collection of size: {len(col)}")
+            self.collection_documents_number += len(col)
+            for idx, doc in enumerate(col):
+                # document related information, shared by its postings
+                doc_ref = DocumentRef(
+                    document_id=len(documents) + 1, id=doc.id, content_hash=self.hash_document(doc),
+                    file_name=file_name, collection_name=doc.source.name, index=idx, words_length=0, title=doc.metadata.title,
+                    **self.document_attributes(doc))
+                documents.append(doc_ref)
+
+                chunk.append(
+                    (doc_ref.document_id, doc.metadata.text, self.document_fields(doc)))
+                if len(chunk) == self.BUILD_CHUNK_SIZE:
+                    yield chunk
+                    chunk = []
+        if len(chunk) > 0:
+            yield chunk
+
+    def parse_chunks(self, chunks: Iterable[list[tuple]], parse=parse_documents_chunk) -> Iterator:
+        """
+        Yields parse results of each chunk in chunks order, parsing within a
+        pool of build_workers processes if more than one. parse defaults to
+        parse_documents_chunk. Chunks are taken as workers need them, at
+        most two per worker are waiting, so that chunks can be streamed
+        """
+        parse_chunk = partial(parse, self.parser)
+        # fork so that workers don't re-import the app main module
+        if self.build_workers <= 1 or (isinstance(chunks, list) and len(chunks) <= 1) or "fork" not in multiprocessing.get_all_start_methods():
+            for i, chunk in enumerate(chunks):
+                yield parse_chunk(chunk)
+                LOGGER.ok(f"Processed chunk: {i + 1}")
+            return
+
+        LOGGER.info(f"Parsing documents with {self.build_workers} workers")
+        executor = ProcessPoolExecutor(
+            max_workers=self.build_workers, mp_context=multiprocessing.get_context("fork"))
+        try:
+            pending: deque[Future] = deque()
+            done = 0
+            for chunk in chunks:
+                pending.append(executor.submit(parse_chunk, chunk))
+                if len(pending) < 2 * self.build_workers:
+                    continue
+                yield pending.popleft().result()
+                done += 1
+                LOGGER.ok(f"Processed chunk: {done}")
+            while len(pending) > 0:
+                yield pending.popleft().result()
+                done += 1
+                LOGGER.ok(f"Processed chunk: {done}")
+        finally:
+            executor.shutdown()
+
+    def build_inverted_index(self, collection: Iterable[tuple[str, list[Document]]]) -> tuple[list[DocumentRef], list[Lexicon], list[tuple[str, str, int, int]]]:
+        """
+        Inverted index algorithm. We do:
+
+        - split the collection in chunks of BUILD_CHUNK_SIZE documents
+        - parse each chunk into a partial word -> postings map, within a
+          pool of build_workers processes if more than one
+        - merge partial maps in chunk order into a dict of word -> Lexicon,
+          so that postings stay sorted by document
         - convert dict into list of Lexicon
 
+        Documents are returned on their own as well, so that documents without
+        any word are still stored, along with the postings of their fields.
+
         While we do so we also compute collection related infomations:
         - collection_documents_number
         - average_document_length
         """
+        documents: list[DocumentRef] = []
+        chunks = self.split_collection(collection, documents)
+
         total_documents_words_length = 0
         words_lexicon: dict[str, Lexicon] = {}
-        for col in collection:
-            collection_size = len(col)
-            LOGGER.info(
-                f"Processing sub-collection of size: {collection_size}")
-            self.collection_documents_number += collection_size
-            for idx, doc in enumerate(col):
-                words = self.parser.parse_text_to_words(doc.metadata.text)
-                total_documents_words_length += len(words)
-
-                # we build a word -> frequency dict and operate on that
-                words_freq = Counter(words)
-
-                # add document to words
-                for word, freq in words_freq.items():
-                    # document related information for word
-                    doc_ref = DocumentRef(
-                        collection_name=doc.source.name, index=idx, words_length=len(words))
-                    posting = Postings(
-                        word_frequency_within_document=freq, document=doc_ref)
-
-                    if word in words_lexicon:
-                        # update lexicon entry
-                        words_lexicon[word].collection_frequency += freq
-                        words_lexicon[word].postings.append(posting)
-                    else:
-                        # create lexicon entry
-                        lexicon = Lexicon(
-                            word=word, collection_frequency=freq, postings=[posting])
-                        words_lexicon[word] = lexicon
-                if idx % 250 == 0:
-                    LOGGER.ok(
-                        f"Processed : {idx} / {collection_size}")
-                if idx == collection_size:
-                    LOGGER.ok(
-                        f"Processed : {idx} / {collection_size}")
-
-            LOGGER.ok(f"Processed collection")
+        fields_postings: list[tuple[str, str, int, int]] = []
+        for words_lengths, words_postings, chunk_fields_postings in self.parse_chunks(chunks):
+            fields_postings.extend(chunk_fields_postings)
+            for document_id, words_length in words_lengths:
+                documents[document_id - 1].words_length = words_length
+                total_documents_words_length += words_length
+
+            # merge partial postings
+            for word, postings in words_postings.items():
+                lexicon = words_lexicon.get(word, None)
+                if lexicon is None:
+                    lexicon = Lexicon(
+                        word=word, collection_frequency=0, postings=[])
+                    words_lexicon[word] = lexicon
+
+                for document_id, freq in postings:
+                    lexicon.collection_frequency += freq
+                    lexicon.postings.append(Postings(
+                        word_frequency_within_document=freq, document=documents[document_id - 1]))
+
+        LOGGER.ok(f"Processed collection")
+        self.average_document_length = total_documents_words_length / \
+            self.collection_documents_number
+        return documents, [value for _, value in words_lexicon.items()], fields_postings
+
+    def build_inverted_index_spimi(self, con: DuckDBPyConnection, collection: Iterable[tuple[str, list[Document]]]) -> list[DocumentRef]:
+        """
+        Single-pass in-memory indexing (SPIMI) bounded by build_memory_budget.
+        We do:
+
+        - parse chunks as build_inverted_index
+        - accumulate their postings in a block of word -> [(document_id, frequency)]
+        - once the block estimated size exceeds the budget, flush it sorted by
+          word as a run into the postings_staging table and start a new block
+        - runs are merged by insert_staged_postings
+
+        Fields postings of a block are flushed along with it, straight into
+        field_postings. Only documents are returned, postings live in
+        postings_staging. Collection files can be read one at a time as
+        chunks are parsed, only their documents refs are kept.
+        """
+        documents: list[DocumentRef] = []
+        chunks = self.split_collection(collection, documents)
+        con.execute("""
+CREATE TABLE postings_staging (
+	word VARCHAR NOT NULL,
+	document_id INTEGER NOT NULL,
+	frequency INTEGER NOT NULL
+)
+""")
+        self.create_field_postings_table(con)
 
+        budget = self.build_memory_budget * 1024 * 1024
+        total_documents_words_length = 0
+        runs = 0
+        block: dict[str, list[tuple[int, int]]] = {}
+        block_fields: list[tuple[str, str, int, int]] = []
+        block_size = 0
+        for words_lengths, words_postings, fields_postings in self.parse_chunks(chunks):
+            for document_id, words_length in words_lengths:
+                documents[document_id - 1].words_length = words_length
+                total_documents_words_length += words_length
+
+            for word, postings in words_postings.items():
+                if word in block:
+                    block[word].extend(postings)
+                else:
+                    block[word] = list(postings)
+                    block_size += self.SPIMI_WORD_BYTES
+                block_size += len(postings) * self.SPIMI_POSTING_BYTES
+            block_fields.extend(fields_postings)
+            block_size += len(fields_postings) * self.SPIMI_POSTING_BYTES
+
+            if block_size >= budget:
+                self.flush_spimi_block(con, block)
+                self.insert_field_postings(con, block_fields)
+                runs += 1
+                block = {}
+                block_fields = []
+                block_size = 0
+
+        if len(block) > 0:
+            self.flush_spimi_block(con, block)
+            runs += 1
+        self.insert_field_postings(con, block_fields)
+
+        LOGGER.ok(f"Processed collection in {runs} runs")
         self.average_document_length = total_documents_words_length / \
             self.collection_documents_number
-        return [value for _, value in words_lexicon.items()]
+        return documents
+
+    def flush_spimi_block(self, con: DuckDBPyConnection, block: dict[str, list[tuple[int, int]]]):
+        """
+        Writes a block as a run sorted by word, then document, to postings_staging
+        """
+        words: list[str] = []
+        documents_ids: list[int] = []
+        frequencies: list[int] = []
+        for word in sorted(block):
+            for document_id, freq in block[word]:
+                words.append(word)
+                documents_ids.append(document_id)
+                frequencies.append(freq)
+
+        self.insert_columns(con, "postings_staging", {
+            "word": np.array(words, dtype=object),
+            "document_id": np.array(documents_ids, dtype=np.int32),
+            "frequency": np.array(frequencies, dtype=np.int32),
+        })
+        LOGGER.ok(f"Flushed run of {len(block)} words, {len(words)} postings")
 
     def create_inverted_index_tables(self, con: DuckDBPyConnection):
         """
         Create tables for inverted index
+
+        Ids are assigned in python while building the columns to insert,
+        so tables have no sequences behind their primary keys.
+
+        Tables have no foreign keys nor a (collection_name, index) unique
+        constraint: duckdb rejects deleting referenced rows and updating
+        indexed columns, which the incremental update does.
         """
         LOGGER.info("Creating Lexicon, Postings and DocumentRef tables...")
-        # documents table adn id sequence
-        con.execute("CREATE SEQUENCE seq_document START 1")
+        # documents table
         con.execute("""
 CREATE TABLE IF NOT EXISTS documents (
-	document_id INTEGER PRIMARY KEY DEFAULT nextval('seq_document'),
+	document_id INTEGER PRIMARY KEY,
+
+	id VARCHAR NOT NULL,
+	content_hash VARCHAR NOT NULL,
 
+	file_name VARCHAR NOT NULL,
 	collection_name VARCHAR NOT NULL,
 	index INTEGER NOT NULL,
 	words_length INTEGER NOT NULL,
+	title VARCHAR NOT NULL,
+
+	-- filter attributes, lowercased
+	category VARCHAR,
+	status VARCHAR
+)
+""")
 
-	UNIQUE(collection_name, index)
+        # platforms and tags of each document, lowercased
+        con.execute("""
+CREATE TABLE IF NOT EXISTS document_platforms (
+	document_id INTEGER NOT NULL,
+	platform VARCHAR NOT NULL
+)
+""")
+        con.execute("""
+CREATE TABLE IF NOT EXISTS document_tags (
+	document_id INTEGER NOT NULL,
+	tag VARCHAR NOT NULL
 )
 """)
 
+        self.create_field_postings_table(con)
+
         # lexicon table
         # we dont use varchar as primary key because in postings would take a lot
         # of space when referenced each time
-        con.execute("CREATE SEQUENCE seq_lexicon START 1")
         con.execute("""
 CREATE TABLE IF NOT EXISTS lexicon (
-	word_id INTEGER PRIMARY KEY DEFAULT nextval('seq_lexicon'),
+	word_id INTEGER PRIMARY KEY,
 
 	word VARCHAR UNIQUE NOT NULL,
-	collection_frequency INTEGER NOT NULL
+	collection_frequency INTEGER NOT NULL,
+	-- number of documents containing the word, its postings count
+	document_frequency INTEGER NOT NULL
 )
 """)
 
         # Create postings table (many-to-many)
-        con.execute("CREATE SEQUENCE seq_postings START 1")
         con.execute("""
 CREATE TABLE IF NOT EXISTS postings (
-	posting_id INTEGER PRIMARY KEY DEFAULT nextval('seq_postings'),
+	posting_id INTEGER PRIMARY KEY,
 
 	lexicon_id INTEGER NOT NULL,
 	document_id INTEGER NOT NULL,
-	word_frequency_within_document INTEGER NOT NULL,
-
-	FOREIGN KEY (lexicon_id) REFERENCES lexicon(word_id),
-	FOREIGN KEY (document_id) REFERENCES documents(document_id),
-	UNIQUE(lexicon_id, document_id)
+	word_frequency_within_document INTEGER NOT NULL
 )
 """)
 
@@ -293,93 +935,400 @@ CREATE TABLE IF NOT EXISTS postings (
             "CREATE INDEX IF NOT EXISTS idx_postings_lexicon ON postings(lexicon_id)")
         con.execute(
             "CREATE INDEX IF NOT EXISTS idx_postings_document ON postings(document_id)")
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_document_platforms_platform ON document_platforms(platform)")
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_document_tags_tag ON document_tags(tag)")
+        con.execute(
+            "CREATE INDEX IF NOT EXISTS idx_field_postings_document ON field_postings(document_id)")
         LOGGER.ok("Tables created")
 
-    def insert_lexicon(self, con: DuckDBPyConnection, lexicon_list: list[Lexicon]):
+    def create_field_postings_table(self, con: DuckDBPyConnection):
         """
-        Insert lexicon into tables, handling Documents duplicates.
+        Create the postings table of documents fields. Words are stored as
+        they are rather than referencing the lexicon, which only holds words
+        of the body text
+        """
+        con.execute("""
+CREATE TABLE IF NOT EXISTS field_postings (
+	document_id INTEGER NOT NULL,
+	field VARCHAR NOT NULL,
+	word VARCHAR NOT NULL,
+	frequency INTEGER NOT NULL
+)
+""")
+
+    def insert_columns(self, con: DuckDBPyConnection, table: str, columns: dict[str, np.ndarray]):
+        """
+        Bulk inserts whole columns into table with a single INSERT ... SELECT
+        over the registered arrays
+        """
+        view = f"{table}_columns"
+        con.register(view, columns)
+        try:
+            names = ", ".join(columns.keys())
+            con.execute(
+                f"INSERT INTO {table} ({names}) SELECT {names} FROM {view}")
+        finally:
+            con.unregister(view)
+
+    def insert_lexicon(self, con: DuckDBPyConnection, documents: list[DocumentRef], lexicon_list: list[Lexicon], fields_postings: list[tuple[str, str, int, int]]):
+        """
+        Insert documents, lexicon and fields postings into tables.
+
+        Document ids come from the build and word ids are assigned here so
+        postings reference them directly, then each table is loaded
+        column-wise in one statement.
         """
         LOGGER.info("Inserting computed Inverted index in database...")
 
-        # collect unique documents: (collection_name, index) -> words_length
-        documents_map = {}
-        for lexicon_entry in lexicon_list:
+        # postings columns
+        postings_lexicon_ids: list[int] = []
+        postings_documents_ids: list[int] = []
+        postings_frequencies: list[int] = []
+        for word_id, lexicon_entry in enumerate(lexicon_list, start=1):
             for posting in lexicon_entry.postings:
-                doc = posting.document
-                key = (doc.collection_name, doc.index)
-                if key not in documents_map:
-                    documents_map[key] = doc.words_length
-
-        # insert unique documents
-        con.executemany(
-            """
-INSERT INTO documents (collection_name, index, words_length)
-VALUES (?, ?, ?)
-""",
-            [(key[0], key[1], value)
-             for key, value in documents_map.items()]
-        )
+                postings_lexicon_ids.append(word_id)
+                postings_documents_ids.append(posting.document.document_id)
+                postings_frequencies.append(
+                    posting.word_frequency_within_document)
+
+        # insert documents
+        self.insert_documents_refs(con, documents)
         LOGGER.ok("DocumentsRef inserted")
 
         # insert lexicon entries, already unique
-        con.executemany(
-            """
-INSERT INTO lexicon (word, collection_frequency)
-VALUES (?, ?)
-""",
-            [(e.word, e.collection_frequency)
-             for e in lexicon_list])
+        self.insert_columns(con, "lexicon", {
+            "word_id": np.arange(1, len(lexicon_list) + 1, dtype=np.int32),
+            "word": np.array([e.word for e in lexicon_list], dtype=object),
+            "collection_frequency": np.array([e.collection_frequency for e in lexicon_list], dtype=np.int32),
+            "document_frequency": np.array([len(e.postings) for e in lexicon_list], dtype=np.int32),
+        })
         LOGGER.ok("Lexicon inserted")
 
         # insert postings that reference lexicon and document rows
-        postings_data = []
-        for lexicon_entry in lexicon_list:
-            for posting in lexicon_entry.postings:
-                doc = posting.document
-                postings_data.append((
-                    lexicon_entry.word,
-                    doc.collection_name,
-                    doc.index,
-                    posting.word_frequency_within_document
-                ))
-
-        # given values: word, (collection_name, index) we fetch proper ids to build references
-        # within the table
-        con.executemany(
-            """
-INSERT INTO postings (lexicon_id, document_id, word_frequency_within_document)
-VALUES (
-	(SELECT word_id FROM lexicon WHERE word = ?),
-	(SELECT document_id FROM documents WHERE collection_name = ? AND index = ?),
-	?
-)
-""",
-            postings_data
-        )
+        self.insert_columns(con, "postings", {
+            "posting_id": np.arange(1, len(postings_lexicon_ids) + 1, dtype=np.int32),
+            "lexicon_id": np.array(postings_lexicon_ids, dtype=np.int32),
+            "document_id": np.array(postings_documents_ids, dtype=np.int32),
+            "word_frequency_within_document": np.array(postings_frequencies, dtype=np.int32),
+        })
         LOGGER.ok("Postings inserted")
 
-    def read_collection_files(self) -> list[list[Document]]:
+        self.insert_field_postings(con, fields_postings)
+        LOGGER.ok("Fields postings inserted")
+
+    def insert_field_postings(self, con: DuckDBPyConnection, fields_postings: list[tuple[str, str, int, int]]):
+        """
+        Insert (field, word, document_id, frequency) postings of documents fields
+        """
+        self.insert_columns(con, "field_postings", {
+            "document_id": np.array([p[2] for p in fields_postings], dtype=np.int32),
+            "field": np.array([p[0] for p in fields_postings], dtype=object),
+            "word": np.array([p[1] for p in fields_postings], dtype=object),
+            "frequency": np.array([p[3] for p in fields_postings], dtype=np.int32),
+        })
+
+    def insert_documents_refs(self, con: DuckDBPyConnection, documents: list[DocumentRef]):
+        """
+        Insert documents rows, their platforms and tags
         """
-        Load all JSON files from collection directory.
-        Returns a list of lists of Source objects, one list per file.
+        self.insert_columns(con, "documents", {
+            "document_id": np.array([d.document_id for d in documents], dtype=np.int32),
+            "id": np.array([d.id for d in documents], dtype=object),
+            "content_hash": np.array([d.content_hash for d in documents], dtype=object),
+            "file_name": np.array([d.file_name for d in documents], dtype=object),
+            "collection_name": np.array([d.collection_name for d in documents], dtype=object),
+            "index": np.array([d.index for d in documents], dtype=np.int32),
+            "words_length": np.array([d.words_length for d in documents], dtype=np.int32),
+            "title": np.array([d.title for d in documents], dtype=object),
+            "category": np.array([d.category for d in documents], dtype=object),
+            "status": np.array([d.status for d in documents], dtype=object),
+        })
+        platforms = [(d.document_id, platform)
+                     for d in documents for platform in set(d.platforms)]
+        self.insert_columns(con, "document_platforms", {
+            "document_id": np.array([p[0] for p in platforms], dtype=np.int32),
+            "platform": np.array([p[1] for p in platforms], dtype=object),
+        })
+        tags = [(d.document_id, tag) for d in documents for tag in set(d.tags)]
+        self.insert_columns(con, "document_tags", {
+            "document_id": np.array([t[0] for t in tags], dtype=np.int32),
+            "tag": np.array([t[1] for t in tags], dtype=object),
+        })
+
+    def update_inverted_index(self, collection: dict[str, list[Document]], changed: list[str], files: list[CollectionFile]) -> bool:
+        """
+        Applies to the stored index only documents that have been added,
+        removed or changed since last build, looking only at changed files.
+        We do:
+
+        - match changed files documents with stored ones by Document.id
+        - same content hash: keep postings, only fix the index if it moved
+        - different content hash: delete and insert it again
+        - stored but no more in collection: delete postings and document
+        - recompute collection related information from the documents table
+
+        Returns False if the index must be fully rebuilt instead, either because
+        tables are missing/outdated or too many documents changed.
+        """
+        con = self.connection
+        try:
+            rows = con.execute("""
+SELECT document_id, id, content_hash, collection_name, index
+FROM documents
+WHERE list_contains(?, file_name)
+ORDER BY document_id
+""", [changed]).fetchall()
+        except Exception as _:
+            return False
+
+        # Document.id -> stored rows, an id can repeat within the collection
+        stored: dict[str, list[tuple]] = {}
+        for row in rows:
+            stored.setdefault(row[1], []).append(row)
+
+        # (document, file name, index, content hash)
+        added: list[tuple[Document, str, int, str]] = []
+        # document_id
+        removed: list[int] = []
+        # (index, document_id)
+        moved: list[tuple[int, int]] = []
+        for name in changed:
+            for idx, doc in enumerate(collection.get(name, [])):
+                content_hash = self.hash_document(doc)
+                candidates = stored.get(doc.id, None)
+                row = candidates.pop(0) if candidates else None
+
+                if row is not None and row[2] == content_hash:
+                    if row[3] != doc.source.name or row[4] != idx:
+                        moved.append((idx, row[0]))
+                    continue
+
+                if row is not None:
+                    removed.append(row[0])
+                added.append((doc, name, idx, content_hash))
+        for candidates in stored.values():
+            removed.extend(row[0] for row in candidates)
+
+        LOGGER.info(
+            f"Documents added: {len(added)}, removed: {len(removed)}, moved: {len(moved)}")
+        if len(added) + len(removed) > self.collection_documents_number * self.INCREMENTAL_UPDATE_MAX_RATIO:
+            return False
+
+        con.execute("BEGIN TRANSACTION")
+        try:
+            self.delete_documents(con, removed)
+            if len(moved) > 0:
+                con.executemany(
+                    "UPDATE documents SET index = ? WHERE document_id = ?", moved)
+            self.insert_documents(con, added)
+            # words left without postings
+            con.execute("DELETE FROM lexicon WHERE collection_frequency <= 0")
+
+            # refresh collection related info
+            row = con.execute(
+                "SELECT COUNT(*), AVG(words_length) FROM documents").fetchone()
+            self.collection_documents_number = row[0]
+            self.average_document_length = row[1] or 0
+            self.collection_hash = self.hash_manifest(files)
+            self.save_collection_related_informations()
+            self.save_collection_manifest(files)
+            con.execute("COMMIT")
+        except Exception as e:
+            con.execute("ROLLBACK")
+            LOGGER.error(f"Failed to update Inverted Index: {e}")
+            return False
+        self.postings_cache.clear()
+        return True
+
+    def delete_documents(self, con: DuckDBPyConnection, documents_ids: list[int]):
+        """
+        Deletes documents and their postings, lowering words collection and
+        document frequencies
+        """
+        if len(documents_ids) == 0:
+            return
+
+        con.register("removed_documents", {
+            "document_id": np.array(documents_ids, dtype=np.int32)})
+        try:
+            con.execute("""
+UPDATE lexicon
+SET collection_frequency = lexicon.collection_frequency - r.frequency,
+	document_frequency = lexicon.document_frequency - r.documents
+FROM (
+	SELECT lexicon_id, SUM(word_frequency_within_document) AS frequency, COUNT(*) AS documents
+	FROM postings
+	WHERE document_id IN (SELECT document_id FROM removed_documents)
+	GROUP BY lexicon_id
+) r
+WHERE lexicon.word_id = r.lexicon_id
+""")
+            con.execute(
+                "DELETE FROM postings WHERE document_id IN (SELECT document_id FROM removed_documents)")
+            con.execute(
+                "DELETE FROM document_platforms WHERE document_id IN (SELECT document_id FROM removed_documents)")
+            con.execute(
+                "DELETE FROM document_tags WHERE document_id IN (SELECT document_id FROM removed_documents)")
+            con.execute(
+                "DELETE FROM field_postings WHERE document_id IN (SELECT document_id FROM removed_documents)")
+            con.execute(
+                "DELETE FROM documents WHERE document_id IN (SELECT document_id FROM removed_documents)")
+        finally:
+            con.unregister("removed_documents")
+        LOGGER.ok(f"Deleted {len(documents_ids)} documents")
+
+    def insert_documents(self, con: DuckDBPyConnection, added: list[tuple[Document, str, int, str]]):
+        """
+        Parses and inserts new documents, their postings, fields postings and
+        any new word
+        """
+        if len(added) == 0:
+            return
+
+        # ids continue from the current maximum
+        next_document_id, next_word_id, next_posting_id = con.execute("""
+SELECT
+	(SELECT COALESCE(MAX(document_id), 0) + 1 FROM documents),
+	(SELECT COALESCE(MAX(word_id), 0) + 1 FROM lexicon),
+	(SELECT COALESCE(MAX(posting_id), 0) + 1 FROM postings)
+""").fetchone()
+
+        documents: list[DocumentRef] = []
+        # word -> collection and document frequency of the added documents
+        words_frequency: Counter = Counter()
+        words_documents: Counter = Counter()
+        # (word, document_id, frequency)
+        postings: list[tuple[str, int, int]] = []
+        # (field, word, document_id, frequency)
+        fields_postings: list[tuple[str, str, int, int]] = []
+        for doc, file_name, idx, content_hash in added:
+            words = self.parser.parse_text_to_words(doc.metadata.text)
+            document_id = next_document_id + len(documents)
+            documents.append(DocumentRef(
+                document_id=document_id, id=doc.id, content_hash=content_hash,
+                file_name=file_name, collection_name=doc.source.name, index=idx, words_length=len(words), title=doc.metadata.title,
+                **self.document_attributes(doc)))
+
+            for word, freq in Counter(words).items():
+                words_frequency[word] += freq
+                words_documents[word] += 1
+                postings.append((word, document_id, freq))
+            for field, field_text in self.document_fields(doc).items():
+                for word, freq in Counter(self.parser.parse_text_to_words(field_text)).items():
+                    fields_postings.append((field, word, document_id, freq))
+
+        # resolve ids of words already in lexicon
+        con.register("added_words", {
+            "word": np.array(list(words_frequency.keys()), dtype=object)})
+        try:
+            words_ids: dict[str, int] = dict(con.execute("""
+SELECT l.word, l.word_id
+FROM lexicon l
+JOIN added_words a ON l.word = a.word
+""").fetchall())
+        finally:
+            con.unregister("added_words")
+
+        existing_words = list(words_ids.keys())
+        new_words = [w for w in words_frequency if w not in words_ids]
+        for i, word in enumerate(new_words):
+            words_ids[word] = next_word_id + i
+
+        # existing words
+        if len(existing_words) > 0:
+            con.register("added_frequencies", {
+                "word_id": np.array([words_ids[w] for w in existing_words], dtype=np.int32),
+                "frequency": np.array([words_frequency[w] for w in existing_words], dtype=np.int32),
+                "documents": np.array([words_documents[w] for w in existing_words], dtype=np.int32),
+            })
+            try:
+                con.execute("""
+UPDATE lexicon
+SET collection_frequency = lexicon.collection_frequency + a.frequency,
+	document_frequency = lexicon.document_frequency + a.documents
+FROM added_frequencies a
+WHERE lexicon.word_id = a.word_id
+""")
+            finally:
+                con.unregister("added_frequencies")
+
+        # new words
+        self.insert_columns(con, "lexicon", {
+            "word_id": np.array([words_ids[w] for w in new_words], dtype=np.int32),
+            "word": np.array(new_words, dtype=object),
+            "collection_frequency": np.array([words_frequency[w] for w in new_words], dtype=np.int32),
+            "document_frequency": np.array([words_documents[w] for w in new_words], dtype=np.int32),
+        })
+
+        self.insert_documents_refs(con, documents)
+        self.insert_columns(con, "postings", {
+            "posting_id": np.arange(next_posting_id, next_posting_id + len(postings), dtype=np.int32),
+            "lexicon_id": np.array([words_ids[p[0]] for p in postings], dtype=np.int32),
+            "document_id": np.array([p[1] for p in postings], dtype=np.int32),
+            "word_frequency_within_document": np.array([p[2] for p in postings], dtype=np.int32),
+        })
+        self.insert_field_postings(con, fields_postings)
+        LOGGER.ok(f"Inserted {len(documents)} documents")
+
+    def insert_staged_postings(self, con: DuckDBPyConnection, documents: list[DocumentRef]):
+        """
+        Merges SPIMI runs of postings_staging into lexicon and postings tables.
+
+        Runs are merged by duckdb sorting and aggregating them by word, which
+        spills to disk past its own memory limit, then staging is dropped.
+        """
+        LOGGER.info("Merging staged postings in database...")
+        self.insert_documents_refs(con, documents)
+        LOGGER.ok("DocumentsRef inserted")
+
+        con.execute("""
+INSERT INTO lexicon (word_id, word, collection_frequency, document_frequency)
+SELECT row_number() OVER (ORDER BY word), word, SUM(frequency), COUNT(*)
+FROM postings_staging
+GROUP BY word
+""")
+        LOGGER.ok("Lexicon inserted")
+
+        con.execute("""
+INSERT INTO postings (posting_id, lexicon_id, document_id, word_frequency_within_document)
+SELECT row_number() OVER (ORDER BY l.word_id, s.document_id), l.word_id, s.document_id, s.frequency
+FROM postings_staging s
+JOIN lexicon l ON l.word = s.word
+""")
+        LOGGER.ok("Postings inserted")
+        con.execute("DROP TABLE postings_staging")
+
+    def read_collection_files(self, names: list[str] | None = None) -> dict[str, list[Document]]:
+        """
+        Load JSON files from collection directory, all of them or only names.
+        Returns file name -> Document objects, empty or missing files are skipped.
+        """
+        return dict(self.iterate_collection_files(names))
+
+    def iterate_collection_files(self, names: list[str] | None = None) -> Iterator[tuple[str, list[Document]]]:
+        """
+        Same as read_collection_files, reading files one at a time as
+        (file name, Document objects)
         """
         collection_dir = Path(self.COLLECTION_FOLDER)
-        all_collections = []
 
         if not collection_dir.exists():
             print(
                 f"[read_collection_files] Directory not found: {collection_dir}")
-            return all_collections
+            return
 
         # we need determinism as has of documents is used
         for json_file in sorted(collection_dir.glob("*.json")):
             # get filename without extension
             name = json_file.stem
+            if names is not None and name not in names:
+                continue
             documents = self.read_collection_by_name(name)
-            if documents and 0 < len(documents):
-                all_collections.append(documents)
             LOGGER.ok(f"Read {json_file}.json")
-        return all_collections
+            if documents and 0 < len(documents):
+                yield name, documents
 
     def read_collection_by_name(self, name: str) -> list[Document]:
         """
@@ -421,80 +1370,138 @@ VALUES (
 
         return documents
 
-    def get_number_documents_containing_word(self, word: str) -> int:
-        # fetch the lexicon id of word
-        # then count postings entries that reference such id
-        result = self.connection.execute("""
-SELECT COUNT(*) 
-FROM postings 
-WHERE lexicon_id = (SELECT word_id FROM lexicon WHERE word = ?)
-""", [word]).fetchone()
-
-        freq = result[0] if result else 0
-        return freq
-
-    def get_documents_for_word(self, word: str) -> list[DocumentInfoDTO]:
-        results = self.connection.execute("""
-SELECT d.collection_name, d.index, p.word_frequency_within_document, d.words_length
+    def get_words_document_frequencies(self) -> dict[str, int]:
+        """
+        Returns word -> number of documents containing it, for the whole lexicon
+        """
+        return dict(self.connection.execute(
+            "SELECT word, document_frequency FROM lexicon").fetchall())
+
+    def get_word_postings(self, word: str) -> tuple[np.ndarray, ...]:
+        """
+        Postings of word and their documents as arrays, served from the
+        postings cache when word was read already. Returns (document_ids,
+        word_frequencies_within_document, words_lengths, collection_codes,
+        indexes, collection_names), documents ordered by document_id and
+        collection_codes pointing into collection_names
+        """
+        postings = self.postings_cache.get(word)
+        if postings is not None:
+            return postings
+
+        # own cursor, as queries run concurrently
+        con = self.connection.cursor()
+        try:
+            results = con.execute("""
+SELECT p.document_id, p.word_frequency_within_document, d.words_length, d.collection_name, d.index
 FROM lexicon l
 JOIN postings p ON l.word_id = p.lexicon_id
 JOIN documents d ON p.document_id = d.document_id
 WHERE l.word = ?
-""", [word]).fetchall()
-
-        return [DocumentInfoDTO(
-                collection_name=r[0], index=r[1], word_frequency_within_document=r[2], words_length=r[3]) for r in results]
+ORDER BY p.document_id
+""", [word]).fetchnumpy()
+        finally:
+            con.close()
+
+        collection_names, collection_codes = np.unique(
+            results["collection_name"], return_inverse=True)
+        postings = (
+            results["document_id"].astype(np.int32),
+            results["word_frequency_within_document"].astype(np.int32),
+            results["words_length"].astype(np.int32),
+            collection_codes.astype(np.uint16),
+            results["index"].astype(np.int32),
+            collection_names,
+        )
+        # words missing from the lexicon are not worth a slot
+        if len(postings[0]) > 0:
+            self.postings_cache.put(word, postings)
+        return postings
 
     def filter_documents(self, docs_scores: dict[tuple[str, int], int], platform: str, category: str, status: str, tags: list[str]) -> dict[tuple[str, int], int]:
-        sub_collections: dict[str, list[Document]] = {}
+        """
+        Keeps scored documents matching filters. Keys of the scored documents
+        are registered as a relation and joined against the documents
+        attributes in a single query, so that only scored documents are
+        matched and no document is read. Filters are normalized (see
+        BM25.normalize_filters)
+        """
+        tags = tags or []
+        if not platform and not category and not status and len(tags) == 0:
+            return docs_scores
+        if len(docs_scores) == 0:
+            return docs_scores
+
+        predicates: list[str] = []
+        parameters: list = []
+        if platform:
+            predicates.append(
+                "d.document_id IN (SELECT document_id FROM document_platforms WHERE platform = ?)")
+            parameters.append(platform)
+        if category:
+            predicates.append("d.category = ?")
+            parameters.append(category)
+        if status:
+            predicates.append("d.status = ?")
+            parameters.append(status)
+        if len(tags) > 0:
+            # documents holding all of the tags
+            predicates.append(f"""d.document_id IN (
+	SELECT document_id
+	FROM document_tags
+	WHERE tag IN ({", ".join("?" for _ in tags)})
+	GROUP BY document_id
+	HAVING COUNT(*) = ?
+)""")
+            parameters.extend(tags)
+            parameters.append(len(tags))
+
+        candidates = {
+            "collection_name": np.array([doc[0] for doc in docs_scores], dtype=object),
+            "index": np.array([doc[1] for doc in docs_scores], dtype=np.int64),
+        }
+        # own cursor, as queries run concurrently, candidates are registered on it only
+        con = self.connection.cursor()
+        try:
+            con.register("candidates", candidates)
+            rows = con.execute(f"""
+SELECT d.collection_name, d.index
+FROM candidates c
+JOIN documents d ON d.collection_name = c.collection_name AND d.index = c.index
+WHERE {" AND ".join(predicates)}
+""", parameters).fetchall()
+        finally:
+            con.close()
+
+        matches = set(rows)
+        return {doc: score for doc, score in docs_scores.items() if doc in matches}
+
+    def filter_documents_in_store(self, docs_scores: dict[tuple[str, int], int], platform: str, category: str, status: str, tags: list[str]) -> dict[tuple[str, int], int]:
+        """
+        Same as filter_documents but checking the attributes of each document
+        of the document store, for documents that are not in the db
+        """
         new_docs_scores: dict[tuple[str, int], int] = {}
 
         for doc, score in docs_scores.items():
-            cname = doc[0]
-
-            if cname not in sub_collections:
-                sub_collections[cname] = self.read_collection_by_name(cname)
-
             # check filters for document
             index = doc[1]
-            if index < len(sub_collections[cname]):
-                d: Document = sub_collections[cname][index]
-
-                if platform and platform != "":
-                    if not d.metadata.platforms:
-                        continue
-
-                    lowercase_d_platforms = [
-                        platform.lower() for platform in d.metadata.platforms]
-                    if platform not in lowercase_d_platforms:
-                        continue
-
-                if category and category != "":
-                    if not d.metadata.category or category.lower() != d.metadata.category.lower():
-                        continue
-
-                if status and status != "":
-                    if not d.metadata.status or status.lower() != d.metadata.status.lower():
-                        continue
-
-                if tags and len(tags) > 0:
-                    if not d.metadata.tags or len(d.metadata.tags) == 0:
-                        continue
-
-                    lowercase_d_tags = [tag.lower() for tag in d.metadata.tags]
-                    missing_one = False
-                    for tag in tags:
-                        if tag.lower() not in lowercase_d_tags:
-                            missing_one = True
-                            break
-
-                    if missing_one:
-                        continue
-
-                # we got here
-                new_docs_scores[doc] = score
-            else:
+            d: Document | None = self.document_store.get(doc[0], index)
+            if d is None:
                 LOGGER.error(f"Index out of bounds for collection: {index}")
+                continue
+
+            attributes = self.document_attributes(d)
+            if platform and platform not in attributes["platforms"]:
+                continue
+            if category and category != attributes["category"]:
+                continue
+            if status and status != attributes["status"]:
+                continue
+            if tags and not set(tags) <= set(attributes["tags"]):
+                continue
+
+            new_docs_scores[doc] = score
 
         return new_docs_scores
 
@@ -502,8 +1509,4 @@ WHERE l.word = ?
         if not collection:
             return None
 
-        documents: list[Document] = self.read_collection_by_name(collection)
-        for d in documents:
-            if d.id == id:
-                return d
-        return None
+        return self.document_store.get_by_id(collection, id)
@@ -0,0 +1,118 @@
+import numpy as np
+from duckdb import DuckDBPyConnection
+
+from utils.logger import LOGGER
+
+
+class MemoryIndex():
+    """
+    Array backed copy of the inverted index, loaded once from the db so
+    that queries never hit SQL.
+
+    Postings are stored CSR style, for the term with id t:
+    - doc_ids[term_offsets[t]:term_offsets[t + 1]] are the documents containing it
+    - term_frequencies[...] are the word frequencies within those documents
+
+    Document ids are dense positions (0..n_documents) into doc_lengths and
+    doc_keys, not the document_id of the documents table.
+    """
+    # word -> term id
+    words: dict[str, int]
+    term_offsets: np.ndarray
+    doc_ids: np.ndarray
+    term_frequencies: np.ndarray
+
+    # dense document id -> words_length and (collection_name, index)
+    doc_lengths: np.ndarray
+    doc_keys: list[tuple[str, int]]
+
+    def __init__(self, connection: DuckDBPyConnection):
+        LOGGER.info("Loading inverted index in memory...")
+        self.load(connection)
+        LOGGER.ok(
+            f"Inverted index loaded in memory: {len(self.words)} words, {len(self.doc_ids)} postings")
+
+    @classmethod
+    def from_arrays(cls, words: dict[str, int], term_offsets: np.ndarray, doc_ids: np.ndarray, term_frequencies: np.ndarray, doc_lengths: np.ndarray, doc_keys: list[tuple[str, int]]) -> "MemoryIndex":
+        """
+        Builds an index from arrays already laid out, without the db
+        """
+        index = cls.__new__(cls)
+        index.words = words
+        index.term_offsets = term_offsets
+        index.doc_ids = doc_ids
+        index.term_frequencies = term_frequencies
+        index.doc_lengths = doc_lengths
+        index.doc_keys = doc_keys
+        return index
+
+    def load(self, con: DuckDBPyConnection):
+        """
+        Reads documents, lexicon and postings tables into arrays
+        """
+        documents = con.execute("""
+SELECT document_id, collection_name, index, words_length
+FROM documents
+ORDER BY document_id
+""").fetchnumpy()
+        # document_id is not guaranteed contiguous, map it to its dense position
+        document_ids = documents["document_id"].astype(np.int64)
+        self.doc_lengths = documents["words_length"].astype(np.float64)
+        self.doc_keys = list(zip(documents["collection_name"].tolist(),
+                                 documents["index"].tolist()))
+
+        lexicon = con.execute("""
+SELECT word_id, word
+FROM lexicon
+ORDER BY word_id
+""").fetchnumpy()
+        word_ids = lexicon["word_id"].astype(np.int64)
+        self.words = {word: term for term,
+                      word in enumerate(lexicon["word"].tolist())}
+
+        postings = con.execute("""
+SELECT lexicon_id, document_id, word_frequency_within_document
+FROM postings
+ORDER BY lexicon_id, document_id
+""").fetchnumpy()
+        terms = np.searchsorted(
+            word_ids, postings["lexicon_id"].astype(np.int64))
+        self.doc_ids = np.searchsorted(
+            document_ids, postings["document_id"].astype(np.int64)).astype(np.int32)
+        self.term_frequencies = postings["word_frequency_within_document"].astype(
+            np.int32)
+
+        # term t postings span term_offsets[t]:term_offsets[t + 1]
+        counts = np.bincount(terms, minlength=len(word_ids))
+        self.term_offsets = np.zeros(len(word_ids) + 1, dtype=np.int64)
+        np.cumsum(counts, out=self.term_offsets[1:])
+
+    @property
+    def documents_number(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def document_frequencies(self) -> np.ndarray:
+        """
+        Number of documents containing each term
+        """
+        return np.diff(self.term_offsets)
+
+    def postings(self, word: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Returns (doc_ids, term_frequencies) of word, None if word is not in the lexicon
+        """
+        term = self.words.get(word, None)
+        if term is None:
+            return None
+        start, end = self.term_offsets[term], self.term_offsets[term + 1]
+        return self.doc_ids[start:end], self.term_frequencies[start:end]
+
+    def all_postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Returns (terms, doc_ids, term_frequencies) of every posting, ordered
+        by term then doc id
+        """
+        terms = np.repeat(np.arange(len(self.words)),
+                          self.document_frequencies)
+        return terms, self.doc_ids, self.term_frequencies
@@ -1,4 +1,5 @@
 
+import re
 import string
 
 import nltk
@@ -9,6 +10,11 @@ from utils.logger import LOGGER
 
 
 class Parser():
+    # "words within quotes", optionally followed by ~N words allowed in between
+    PHRASE = re.compile(r'"([^"]*)"(?:~(\d+))?')
+    # runs of characters the tokenizer splits text in
+    TOKEN = re.compile(r"\S+")
+
     stemmer: PorterStemmer
 
     def __init__(self):
@@ -48,3 +54,32 @@ class Parser():
         """
         words = self.tokenizer(text)
         return self.stemming(self.stopwords_removal(words))
+
+    def parse_text_to_words_offsets(self, text: str) -> tuple[list[str], list[tuple[int, int]]]:
+        """
+        Same words as parse_text_to_words, along with the (start, end)
+        characters of text each was parsed from
+        """
+        punctuation = str.maketrans('', '', string.punctuation)
+        stop_words = set(stopwords.words('english'))
+        words: list[str] = []
+        offsets: list[tuple[int, int]] = []
+        for match in self.TOKEN.finditer(text):
+            word = match.group().translate(punctuation).lower()
+            if word and word not in stop_words:
+                words.append(word)
+                offsets.append(match.span())
+        return self.stemming(words), offsets
+
+    def parse_query(self, text: str) -> tuple[list[str], list[tuple[list[str], int]]]:
+        """
+        Takes a query and converts it to words, as parse_text_to_words, and
+        phrases as (words, slop). Words of phrases are query words too,
+        phrases of a single word are words only
+        """
+        phrases: list[tuple[list[str], int]] = []
+        for match in self.PHRASE.finditer(text):
+            words = self.parse_text_to_words(match.group(1))
+            if len(words) > 1:
+                phrases.append((words, int(match.group(2) or 0)))
+        return self.parse_text_to_words(self.PHRASE.sub(r" \1 ", text)), phrases
@@ -0,0 +1,320 @@
+from pathlib import Path
+import struct
+from typing import Iterable
+
+import numpy as np
+
+from app.engine.memory import MemoryIndex
+from app.engine.sections import SectionedFile, doc_keys_sections, read_header, write_sections
+from app.engine.segment import decode_varints, encode_varints
+from utils.logger import LOGGER
+
+
+# magic, version, terms, documents, postings, collection hash
+HEADER = struct.Struct("<8sIIIQ64s")
+MAGIC = b"SGPOSITN"
+VERSION = 3
+# sections stored after the header, each with u64 start and end offsets
+SECTIONS = [
+    "words",
+    "collections",
+    "doc_collections",
+    "doc_indexes",
+    "posting_offsets",
+    "doc_ids",
+    "position_byte_offsets",
+    "position_stream",
+    "offset_byte_offsets",
+    "offset_stream",
+]
+
+
+def write_positions(path: Path, index: MemoryIndex, documents_words: Iterable[tuple[int, list[str], list[tuple[int, int]]]], collection_hash: str):
+    """
+    Writes the positions of every word within every document of the index,
+    given the parsed words of each document and the characters each was
+    parsed from as (doc id, words, offsets):
+
+    - postings are the ones of index, same words and doc ids
+    - positions of each posting are delta encoded, then varint encoded
+    - a byte offset per posting gives the range of its positions
+    - characters of each position of a document are encoded as the gap
+      since the previous word end and the word length, varint encoded,
+      with a byte offset per document
+    """
+    LOGGER.info(f"Writing positions {path}...")
+    terms: list[np.ndarray] = []
+    doc_ids: list[np.ndarray] = []
+    positions: list[np.ndarray] = []
+    # (start - previous end, end - start) of every word, in doc ids order
+    offsets: list[np.ndarray] = []
+    for doc_id, words, word_offsets in documents_words:
+        if doc_id != len(offsets):
+            raise Exception("parsed documents are not in doc ids order")
+        spans = np.array(word_offsets, dtype=np.int64).reshape(-1, 2)
+        gaps = spans.copy()
+        gaps[:, 1] -= spans[:, 0]
+        gaps[1:, 0] -= spans[:-1, 1]
+        offsets.append(gaps.ravel())
+
+        document_terms = np.array([index.words.get(word, -1)
+                                  for word in words], dtype=np.int32)
+        known = document_terms >= 0
+        terms.append(document_terms[known])
+        doc_ids.append(np.full(int(known.sum()), doc_id, dtype=np.int32))
+        positions.append(np.flatnonzero(known).astype(np.int32))
+
+    all_terms = np.concatenate(terms) if terms else np.zeros(0, np.int32)
+    all_doc_ids = np.concatenate(doc_ids) if doc_ids else np.zeros(0, np.int32)
+    all_positions = np.concatenate(
+        positions) if positions else np.zeros(0, np.int32)
+    order = np.lexsort((all_positions, all_doc_ids, all_terms))
+    all_terms, all_doc_ids, all_positions = all_terms[order], all_doc_ids[order], all_positions[order]
+
+    # a posting starts wherever term or document changes
+    starts = np.ones(len(order), dtype=bool)
+    starts[1:] = (all_terms[1:] != all_terms[:-1]) | (
+        all_doc_ids[1:] != all_doc_ids[:-1])
+    posting_starts = np.flatnonzero(starts)
+    if len(posting_starts) != len(index.doc_ids) or not np.array_equal(all_doc_ids[posting_starts], index.doc_ids):
+        raise Exception("parsed documents don't match the index postings")
+
+    # delta encode positions, restarting at each posting first position
+    deltas = all_positions.astype(np.int64)
+    deltas[1:] -= all_positions[:-1]
+    deltas[posting_starts] = all_positions[posting_starts]
+    position_stream, position_bytes = encode_varints(deltas)
+    position_byte_offsets = np.concatenate(([0], np.cumsum(position_bytes)))[
+        np.append(posting_starts, len(order))]
+
+    if len(offsets) != index.documents_number:
+        raise Exception("parsed documents don't match the index documents")
+    offset_stream, offset_bytes = encode_varints(
+        np.concatenate(offsets) if offsets else np.zeros(0, np.int64))
+    offset_byte_offsets = np.concatenate(([0], np.cumsum(offset_bytes)))[
+        np.cumsum([0] + [len(o) for o in offsets])]
+
+    words = sorted(index.words, key=index.words.get)
+
+    sections = {
+        "words": "\n".join(words).encode("utf-8"),
+        **doc_keys_sections(index.doc_keys),
+        "posting_offsets": index.term_offsets.astype("<u8").tobytes(),
+        "doc_ids": index.doc_ids.astype("<u4").tobytes(),
+        "position_byte_offsets": position_byte_offsets.astype("<u8").tobytes(),
+        "position_stream": position_stream.tobytes(),
+        "offset_byte_offsets": offset_byte_offsets.astype("<u8").tobytes(),
+        "offset_stream": offset_stream.tobytes(),
+    }
+
+    size = write_sections(path, HEADER.pack(MAGIC, VERSION, len(words), index.documents_number,
+                          len(index.doc_ids), collection_hash.encode("ascii")), SECTIONS, sections)
+    LOGGER.ok(
+        f"Positions written: {size} bytes, {len(order)} positions")
+
+
+def read_positions_hash(path: Path) -> str | None:
+    """
+    Returns the collection hash positions were written for, None if there are no valid positions
+    """
+    header = read_header(path, HEADER, MAGIC, VERSION)
+    return header[-1].decode("ascii") if header is not None else None
+
+
+class PositionIndex(SectionedFile):
+    """
+    Read only view over a positions file mapped in memory, to match phrases.
+
+    Doc ids are the dense ids of MemoryIndex. Positions count parsed words,
+    stopwords removed, so that "the very organized theft" is three adjacent
+    words. Only positions of candidate documents are decoded. Characters of
+    each position within the document text are kept too, for snippets.
+    """
+    HEADER = HEADER
+    MAGIC = MAGIC
+    VERSION = VERSION
+    SECTIONS = SECTIONS
+    KIND = "a positions file"
+
+    collection_hash: str
+
+    words: dict[str, int]
+    doc_keys: list[tuple[str, int]]
+    # (collection_name, index) -> doc id
+    keys: dict[tuple[str, int], int]
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Mapping positions {path}...")
+        super().__init__(path)
+        _, _, n_terms, n_documents, _, collection_hash = self.header
+        self.collection_hash = collection_hash.decode("ascii")
+        self.words = self.section_words(n_terms)
+
+        self.posting_offsets = self.section_array("posting_offsets", "<u8")
+        self.doc_ids = self.section_array("doc_ids", "<u4")
+        self.position_byte_offsets = self.section_array(
+            "position_byte_offsets", "<u8")
+        self.position_stream = self.section_array("position_stream", "<u1")
+
+        self.doc_keys = self.section_doc_keys(n_documents)
+
+        self.offset_byte_offsets = self.section_array(
+            "offset_byte_offsets", "<u8")
+        self.offset_stream = self.section_array("offset_stream", "<u1")
+        self.keys = {key: doc_id for doc_id, key in enumerate(self.doc_keys)}
+        LOGGER.ok(f"Positions mapped: {n_terms} words, {n_documents} documents")
+
+    @property
+    def documents_number(self) -> int:
+        return len(self.doc_keys)
+
+    def term_doc_ids(self, term: int) -> np.ndarray:
+        start, end = self.posting_offsets[term:term + 2]
+        return self.doc_ids[start:end].astype(np.int64)
+
+    def positions_keys(self, term: int, documents: np.ndarray) -> np.ndarray:
+        """
+        Positions of term within sorted documents containing it, as
+        doc id << 32 | position, sorted
+        """
+        start = int(self.posting_offsets[term])
+        postings = start + \
+            np.searchsorted(self.term_doc_ids(term), documents)
+        byte_starts = self.position_byte_offsets[postings].astype(np.int64)
+        byte_counts = self.position_byte_offsets[postings + 1].astype(
+            np.int64) - byte_starts
+
+        # gather bytes of all postings at once
+        gathered_starts = np.cumsum(byte_counts) - byte_counts
+        gather = np.arange(int(byte_counts.sum())) + \
+            np.repeat(byte_starts - gathered_starts, byte_counts)
+        data = self.position_stream[gather]
+
+        # positions deltas restart at each posting first position
+        counts = np.add.reduceat(
+            (data < 0x80).astype(np.int64), gathered_starts)
+        sums = np.cumsum(decode_varints(data))
+        before = np.concatenate(([0], sums))[np.cumsum(counts) - counts]
+        positions = sums - np.repeat(before, counts)
+        return (np.repeat(documents, counts) << 32) | positions
+
+    def word_offsets(self, doc_id: int) -> np.ndarray:
+        """
+        (start, end) characters of each position of doc id within its text
+        """
+        start, end = self.offset_byte_offsets[doc_id:doc_id + 2]
+        gaps = decode_varints(self.offset_stream[start:end]).reshape(-1, 2)
+        ends = np.cumsum(gaps.sum(axis=1))
+        return np.stack((ends - gaps[:, 1], ends), axis=1)
+
+    def documents_terms(self) -> tuple[list[str], np.ndarray, np.ndarray]:
+        """
+        Parsed words of every document as written, to copy them over to
+        another positions file: words by term, the term at every position
+        of every document in doc ids then positions order, and the start of
+        each document within them. Every posting is decoded at once
+        """
+        terms_number = len(self.posting_offsets) - 1
+        postings_counts = np.diff(self.posting_offsets.astype(np.int64))
+        data = self.position_stream
+        # values of each posting, counted by their last bytes
+        last_bytes = np.concatenate(([0], np.cumsum(data < 0x80)))
+        counts = np.diff(last_bytes[self.position_byte_offsets.astype(np.int64)])
+
+        # positions deltas restart at each posting first position
+        sums = np.cumsum(decode_varints(data))
+        before = np.concatenate(([0], sums))[np.cumsum(counts) - counts]
+        positions = sums - np.repeat(before, counts)
+        terms = np.repeat(np.repeat(
+            np.arange(terms_number), postings_counts), counts)
+        doc_ids = np.repeat(self.doc_ids.astype(np.int64), counts)
+
+        order = np.lexsort((positions, doc_ids))
+        starts = np.concatenate(([0], np.cumsum(
+            np.bincount(doc_ids, minlength=self.documents_number))))
+        # every parsed word is a lexicon word, so positions have no holes
+        expected = np.arange(len(order)) - \
+            np.repeat(starts[:-1], np.diff(starts))
+        if not np.array_equal(positions[order], expected):
+            raise Exception("positions of a document are missing")
+
+        words = sorted(self.words, key=self.words.get)
+        return words, terms[order], starts
+
+    def document_positions(self, doc_id: int, words: list[str]) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Sorted positions of words within doc id and the index within words
+        of the word at each
+        """
+        positions: list[np.ndarray] = []
+        indexes: list[np.ndarray] = []
+        document = np.array([doc_id], dtype=np.int64)
+        for i, word in enumerate(words):
+            term = self.words.get(word, None)
+            if term is None:
+                continue
+            doc_ids = self.term_doc_ids(term)
+            found = np.searchsorted(doc_ids, doc_id)
+            if found == len(doc_ids) or doc_ids[found] != doc_id:
+                continue
+            keys = self.positions_keys(term, document)
+            positions.append(keys & 0xFFFFFFFF)
+            indexes.append(np.full(len(keys), i, dtype=np.int64))
+        if len(positions) == 0:
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        positions_all = np.concatenate(positions)
+        order = np.argsort(positions_all, kind="stable")
+        return positions_all[order], np.concatenate(indexes)[order]
+
+    def phrase_documents(self, words: list[str], slop: int = 0, candidates: np.ndarray | None = None) -> np.ndarray:
+        """
+        Sorted doc ids of documents holding words in order, each within
+        1 + slop positions of the previous one (adjacent when slop is 0),
+        among candidates if given. We do:
+
+        - intersect doc ids of the phrase words, rarest first, so that
+          positions are decoded only for documents holding all of them
+        - keep positions of the first word, then for each next word keep
+          its positions following a kept one closely enough
+        """
+        terms = [self.words.get(word, None) for word in words]
+        if len(terms) == 0 or None in terms:
+            return np.zeros(0, dtype=np.int64)
+
+        documents = candidates.astype(
+            np.int64) if candidates is not None else None
+        for term in sorted(set(terms), key=lambda t: self.posting_offsets[t + 1] - self.posting_offsets[t]):
+            doc_ids = self.term_doc_ids(term)
+            documents = doc_ids if documents is None else np.intersect1d(
+                documents, doc_ids, assume_unique=True)
+            if len(documents) == 0:
+                return documents
+        if len(terms) == 1:
+            return documents
+
+        ends = self.positions_keys(terms[0], documents)
+        for term in terms[1:]:
+            keys = self.positions_keys(term, documents)
+            # closest kept position before each position of term
+            previous = np.searchsorted(ends, keys, side="left") - 1
+            follows = previous >= 0
+            follows[follows] = keys[follows] - \
+                ends[previous[follows]] <= 1 + slop
+            ends = keys[follows]
+            if len(ends) == 0:
+                return np.zeros(0, dtype=np.int64)
+        return np.unique(ends >> 32)
+
+
+def words_hold_phrase(document_words: list[str], words: list[str], slop: int = 0) -> bool:
+    """
+    Same match as PositionIndex.phrase_documents over the parsed words of a
+    single document
+    """
+    ends = [i for i, word in enumerate(document_words) if word == words[0]]
+    for word in words[1:]:
+        positions = [i for i, w in enumerate(document_words) if w == word]
+        ends = [p for p in positions if any(0 < p - end <= 1 + slop for end in ends)]
+        if len(ends) == 0:
+            return False
+    return len(ends) > 0
@@ -0,0 +1,79 @@
+import numpy as np
+
+from utils.logger import LOGGER
+
+
+def find_postings(doc_ids: np.ndarray, documents: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Looks sorted documents up within a word postings doc ids.
+
+    Returns positions within postings of the documents found, and whether
+    each document was found
+    """
+    positions = np.searchsorted(doc_ids, documents)
+    found = positions < len(doc_ids)
+    found[found] = doc_ids[positions[found]] == documents[found]
+    return positions[found], found
+
+
+class ScoreBounds():
+    """
+    Upper bounds of the score a word can add to a document, over the
+    postings of an index generation:
+
+    - term_max: maximum score of each term postings
+    - block_max: maximum score within each block of BLOCK_SIZE postings,
+      term t blocks span block_offsets[t]:block_offsets[t + 1]
+    - block_last: last doc id of each block, to find the block of a document
+
+    Documents whose bound can't reach the current k-th score are skipped
+    without scoring them.
+    """
+    BLOCK_SIZE: int = 64
+
+    term_max: np.ndarray
+    block_offsets: np.ndarray
+    block_max: np.ndarray
+    block_last: np.ndarray
+
+    def __init__(self, document_frequencies: np.ndarray, doc_ids: np.ndarray, scores: np.ndarray):
+        """
+        doc_ids and scores are those of every posting, ordered by term then
+        doc id, document_frequencies the number of postings of each term
+        """
+        LOGGER.info("Computing score bounds...")
+        counts = document_frequencies.astype(np.int64)
+        term_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(counts, out=term_offsets[1:])
+        n_blocks = (counts + self.BLOCK_SIZE - 1) // self.BLOCK_SIZE
+        self.block_offsets = np.zeros(len(counts) + 1, dtype=np.int64)
+        np.cumsum(n_blocks, out=self.block_offsets[1:])
+
+        # first and last posting of each block
+        block_rank = np.arange(self.block_offsets[-1]) - \
+            np.repeat(self.block_offsets[:-1], n_blocks)
+        block_starts = np.repeat(
+            term_offsets[:-1], n_blocks) + block_rank * self.BLOCK_SIZE
+        block_ends = np.minimum(block_starts + self.BLOCK_SIZE,
+                                np.repeat(term_offsets[1:], n_blocks))
+
+        self.block_max = np.maximum.reduceat(
+            scores, block_starts) if len(block_starts) > 0 else np.zeros(0)
+        self.block_last = doc_ids[block_ends - 1].astype(np.int64)
+        self.term_max = np.zeros(len(counts), dtype=np.float64)
+        non_empty = n_blocks > 0
+        if non_empty.any():
+            self.term_max[non_empty] = np.maximum.reduceat(
+                self.block_max, self.block_offsets[:-1][non_empty])
+        LOGGER.ok(f"Score bounds computed: {len(block_starts)} blocks")
+
+    def documents_bounds(self, term: int, doc_ids: np.ndarray) -> np.ndarray:
+        """
+        Block-max bound of term for each document, 0 past its last block
+        """
+        start, end = self.block_offsets[term], self.block_offsets[term + 1]
+        blocks = np.searchsorted(self.block_last[start:end], doc_ids)
+        bounds = np.zeros(len(doc_ids), dtype=np.float64)
+        inside = blocks < end - start
+        bounds[inside] = self.block_max[start:end][blocks[inside]]
+        return bounds
@@ -0,0 +1,23 @@
+import numpy as np
+
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def bm25_idf(n_documents: int | np.ndarray, collection_documents_number: int) -> float | np.ndarray:
+    """
+    IDF given the number of documents containing a word, also over arrays
+    """
+    return np.log((collection_documents_number - n_documents + 0.5) / (n_documents + 0.5) + 1)
+
+
+def bm25_scores(idf: float | np.ndarray, frequencies: np.ndarray, doc_lengths: np.ndarray, average_document_length: float, k1: float = K1, b: float = B) -> np.ndarray:
+    """
+    Scores of postings given their word IDF, frequencies and documents lengths
+    """
+    top = frequencies * (k1 + 1)
+    bottom = frequencies + k1 * \
+        (1 - b + b * (doc_lengths / average_document_length))
+    return idf * (top / bottom)
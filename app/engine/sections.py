@@ -0,0 +1,133 @@
+import mmap
+from pathlib import Path
+import struct
+
+import numpy as np
+
+
+# sections start on multiples of ALIGNMENT bytes, so arrays are aligned views
+ALIGNMENT = 8
+
+
+def offsets_struct(names: list[str]) -> struct.Struct:
+    """
+    u64 start and end offsets of each section, stored after the header
+    """
+    return struct.Struct(f"<{2 * len(names)}Q")
+
+
+def write_sections(path: Path, header: bytes, names: list[str], sections: dict[str, bytes]) -> int:
+    """
+    Writes a sectioned file: header, offsets of each section of names, then
+    sections in names order, each aligned.
+
+    The file is written aside and renamed, readers may have the old one
+    mapped. Returns the file size
+    """
+    offsets_layout = offsets_struct(names)
+    offsets = []
+    position = len(header) + offsets_layout.size
+    for name in names:
+        position += -position % ALIGNMENT
+        offsets.append(position)
+        position += len(sections[name])
+        offsets.append(position)
+
+    tmp_path = path.with_name(path.name + ".tmp")
+    with open(tmp_path, "wb") as f:
+        f.write(header)
+        f.write(offsets_layout.pack(*offsets))
+        for name, offset in zip(names, offsets[::2]):
+            f.write(b"\0" * (offset - f.tell()))
+            f.write(sections[name])
+    tmp_path.replace(path)
+    return position
+
+
+def read_header(path: Path, header: struct.Struct, magic: bytes, version: int) -> tuple | None:
+    """
+    Returns the unpacked header of a sectioned file, starting with magic and
+    version, None if there is no valid file
+    """
+    try:
+        with open(path, "rb") as f:
+            values = header.unpack(f.read(header.size))
+    except Exception as _:
+        return None
+    if values[0] != magic or values[1] != version:
+        return None
+    return values
+
+
+def doc_keys_sections(doc_keys: list[tuple[str, int]]) -> dict[str, bytes]:
+    """
+    "collections", "doc_collections" and "doc_indexes" sections holding the
+    (collection_name, index) of each doc id
+    """
+    collections = sorted({key[0] for key in doc_keys})
+    collections_codes = {name: code for code, name in enumerate(collections)}
+    return {
+        "collections": "\n".join(collections).encode("utf-8"),
+        "doc_collections": np.array([collections_codes[key[0]] for key in doc_keys], dtype="<u2").tobytes(),
+        "doc_indexes": np.array([key[1] for key in doc_keys], dtype="<u4").tobytes(),
+    }
+
+
+class SectionedFile():
+    """
+    Read only view over a sectioned file mapped in memory, as written by
+    write_sections. Subclasses set the header layout, its magic and version,
+    and the section names.
+    """
+    HEADER: struct.Struct
+    MAGIC: bytes
+    VERSION: int
+    SECTIONS: list[str]
+    # what the file is, for errors
+    KIND: str
+
+    # unpacked header
+    header: tuple
+    # section name -> (start, end)
+    sections: dict[str, tuple[int, int]]
+
+    def __init__(self, path: Path):
+        with open(path, "rb") as f:
+            self.buffer = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.header = self.HEADER.unpack_from(self.buffer, 0)
+        if self.header[0] != self.MAGIC or self.header[1] != self.VERSION:
+            raise Exception(f"{path} is not {self.KIND}")
+        offsets = offsets_struct(self.SECTIONS).unpack_from(
+            self.buffer, self.HEADER.size)
+        self.sections = {name: (offsets[2 * i], offsets[2 * i + 1])
+                         for i, name in enumerate(self.SECTIONS)}
+
+    def section_bytes(self, name: str) -> bytes:
+        start, end = self.sections[name]
+        return self.buffer[start:end]
+
+    def section_array(self, name: str, dtype: str) -> np.ndarray:
+        """
+        Zero-copy view of a section
+        """
+        start, end = self.sections[name]
+        itemsize = np.dtype(dtype).itemsize
+        return np.frombuffer(self.buffer, dtype=dtype, count=(end - start) // itemsize, offset=start)
+
+    def section_words(self, n_terms: int) -> dict[str, int]:
+        """
+        Word -> term of the "words" section
+        """
+        words = self.section_bytes("words").decode("utf-8")
+        return {word: term for term, word in enumerate(words.split("\n"))} if n_terms > 0 else {}
+
+    def section_doc_keys(self, n_documents: int) -> list[tuple[str, int]]:
+        """
+        (collection_name, index) of each doc id, see doc_keys_sections
+        """
+        collections = self.section_bytes("collections").decode("utf-8").split("\n")
+        doc_collections = self.section_array("doc_collections", "<u2")
+        doc_indexes = self.section_array("doc_indexes", "<u4")
+        return [(collections[c], i) for c, i in zip(
+            doc_collections.tolist(), doc_indexes.tolist())] if n_documents > 0 else []
@@ -0,0 +1,214 @@
+from pathlib import Path
+import struct
+
+import numpy as np
+
+from app.engine.memory import MemoryIndex
+from app.engine.sections import SectionedFile, doc_keys_sections, read_header, write_sections
+from utils.logger import LOGGER
+
+
+# magic, version, terms, documents, postings, collection hash
+HEADER = struct.Struct("<8sIIIQ64s")
+MAGIC = b"SGSEGMNT"
+VERSION = 2
+# sections stored after the header, each with u64 start and end offsets
+SECTIONS = [
+    "words",
+    "collections",
+    "doc_collections",
+    "doc_indexes",
+    "doc_lengths",
+    "posting_offsets",
+    "doc_byte_offsets",
+    "frequency_byte_offsets",
+    "doc_stream",
+    "frequency_stream",
+    "documents",
+]
+
+
+def encode_varints(values: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    LEB128 encodes values: 7 bits per byte, high bit set on all bytes but
+    the last of each value.
+
+    Returns encoded bytes and number of bytes of each value
+    """
+    values = values.astype(np.uint64)
+    n_bytes = np.ones(len(values), dtype=np.int64)
+    rest = values >> np.uint64(7)
+    while rest.any():
+        n_bytes += rest > 0
+        rest >>= np.uint64(7)
+
+    out = np.empty(int(n_bytes.sum()), dtype=np.uint8)
+    starts = np.cumsum(n_bytes) - n_bytes
+    for k in range(int(n_bytes.max(initial=0))):
+        mask = n_bytes > k
+        byte = (values[mask] >> np.uint64(7 * k)) & np.uint64(0x7F)
+        more = (n_bytes[mask] > k + 1).astype(np.uint64) << np.uint64(7)
+        out[starts[mask] + k] = byte | more
+    return out, n_bytes
+
+
+def decode_varints(data: np.ndarray) -> np.ndarray:
+    """
+    Decodes LEB128 bytes back to values, without a python loop per value
+    """
+    if len(data) == 0:
+        return np.zeros(0, dtype=np.int64)
+
+    # last byte of each value has the high bit unset
+    ends = np.flatnonzero(data < 0x80)
+    starts = np.empty_like(ends)
+    starts[0] = 0
+    starts[1:] = ends[:-1] + 1
+
+    # shift of each byte within its value
+    value_of_byte = np.repeat(np.arange(len(ends)), ends - starts + 1)
+    shifts = (np.arange(len(data)) - starts[value_of_byte]) * 7
+    parts = (data & 0x7F).astype(np.int64) << shifts
+    return np.add.reduceat(parts, starts)
+
+
+def write_segment(path: Path, index: MemoryIndex, collection_hash: str, documents: list[tuple[str, str, str]] | None = None):
+    """
+    Writes the index as a compressed segment file:
+
+    - postings doc ids are delta encoded within each word, then varint encoded
+    - frequencies are varint encoded
+    - a term dictionary holds words and the byte offsets of their postings
+    - documents lengths and keys are stored as plain arrays
+    - optionally (Document.id, content hash, file name) of each document
+    """
+    LOGGER.info(f"Writing segment {path}...")
+    n_terms = len(index.words)
+    starts = index.term_offsets[:-1]
+
+    # delta encode doc ids, restarting at each word first posting
+    deltas = index.doc_ids.astype(np.int64)
+    deltas[1:] -= index.doc_ids[:-1]
+    non_empty = starts[starts < len(deltas)]
+    deltas[non_empty] = index.doc_ids[non_empty]
+
+    doc_stream, doc_bytes = encode_varints(deltas)
+    frequency_stream, frequency_bytes = encode_varints(index.term_frequencies)
+    # byte offset of each word postings within the streams
+    doc_byte_offsets = np.concatenate(
+        ([0], np.cumsum(doc_bytes)))[index.term_offsets]
+    frequency_byte_offsets = np.concatenate(
+        ([0], np.cumsum(frequency_bytes)))[index.term_offsets]
+
+    words = sorted(index.words, key=index.words.get)
+
+    sections = {
+        "words": "\n".join(words).encode("utf-8"),
+        **doc_keys_sections(index.doc_keys),
+        "doc_lengths": index.doc_lengths.astype("<u4").tobytes(),
+        "posting_offsets": index.term_offsets.astype("<u8").tobytes(),
+        "doc_byte_offsets": doc_byte_offsets.astype("<u8").tobytes(),
+        "frequency_byte_offsets": frequency_byte_offsets.astype("<u8").tobytes(),
+        "doc_stream": doc_stream.tobytes(),
+        "frequency_stream": frequency_stream.tobytes(),
+        "documents": "\n".join("\t".join(d) for d in documents).encode("utf-8") if documents else b"",
+    }
+
+    size = write_sections(path, HEADER.pack(MAGIC, VERSION, n_terms, index.documents_number,
+                          len(index.doc_ids), collection_hash.encode("ascii")), SECTIONS, sections)
+    LOGGER.ok(
+        f"Segment written: {size} bytes, {len(index.doc_ids)} postings")
+
+
+def read_segment_hash(path: Path) -> str | None:
+    """
+    Returns the collection hash a segment was written for, None if there is no valid segment
+    """
+    header = read_header(path, HEADER, MAGIC, VERSION)
+    return header[-1].decode("ascii") if header is not None else None
+
+
+class Segment(SectionedFile):
+    """
+    Read only view over a segment file mapped in memory. Exposes the same
+    interface as MemoryIndex so that BM25 scores over either.
+
+    Arrays are numpy views over the mapped file, postings are decoded only
+    when a word is queried. Processes mapping the same segment share it
+    through the OS page cache.
+    """
+    HEADER = HEADER
+    MAGIC = MAGIC
+    VERSION = VERSION
+    SECTIONS = SECTIONS
+    KIND = "a segment"
+
+    collection_hash: str
+
+    words: dict[str, int]
+    doc_lengths: np.ndarray
+    doc_keys: list[tuple[str, int]]
+    # (Document.id, content hash, file name), empty if not written
+    documents: list[tuple[str, str, str]]
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Mapping segment {path}...")
+        super().__init__(path)
+        _, _, n_terms, n_documents, _, collection_hash = self.header
+        self.collection_hash = collection_hash.decode("ascii")
+        self.words = self.section_words(n_terms)
+
+        self.doc_lengths = self.section_array("doc_lengths", "<u4")
+        self.posting_offsets = self.section_array("posting_offsets", "<u8")
+        self.doc_byte_offsets = self.section_array("doc_byte_offsets", "<u8")
+        self.frequency_byte_offsets = self.section_array(
+            "frequency_byte_offsets", "<u8")
+        self.doc_stream = self.section_array("doc_stream", "<u1")
+        self.frequency_stream = self.section_array("frequency_stream", "<u1")
+
+        self.doc_keys = self.section_doc_keys(n_documents)
+        documents = self.section_bytes("documents").decode("utf-8")
+        self.documents = [tuple(d.split("\t")) for d in documents.split("\n")] if documents else []
+        LOGGER.ok(f"Segment mapped: {n_terms} words, {n_documents} documents")
+
+    @property
+    def documents_number(self) -> int:
+        return len(self.doc_lengths)
+
+    @property
+    def document_frequencies(self) -> np.ndarray:
+        """
+        Number of documents containing each term
+        """
+        return np.diff(self.posting_offsets.astype(np.int64))
+
+    def postings(self, word: str) -> tuple[np.ndarray, np.ndarray] | None:
+        """
+        Returns (doc_ids, term_frequencies) of word, None if word is not in the lexicon
+        """
+        term = self.words.get(word, None)
+        if term is None:
+            return None
+
+        doc_start, doc_end = self.doc_byte_offsets[term:term + 2]
+        frequency_start, frequency_end = self.frequency_byte_offsets[term:term + 2]
+        doc_ids = np.cumsum(decode_varints(
+            self.doc_stream[doc_start:doc_end]))
+        frequencies = decode_varints(
+            self.frequency_stream[frequency_start:frequency_end])
+        return doc_ids, frequencies
+
+    def all_postings(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        Decodes every posting at once, returns (terms, doc_ids, term_frequencies)
+        ordered by term then doc id
+        """
+        counts = self.document_frequencies
+        terms = np.repeat(np.arange(len(counts)), counts)
+        # doc ids deltas restart at each word first posting
+        sums = np.cumsum(decode_varints(self.doc_stream))
+        starts = self.posting_offsets[:-1].astype(np.int64)
+        before = np.concatenate(([0], sums))[starts]
+        doc_ids = sums - np.repeat(before, counts)
+        frequencies = decode_varints(self.frequency_stream)
+        return terms, doc_ids, frequencies
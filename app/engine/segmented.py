@@ -0,0 +1,407 @@
+import copy
+import json
+import math
+from pathlib import Path
+import threading
+
+import numpy as np
+
+from app.engine.indexer import Indexer, parse_documents_chunk
+from app.engine.memory import MemoryIndex
+from app.engine.segment import Segment, write_segment
+from collection.models.document import Document
+from utils.logger import LOGGER
+
+
+class LiveSegment():
+    """
+    Immutable segment of the segmented index along with the mask of its
+    deleted documents, the only part of it that changes. Deleting documents
+    makes a new LiveSegment, so that queries holding this one keep the same
+    mask until they end.
+    """
+    name: str
+    segment: Segment
+    deleted: np.ndarray
+
+    def __init__(self, directory: Path, name: str):
+        self.name = name
+        self.segment = Segment(directory / f"{name}.segment")
+        deleted_path = directory / f"{name}.deleted.npy"
+        self.deleted = np.load(deleted_path) if deleted_path.exists() else np.zeros(
+            self.segment.documents_number, dtype=bool)
+
+    def with_deleted(self, documents: list[int]) -> "LiveSegment":
+        """
+        Copy of the live segment with documents deleted too
+        """
+        live = copy.copy(self)
+        live.deleted = self.deleted.copy()
+        live.deleted[documents] = True
+        return live
+
+    @property
+    def live_documents_number(self) -> int:
+        return self.segment.documents_number - int(self.deleted.sum())
+
+    def save_deleted(self, directory: Path):
+        tmp_path = directory / f"{self.name}.deleted.tmp"
+        with open(tmp_path, "wb") as f:
+            np.save(f, self.deleted)
+        tmp_path.replace(directory / f"{self.name}.deleted.npy")
+
+
+class SegmentedIndex():
+    """
+    LSM style layout of the inverted index, a list of immutable segment files
+    within DIRECTORY. We do:
+
+    - startup: reuse segments if they were written for the indexer collection
+      hash, otherwise write a single base segment from the db
+    - ingestion: every ingest_interval seconds collection files are scanned,
+      documents of changed files are matched with stored ones by Document.id,
+      new or changed documents go into a new small segment and removed or
+      changed ones are only marked as deleted
+    - merging: once MERGE_FACTOR segments share a size tier they are merged
+      into one, dropping deleted documents, so that the number of segments
+      stays logarithmic in the collection size
+
+    Ingestion and merging run on a single background thread, the only writer.
+    Queries fan out over a snapshot of the live segments.
+    """
+    DIRECTORY: str = "app/engine/db/segments"
+    STATE_FILE: str = "segments.json"
+    # segments merged at once, and size ratio between tiers
+    MERGE_FACTOR: int = 4
+    # live documents of the smallest tier
+    MIN_SEGMENT_DOCUMENTS: int = 100
+    # segments with more deleted documents are rewritten on their own
+    MAX_DELETED_RATIO: float = 0.5
+
+    indexer: Indexer
+    directory: Path
+    ingest_interval: int
+
+    # live segments, replaced as a whole under lock
+    segments: list[LiveSegment]
+    next_segment: int = 0
+    # collection files as of the last ingestion
+    manifest: dict
+    collection_hash: str
+    # bumped whenever live documents change, merges keep it
+    generation: int = 0
+
+    # live collection related info
+    documents_number: int = 0
+    average_document_length: float = 0
+
+    def __init__(self, indexer: Indexer, ingest_interval: int = 30):
+        LOGGER.info("Initializing segmented index...")
+        self.indexer = indexer
+        self.directory = Path(self.DIRECTORY)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.ingest_interval = ingest_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+
+        state = self.load_state()
+        if state is not None and state["collection_hash"] == indexer.collection_hash:
+            self.segments = [LiveSegment(self.directory, name)
+                             for name in state["segments"]]
+            self.next_segment = state["next_segment"]
+        else:
+            self.write_base_segment()
+        self.collection_hash = indexer.collection_hash
+        self.manifest = indexer.load_collection_manifest() or {}
+        self.refresh_statistics()
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+        LOGGER.ok(
+            f"Segmented index initialized: {len(self.segments)} segments, {self.documents_number} documents")
+
+    def load_state(self) -> dict | None:
+        """
+        Loads live segments names of the last run, None if missing
+        """
+        try:
+            with open(self.directory / self.STATE_FILE, "r") as f:
+                return json.load(f)
+        except Exception as _:
+            return None
+
+    def save_state(self):
+        """
+        Saves live segments names, replacing the state file at once
+        """
+        tmp_path = self.directory / f"{self.STATE_FILE}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({
+                "collection_hash": self.collection_hash,
+                "next_segment": self.next_segment,
+                "segments": [live.name for live in self.segments],
+            }, f)
+        tmp_path.replace(self.directory / self.STATE_FILE)
+
+    def write_base_segment(self):
+        """
+        Drops any segment and writes the whole db index as the only one
+        """
+        LOGGER.info("Writing base segment from db...")
+        for path in self.directory.iterdir():
+            path.unlink()
+        documents = self.indexer.connection.execute("""
+SELECT id, content_hash, file_name
+FROM documents
+ORDER BY document_id
+""").fetchall()
+        self.collection_hash = self.indexer.collection_hash
+        self.segments = [self.write(
+            MemoryIndex(self.indexer.connection), documents)]
+        self.save_state()
+
+    def write(self, index: MemoryIndex, documents: list[tuple[str, str, str]]) -> LiveSegment:
+        """
+        Writes a new segment file, not yet live
+        """
+        name = f"{self.next_segment:08d}"
+        self.next_segment += 1
+        write_segment(self.directory / f"{name}.segment",
+                      index, self.collection_hash, documents)
+        return LiveSegment(self.directory, name)
+
+    def refresh_statistics(self):
+        """
+        Recomputes number and average length of live documents
+        """
+        documents_number = 0
+        words_length = 0
+        for live in self.segments:
+            documents_number += live.live_documents_number
+            words_length += int(live.segment.doc_lengths[~live.deleted].sum())
+        self.documents_number = documents_number
+        self.average_document_length = words_length / \
+            documents_number if documents_number > 0 else 0
+
+    def snapshot(self) -> tuple[list[LiveSegment], int, float]:
+        """
+        Returns live segments, number and average length of live documents
+        """
+        with self.lock:
+            return list(self.segments), self.documents_number, self.average_document_length
+
+    def run(self):
+        """
+        Background loop ingesting collection changes and merging segments
+        """
+        while True:
+            try:
+                self.ingest()
+                while self.merge_next():
+                    pass
+            except Exception as e:
+                LOGGER.error(f"Segmented index maintenance failed: {e}")
+            if self.stop_event.wait(self.ingest_interval):
+                return
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def ingest(self):
+        """
+        Applies documents of collection files changed since last ingestion,
+        same matching as Indexer.update_inverted_index
+        """
+        files, changed = self.indexer.scan_collection_files(self.manifest)
+        if len(changed) == 0:
+            self.manifest = {f.name: f for f in files}
+            return
+
+        LOGGER.info(f"Ingesting changed collection files: {changed}")
+        collection = self.indexer.read_collection_files(changed)
+
+        # Document.id -> (segment, document, content hash, key) of live documents of changed files
+        stored: dict[str, list[tuple[LiveSegment, int, str, tuple[str, int]]]] = {}
+        for live in self.segments:
+            for local, (id, content_hash, file_name) in enumerate(live.segment.documents):
+                if file_name in changed and not live.deleted[local]:
+                    stored.setdefault(id, []).append(
+                        (live, local, content_hash, live.segment.doc_keys[local]))
+
+        # (document, file name, index, content hash)
+        added: list[tuple[Document, str, int, str]] = []
+        # (segment, document)
+        removed: list[tuple[LiveSegment, int]] = []
+        for name in changed:
+            for idx, doc in enumerate(collection.get(name, [])):
+                content_hash = self.indexer.hash_document(doc)
+                candidates = stored.get(doc.id, None)
+                row = candidates.pop(0) if candidates else None
+
+                # segments are immutable, moved documents are written again
+                if row is not None and row[2] == content_hash and row[3] == (doc.source.name, idx):
+                    continue
+                if row is not None:
+                    removed.append((row[0], row[1]))
+                added.append((doc, name, idx, content_hash))
+        for candidates in stored.values():
+            removed.extend((row[0], row[1]) for row in candidates)
+        LOGGER.info(
+            f"Documents added: {len(added)}, removed: {len(removed)}")
+
+        self.collection_hash = self.indexer.hash_manifest(files)
+        segment = self.write_documents(added) if len(added) > 0 else None
+        self.indexer.refresh_document_store(files, collection)
+        # segment name -> removed documents, masks are swapped, not written in place
+        deleted: dict[str, list[int]] = {}
+        for live, local in removed:
+            deleted.setdefault(live.name, []).append(local)
+        with self.lock:
+            self.segments = [live.with_deleted(deleted[live.name]) if live.name in deleted else live
+                             for live in self.segments]
+            if segment is not None:
+                self.segments = self.segments + [segment]
+            self.refresh_statistics()
+            if segment is not None or len(removed) > 0:
+                self.generation += 1
+        for live in self.segments:
+            if live.name in deleted:
+                live.save_deleted(self.directory)
+        self.save_state()
+        self.manifest = {f.name: f for f in files}
+        LOGGER.ok("Collection changes ingested")
+
+    def write_documents(self, added: list[tuple[Document, str, int, str]]) -> LiveSegment:
+        """
+        Parses documents and writes them as a new segment
+        """
+        # segments hold the body only, fields are not parsed
+        words_lengths, words_postings, _ = parse_documents_chunk(
+            self.indexer.parser, [(i, doc.metadata.text, {}) for i, (doc, _, _, _) in enumerate(added)])
+
+        words = sorted(words_postings)
+        term_offsets = np.zeros(len(words) + 1, dtype=np.int64)
+        np.cumsum([len(words_postings[word]) for word in words],
+                  out=term_offsets[1:])
+        # documents were parsed in order, doc ids are ascending within a word
+        postings = [p for word in words for p in words_postings[word]]
+        index = MemoryIndex.from_arrays(
+            {word: term for term, word in enumerate(words)},
+            term_offsets,
+            np.array([p[0] for p in postings], dtype=np.int32),
+            np.array([p[1] for p in postings], dtype=np.int32),
+            np.array([length for _, length in words_lengths], dtype=np.float64),
+            [(doc.source.name, idx) for doc, _, idx, _ in added])
+        return self.write(index, [(doc.id, content_hash, file_name) for doc, file_name, _, content_hash in added])
+
+    def tier(self, live: LiveSegment) -> int:
+        """
+        Size tier of a segment, MERGE_FACTOR times bigger at each tier
+        """
+        n = max(live.live_documents_number, self.MIN_SEGMENT_DOCUMENTS)
+        return int(math.log(n / self.MIN_SEGMENT_DOCUMENTS, self.MERGE_FACTOR))
+
+    def merge_next(self) -> bool:
+        """
+        Merges the smallest tier holding MERGE_FACTOR segments, or else
+        rewrites a segment with too many deleted documents.
+
+        Returns False if there was nothing to merge
+        """
+        tiers: dict[int, list[LiveSegment]] = {}
+        for live in self.segments:
+            tiers.setdefault(self.tier(live), []).append(live)
+
+        group = None
+        for tier in sorted(tiers):
+            if len(tiers[tier]) >= self.MERGE_FACTOR:
+                group = tiers[tier][:self.MERGE_FACTOR]
+                break
+        if group is None:
+            group = next(([live] for live in self.segments if live.segment.documents_number > 0 and
+                          live.deleted.mean() > self.MAX_DELETED_RATIO), None)
+        if group is None:
+            return False
+
+        self.merge(group)
+        return True
+
+    def merge(self, group: list[LiveSegment]):
+        """
+        Merges segments into a new one without their deleted documents.
+        We do:
+
+        - give live documents new ids, in segments order
+        - decode all postings and drop the ones of deleted documents
+        - map segments words to the merged vocabulary and sort postings by word and document
+        - swap merged segment in place of the group, then remove group files
+        """
+        LOGGER.info(
+            f"Merging segments: {[live.name for live in group]}")
+        vocabulary = sorted(set().union(
+            *(live.segment.words for live in group)))
+        words = {word: term for term, word in enumerate(vocabulary)}
+
+        doc_lengths: list[np.ndarray] = []
+        doc_keys: list[tuple[str, int]] = []
+        documents: list[tuple[str, str, str]] = []
+        terms: list[np.ndarray] = []
+        doc_ids: list[np.ndarray] = []
+        frequencies: list[np.ndarray] = []
+        base = 0
+        for live in group:
+            segment = live.segment
+            # deletes only happen on this thread, the mask can't change meanwhile
+            keep = ~live.deleted
+            kept = np.flatnonzero(keep)
+            remap = np.full(len(keep), -1, dtype=np.int64)
+            remap[kept] = np.arange(base, base + len(kept))
+            base += len(kept)
+
+            doc_lengths.append(segment.doc_lengths[kept])
+            doc_keys.extend(segment.doc_keys[i] for i in kept.tolist())
+            documents.extend(segment.documents[i] for i in kept.tolist())
+
+            segment_terms, segment_doc_ids, segment_frequencies = segment.all_postings()
+            alive = keep[segment_doc_ids]
+            segment_words = sorted(segment.words, key=segment.words.get)
+            words_map = np.array([words[word]
+                                 for word in segment_words], dtype=np.int64)
+            terms.append(words_map[segment_terms[alive]])
+            doc_ids.append(remap[segment_doc_ids[alive]])
+            frequencies.append(segment_frequencies[alive])
+
+        merged = None
+        if base > 0:
+            all_terms = np.concatenate(terms)
+            all_doc_ids = np.concatenate(doc_ids)
+            order = np.lexsort((all_doc_ids, all_terms))
+            # words left without postings are dropped
+            counts = np.bincount(all_terms, minlength=len(vocabulary))
+            used = counts > 0
+            term_offsets = np.zeros(int(used.sum()) + 1, dtype=np.int64)
+            np.cumsum(counts[used], out=term_offsets[1:])
+            index = MemoryIndex.from_arrays(
+                {word: term for term, word in enumerate(
+                    np.array(vocabulary, dtype=object)[used].tolist())},
+                term_offsets,
+                all_doc_ids[order].astype(np.int32),
+                np.concatenate(frequencies)[order].astype(np.int32),
+                np.concatenate(doc_lengths).astype(np.float64),
+                doc_keys)
+            merged = self.write(index, documents)
+
+        names = [live.name for live in group]
+        with self.lock:
+            self.segments = [live for live in self.segments if live.name not in names] + \
+                ([merged] if merged is not None else [])
+            self.refresh_statistics()
+        self.save_state()
+
+        # queries still holding the group keep their mapping
+        for name in names:
+            (self.directory / f"{name}.segment").unlink(missing_ok=True)
+            (self.directory / f"{name}.deleted.npy").unlink(missing_ok=True)
+        LOGGER.ok(
+            f"Segments merged: {base} documents, {len(self.segments)} live segments")
@@ -0,0 +1,56 @@
+import numpy as np
+
+
+# parsed words of a snippet, stopwords not counted, and words kept before
+# the first match when there's room for them
+SNIPPET_WORDS = 24
+SNIPPET_LEAD = 4
+
+
+def best_window(positions: np.ndarray, indexes: np.ndarray, width: int) -> tuple[int, int]:
+    """
+    Range first:last of sorted matches, at positions of words indexes, within
+    width positions holding the most distinct words, then the most matches,
+    earliest first
+    """
+    best = (0, 0, 0)
+    best_range = (0, 0)
+    counts: dict[int, int] = {}
+    first = 0
+    for last in range(len(positions)):
+        counts[indexes[last]] = counts.get(indexes[last], 0) + 1
+        while positions[last] - positions[first] >= width:
+            counts[indexes[first]] -= 1
+            if counts[indexes[first]] == 0:
+                del counts[indexes[first]]
+            first += 1
+        score = (len(counts), last - first + 1, -first)
+        if score > best:
+            best, best_range = score, (first, last + 1)
+    return best_range
+
+
+def make_snippet(text: str, offsets: np.ndarray, positions: np.ndarray, indexes: np.ndarray, width: int = SNIPPET_WORDS) -> dict:
+    """
+    Best matching part of text, given the (start, end) characters of each
+    parsed word of text and the sorted positions of the matched words, as
+    {"text": ..., "highlights": [[start, end], ...]} with characters of the
+    matched words within the snippet. Text starts the snippet without
+    matches
+    """
+    if len(offsets) == 0:
+        return {"text": "", "highlights": []}
+
+    first, last = best_window(positions.tolist(), indexes.tolist(), width)
+    start = 0
+    if last > first:
+        # some words before the first match, as many as the window allows
+        room = width - int(positions[last - 1] - positions[first] + 1)
+        start = max(0, int(positions[first]) - min(SNIPPET_LEAD, room))
+    end = min(len(offsets), start + width)
+    start = max(0, end - width)
+
+    begin = int(offsets[start][0])
+    highlights = [[int(offsets[p][0]) - begin, int(offsets[p][1]) - begin]
+                  for p in positions.tolist() if start <= p < end]
+    return {"text": text[begin:int(offsets[end - 1][1])], "highlights": highlights}
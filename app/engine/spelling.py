@@ -0,0 +1,204 @@
+from pathlib import Path
+from typing import Iterable
+import zlib
+
+import numpy as np
+from duckdb import DuckDBPyConnection
+
+from app.engine.arrays import save_arrays
+from app.engine.suggest import join_strings, split_strings
+from utils.logger import LOGGER
+
+
+def deletes(word: str, distance: int) -> dict[str, int]:
+    """
+    Strings made of word by deleting up to distance characters, word
+    included, and the fewest characters deleted to make each
+    """
+    results = {word: 0}
+    edges = {word}
+    for level in range(1, distance + 1):
+        edges = {w[:i] + w[i + 1:] for w in edges for i in range(len(w))}
+        for edge in edges:
+            results.setdefault(edge, level)
+    return results
+
+
+def hash_strings(strings: Iterable[str]) -> np.ndarray:
+    """
+    Hashes stable across processes, unlike hash()
+    """
+    return np.array([zlib.crc32(s.encode("utf-8")) for s in strings], dtype=np.uint32)
+
+
+def character_bits(word: str) -> dict[str, int]:
+    """
+    Bits of the positions of each character within word
+    """
+    bits: dict[str, int] = {}
+    for i, c in enumerate(word):
+        bits[c] = bits.get(c, 0) | 1 << i
+    return bits
+
+
+def edit_distance(a: str, b: str, max_distance: int, a_bits: dict[str, int] | None = None) -> int:
+    """
+    Optimal string alignment distance of a and b: insertions, deletions,
+    substitutions and transpositions of adjacent characters, capped at
+    max_distance + 1. Columns of the distance matrix are computed as bits
+    of integers, one character of b at a time (Hyyrö's bit-parallel form),
+    given character_bits of a when comparing it to many words
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+    if not a or not b:
+        return min(max(len(a), len(b)), max_distance + 1)
+
+    matches = a_bits if a_bits is not None else character_bits(a)
+    full = (1 << len(a)) - 1
+    last = 1 << (len(a) - 1)
+
+    # vertical +1 and -1 deltas, diagonal zero deltas of the last column
+    vp, vn, d0, pm_before = full, 0, 0, 0
+    distance = len(a)
+    left = len(b)
+    for c in b:
+        pm = matches.get(c, 0)
+        transposed = (((~d0) & pm) << 1) & pm_before
+        d0 = ((((pm & vp) + vp) ^ vp) | pm | vn | transposed) & full
+        hp = vn | (~(d0 | vp) & full)
+        hn = d0 & vp
+        if hp & last:
+            distance += 1
+        elif hn & last:
+            distance -= 1
+        # each character left lowers the distance by one at most
+        left -= 1
+        if distance - left > max_distance:
+            return max_distance + 1
+        hp = ((hp << 1) | 1) & full
+        hn = (hn << 1) & full
+        vp = hn | (~(d0 | hp) & full)
+        vn = d0 & hp
+        pm_before = pm
+    return min(distance, max_distance + 1)
+
+
+class SpellingIndex():
+    """
+    Nearest words of the lexicon to a misspelled one, SymSpell style:
+
+    - every word is stored under the strings made of it by deleting up to
+      MAX_DISTANCE characters, as sorted hashes of those strings
+    - a misspelled word looks its own deletes up, words sharing one are
+      within 2 * MAX_DISTANCE edits and are checked with edit_distance.
+      Words within d edits share a delete made by d deletions at most on
+      both sides, so words one edit away are looked for first and most
+      typos are corrected without looking at words two edits away
+
+    Deletes are made of the first PREFIX_LENGTH characters only, as words
+    close to each other share close prefixes, so that there are a few tens
+    per word whatever its length. Words are stemmed as the lexicon is.
+    """
+    MAX_DISTANCE: int = 2
+    PREFIX_LENGTH: int = 7
+    # shorter words are not corrected, up to SHORT_LENGTH only by one edit
+    MIN_LENGTH: int = 3
+    SHORT_LENGTH: int = 4
+
+    collection_hash: str
+    # words, their collection frequencies and lengths, word -> position
+    words: list[str]
+    word_weights: np.ndarray
+    word_lengths: np.ndarray
+    lexicon: dict[str, int]
+    # sorted hashes of deletes, the word of each and characters deleted
+    delete_hashes: np.ndarray
+    delete_words: np.ndarray
+    delete_levels: np.ndarray
+
+    def __init__(self, path: Path):
+        LOGGER.info(f"Loading spelling {path}...")
+        with np.load(path) as data:
+            self.collection_hash = str(data["collection_hash"])
+            self.word_weights = data["word_weights"]
+            self.words = split_strings(data["words"], len(self.word_weights))
+            self.delete_hashes = data["delete_hashes"]
+            self.delete_words = data["delete_words"]
+            self.delete_levels = data["delete_levels"]
+        self.word_lengths = np.array([len(word)
+                                     for word in self.words], dtype=np.int32)
+        self.lexicon = {word: i for i, word in enumerate(self.words)}
+        LOGGER.ok(
+            f"Spelling loaded: {len(self.words)} words, {len(self.delete_hashes)} deletes")
+
+    @classmethod
+    def build(cls, con: DuckDBPyConnection, path: Path, collection_hash: str):
+        """
+        Writes deletes of every word of the lexicon
+        """
+        LOGGER.info(f"Writing spelling {path}...")
+        words = sorted(con.execute(
+            "SELECT word, collection_frequency FROM lexicon").fetchall())
+        hashes: list[np.ndarray] = []
+        levels: list[int] = []
+        for word, _ in words:
+            word_deletes = deletes(word[:cls.PREFIX_LENGTH], cls.MAX_DISTANCE)
+            hashes.append(hash_strings(word_deletes))
+            levels.extend(word_deletes.values())
+        delete_hashes = np.concatenate(
+            hashes) if hashes else np.zeros(0, dtype=np.uint32)
+        delete_words = np.repeat(np.arange(len(words), dtype=np.int32), [
+                                 len(h) for h in hashes])
+        delete_levels = np.array(levels, dtype=np.uint8)
+        order = np.argsort(delete_hashes, kind="stable")
+
+        save_arrays(path, collection_hash,
+                    words=join_strings([w for w, _ in words]),
+                    word_weights=np.array(
+                        [n for _, n in words], dtype=np.int64),
+                    delete_hashes=delete_hashes[order],
+                    delete_words=delete_words[order],
+                    delete_levels=delete_levels[order])
+        LOGGER.ok(
+            f"Spelling written: {len(words)} words, {len(delete_hashes)} deletes")
+
+    def correction(self, word: str) -> str | None:
+        """
+        Word of the lexicon nearest to word, the most frequent one at the
+        same smallest distance. None if word is in the lexicon, too short
+        or no word is near enough
+        """
+        if word in self.lexicon or len(word) < self.MIN_LENGTH:
+            return None
+        max_distance = 1 if len(word) <= self.SHORT_LENGTH else self.MAX_DISTANCE
+
+        word_deletes = deletes(word[:self.PREFIX_LENGTH], max_distance)
+        hashes = hash_strings(word_deletes)
+        levels = np.fromiter(word_deletes.values(),
+                             dtype=np.uint8, count=len(word_deletes))
+        starts = np.searchsorted(self.delete_hashes, hashes, side="left")
+        ends = np.searchsorted(self.delete_hashes, hashes, side="right")
+        word_bits = character_bits(word)
+        for distance in range(1, max_distance + 1):
+            # deletes made by distance deletions at most on both sides
+            entries = [np.arange(start, end) for start, end, level in zip(
+                starts.tolist(), ends.tolist(), levels.tolist()) if level <= distance]
+            if len(entries) == 0:
+                continue
+            entries = np.concatenate(entries)
+            candidates = np.unique(
+                self.delete_words[entries[self.delete_levels[entries] <= distance]])
+            # words sharing a prefix only are mostly too long or too short
+            candidates = candidates[np.abs(
+                self.word_lengths[candidates] - len(word)) <= distance]
+
+            # (-collection frequency, word) of words distance edits away,
+            # closer words were looked for with a smaller distance
+            nearest: list[tuple[int, str]] = []
+            for c in candidates.tolist():
+                if edit_distance(word, self.words[c], distance, word_bits) <= distance:
+                    nearest.append((-int(self.word_weights[c]), self.words[c]))
+            if len(nearest) > 0:
+                return min(nearest)[1]
+        return None
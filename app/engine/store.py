@@ -0,0 +1,199 @@
+from pathlib import Path
+import struct
+import zlib
+
+import numpy as np
+
+from app.engine.cache import DocumentCache
+from app.engine.sections import SectionedFile, write_sections
+from collection.models.document import Document
+from utils.logger import LOGGER
+
+
+# magic, version, documents, collection file content hash
+HEADER = struct.Struct("<8sII64s")
+MAGIC = b"SGDOCSTR"
+VERSION = 1
+# sections stored after the header, each with u64 start and end offsets
+SECTIONS = [
+    "ids",
+    "record_offsets",
+    "records",
+]
+
+
+def write_store_file(path: Path, documents: list[Document], content_hash: str):
+    """
+    Writes documents of a collection file as a store file:
+
+    - each document is a zlib compressed JSON record
+    - an offset table gives the byte range of the record of each index
+    - Document.id of each index, to look documents up by id
+    """
+    records = [zlib.compress(doc.model_dump_json().encode("utf-8"))
+               for doc in documents]
+    record_offsets = np.zeros(len(records) + 1, dtype="<u8")
+    np.cumsum([len(r) for r in records], out=record_offsets[1:])
+
+    sections = {
+        "ids": "\n".join(doc.id for doc in documents).encode("utf-8"),
+        "record_offsets": record_offsets.tobytes(),
+        "records": b"".join(records),
+    }
+    write_sections(path, HEADER.pack(MAGIC, VERSION, len(documents),
+                   content_hash.encode("ascii")), SECTIONS, sections)
+
+
+class StoreFile(SectionedFile):
+    """
+    Read only view over the store file of a collection file, mapped in
+    memory. Only records that are asked for are read and parsed.
+    """
+    HEADER = HEADER
+    MAGIC = MAGIC
+    VERSION = VERSION
+    SECTIONS = SECTIONS
+    KIND = "a document store file"
+
+    content_hash: str
+    # Document.id -> indexes, an id can repeat within a file
+    ids: dict[str, list[int]]
+
+    def __init__(self, path: Path):
+        super().__init__(path)
+        _, _, n_documents, content_hash = self.header
+        self.content_hash = content_hash.decode("ascii")
+
+        self.record_offsets = self.section_array("record_offsets", "<u8")
+        self.records_start = self.sections["records"][0]
+
+        self.ids = {}
+        if n_documents > 0:
+            for idx, id in enumerate(self.section_bytes("ids").decode("utf-8").split("\n")):
+                self.ids.setdefault(id, []).append(idx)
+
+    @property
+    def documents_number(self) -> int:
+        return len(self.record_offsets) - 1
+
+    def get_record(self, index: int) -> bytes | None:
+        """
+        Reads the JSON record of the document at index, None if out of bounds
+        """
+        if index < 0 or index >= self.documents_number:
+            return None
+        start = self.records_start + int(self.record_offsets[index])
+        end = self.records_start + int(self.record_offsets[index + 1])
+        return zlib.decompress(self.buffer[start:end])
+
+    def get(self, index: int) -> Document | None:
+        """
+        Reads and parses the document at index, None if out of bounds
+        """
+        record = self.get_record(index)
+        return Document.model_validate_json(record) if record is not None else None
+
+
+class DocumentStore():
+    """
+    Random access store of the collection documents, one store file per
+    collection file within DIRECTORY, tagged with the file content hash of
+    the manifest so that only changed files are written again.
+
+    Documents are addressed as the index does, by collection name and
+    index within it, or by Document.id. Parsed documents are kept in cache,
+    until their store file is written again.
+    """
+    DIRECTORY: str = "app/engine/db/documents"
+
+    directory: Path
+    # collection name -> mapped store file
+    files: dict[str, StoreFile]
+    # (collection name, index) -> document, per store file content hash
+    cache: DocumentCache
+
+    def __init__(self, cache_size: int = 0):
+        """
+        cache_size is the bytes of documents records kept parsed, 0 disables the cache
+        """
+        self.directory = Path(self.DIRECTORY)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.files = {}
+        self.cache = DocumentCache(cache_size)
+
+    def path(self, name: str) -> Path:
+        return self.directory / f"{name}.store"
+
+    def open(self, name: str) -> StoreFile | None:
+        """
+        Returns the mapped store file of a collection, None if missing
+        """
+        store_file = self.files.get(name, None)
+        if store_file is not None:
+            return store_file
+        try:
+            store_file = StoreFile(self.path(name))
+        except Exception as _:
+            return None
+        self.files[name] = store_file
+        return store_file
+
+    def content_hash(self, name: str) -> str | None:
+        """
+        Returns the content hash a store file was written for, None if missing
+        """
+        store_file = self.open(name)
+        return store_file.content_hash if store_file is not None else None
+
+    def write(self, name: str, documents: list[Document], content_hash: str):
+        """
+        Writes the store file of a collection, replacing the mapped one
+        """
+        write_store_file(self.path(name), documents, content_hash)
+        self.files[name] = StoreFile(self.path(name))
+        LOGGER.ok(f"Document store written for {name}: {len(documents)} documents")
+
+    def remove_others(self, names: list[str]):
+        """
+        Removes store files of collections not in names
+        """
+        for path in self.directory.glob("*.store"):
+            if path.stem not in names:
+                self.files.pop(path.stem, None)
+                path.unlink(missing_ok=True)
+
+    def get(self, collection_name: str, index: int) -> Document | None:
+        """
+        Returns the document at index of a collection, None if missing
+        """
+        store_file = self.open(collection_name)
+        if store_file is None:
+            LOGGER.error(f"Missing document store for: {collection_name}")
+            return None
+        return self.get_cached(store_file, collection_name, index)
+
+    def get_cached(self, store_file: StoreFile, collection_name: str, index: int) -> Document | None:
+        """
+        Returns the document at index of a store file, parsing it only if not cached
+        """
+        key = (collection_name, index)
+        document = self.cache.get(key, store_file.content_hash)
+        if document is not None:
+            return document
+        record = store_file.get_record(index)
+        if record is None:
+            return None
+        document = Document.model_validate_json(record)
+        self.cache.put(key, store_file.content_hash, len(record), document)
+        return document
+
+    def get_by_id(self, collection_name: str, id: str) -> Document | None:
+        """
+        Returns the first document of a collection with Document.id, None if missing
+        """
+        store_file = self.open(collection_name)
+        if store_file is None:
+            LOGGER.error(f"Missing document store for: {collection_name}")
+            return None
+        indexes = store_file.ids.get(id, None)
+        return self.get_cached(store_file, collection_name, indexes[0]) if indexes else None
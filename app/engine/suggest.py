@@ -0,0 +1,193 @@
+import bisect
+from collections import Counter
+from pathlib import Path
+
+import numpy as np
+from duckdb import DuckDBPyConnection
+
+from app.engine.arrays import save_arrays
+from app.engine.parser import Parser
+from utils.logger import LOGGER
+
+
+def join_strings(strings: list[str]) -> np.ndarray:
+    """
+    Strings as new line separated UTF-8 bytes, stored without padding
+    """
+    return np.frombuffer("\n".join(strings).encode("utf-8"), dtype=np.uint8)
+
+
+def split_strings(data: np.ndarray, count: int) -> list[str]:
+    return data.tobytes().decode("utf-8").split("\n") if count > 0 else []
+
+
+class SuggestIndex():
+    """
+    Completions of the query being typed, over sorted arrays that are
+    binary searched for the range of keys starting with what was typed:
+
+    - words of the lexicon as they are written, ranked by the collection
+      frequency of their stem. The lexicon holds stems only, so each stem
+      is shown as its most common form within titles and tags, stems
+      missing from them are not completed
+    - titles of the documents, lowercased without punctuation as the
+      tokenizer does and ranked by the number of documents holding them.
+      A title is keyed from each of its words on, so that "knight" completes
+      to "Hollow Knight"
+
+    Within a range only the best weights are picked, ties keep keys order.
+    Best positions of ranges over LARGE_RANGE keys, short prefixes, are
+    kept once picked so that they are not picked again at each keystroke.
+    """
+    # completions returned at most, of each kind
+    MAX_SUGGESTIONS: int = 50
+    LARGE_RANGE: int = 4096
+
+    collection_hash: str
+    parser: Parser
+
+    # sorted words as written and collection frequencies of their stems
+    words: list[str]
+    word_weights: np.ndarray
+    # titles as displayed and number of documents holding each
+    titles: list[str]
+    title_weights: np.ndarray
+    # sorted title keys, the title of each and its weight
+    title_keys: list[str]
+    title_key_ids: np.ndarray
+    title_key_weights: np.ndarray
+    # (keys, start, end) -> MAX_SUGGESTIONS best positions of large ranges
+    best_positions: dict[tuple[str, int, int], np.ndarray]
+
+    def __init__(self, path: Path, parser: Parser):
+        LOGGER.info(f"Loading suggestions {path}...")
+        self.parser = parser
+        with np.load(path) as data:
+            self.collection_hash = str(data["collection_hash"])
+            self.word_weights = data["word_weights"]
+            self.words = split_strings(data["words"], len(self.word_weights))
+            self.title_weights = data["title_weights"]
+            self.titles = split_strings(
+                data["titles"], len(self.title_weights))
+            self.title_key_ids = data["title_key_ids"]
+            self.title_keys = split_strings(
+                data["title_keys"], len(self.title_key_ids))
+        self.title_key_weights = self.title_weights[self.title_key_ids]
+        self.best_positions = {}
+        LOGGER.ok(
+            f"Suggestions loaded: {len(self.words)} words, {len(self.titles)} titles")
+
+    @classmethod
+    def build(cls, con: DuckDBPyConnection, path: Path, collection_hash: str, parser: Parser):
+        """
+        Writes sorted words of the lexicon, as written, and keys of the
+        documents titles
+        """
+        LOGGER.info(f"Writing suggestions {path}...")
+        lexicon = dict(con.execute(
+            "SELECT word, collection_frequency FROM lexicon").fetchall())
+        title_rows = sorted(con.execute(
+            "SELECT title, COUNT(*) FROM documents GROUP BY title").fetchall())
+        tag_rows = sorted(con.execute(
+            "SELECT tag, COUNT(*) FROM document_tags GROUP BY tag").fetchall())
+
+        # stem -> documents holding each of its forms within titles and tags
+        forms: dict[str, Counter] = {}
+        for text, documents in title_rows + tag_rows:
+            for word in parser.stopwords_removal(parser.tokenizer(text)):
+                forms.setdefault(parser.stemmer.stem(word), Counter())[
+                    word] += documents
+        words = sorted((min(forms[stem].items(), key=lambda form: (-form[1], form[0]))[0], frequency)
+                       for stem, frequency in lexicon.items() if stem in forms)
+
+        # normalized title -> documents holding it per displayed title
+        titles: dict[str, Counter] = {}
+        for title, documents in title_rows:
+            key = " ".join(parser.tokenizer(title))
+            if key:
+                titles.setdefault(key, Counter())[
+                    " ".join(title.split())] += documents
+        normalized = sorted(titles)
+        keys = sorted((" ".join(title.split(" ")[i:]), title_id) for title_id, title in enumerate(normalized)
+                      for i in range(len(title.split(" "))))
+
+        save_arrays(path, collection_hash,
+                    words=join_strings([w for w, _ in words]),
+                    word_weights=np.array(
+                        [n for _, n in words], dtype=np.int64),
+                    titles=join_strings(
+                        [titles[t].most_common(1)[0][0] for t in normalized]),
+                    title_weights=np.array(
+                        [sum(titles[t].values()) for t in normalized], dtype=np.int64),
+                    title_keys=join_strings([k for k, _ in keys]),
+                    title_key_ids=np.array([i for _, i in keys], dtype=np.int64))
+        LOGGER.ok(
+            f"Suggestions written: {len(words)} words, {len(normalized)} titles")
+
+    def prefix_range(self, keys: list[str], prefix: str) -> tuple[int, int]:
+        """
+        Range of sorted keys starting with prefix
+        """
+        return bisect.bisect_left(keys, prefix), bisect.bisect_left(keys, prefix + "\U0010ffff")
+
+    def best(self, keys: str, start: int, end: int, n: int) -> np.ndarray:
+        """
+        Positions of the n highest weights within start:end of "words" or
+        "titles" keys, highest first and in keys order among ties
+        """
+        if end - start > self.LARGE_RANGE and n <= self.MAX_SUGGESTIONS:
+            positions = self.best_positions.get((keys, start, end), None)
+            if positions is None:
+                positions = self.pick(keys, start, end, self.MAX_SUGGESTIONS)
+                self.best_positions[(keys, start, end)] = positions
+            return positions[:n]
+        return self.pick(keys, start, end, n)
+
+    def pick(self, keys: str, start: int, end: int, n: int) -> np.ndarray:
+        """
+        Same as best, without keeping positions
+        """
+        weights = self.word_weights if keys == "words" else self.title_key_weights
+        candidates = weights[start:end]
+        if len(candidates) > n:
+            kth = np.partition(candidates, len(candidates) - n)[
+                len(candidates) - n]
+            above = np.flatnonzero(candidates > kth)
+            ties = np.flatnonzero(candidates == kth)[:n - len(above)]
+            selected = np.concatenate((above, ties))
+        else:
+            selected = np.arange(len(candidates))
+        return start + selected[np.lexsort((selected, -candidates[selected]))]
+
+    def suggest(self, text: str, n: int) -> dict[str, list[str]]:
+        """
+        Returns up to n titles starting with text, from any of their words,
+        and up to n completions of the last word of text, as text with the
+        last word completed. A last word matching no word as typed is
+        matched by its stem, so that "adventuring" completes to "adventure"
+        """
+        n = min(n, self.MAX_SUGGESTIONS)
+        words = self.parser.tokenizer(text)
+        if len(words) == 0 or n <= 0:
+            return {"titles": [], "words": []}
+
+        # a title keyed from several matching words counts once
+        start, end = self.prefix_range(self.title_keys, " ".join(words))
+        titles: list[int] = []
+        depth = n
+        while True:
+            titles = list(dict.fromkeys(self.title_key_ids[self.best(
+                "titles", start, end, depth)].tolist()))
+            if len(titles) >= n or depth >= end - start:
+                break
+            depth *= 2
+
+        start, end = self.prefix_range(self.words, words[-1])
+        if start == end:
+            start, end = self.prefix_range(
+                self.words, self.parser.stemmer.stem(words[-1]))
+        head = " ".join(words[:-1] + [""])
+        return {
+            "titles": [self.titles[i] for i in titles[:n]],
+            "words": [head + self.words[i] for i in self.best("words", start, end, n).tolist()],
+        }
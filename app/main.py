@@ -7,6 +7,7 @@ from flask import Flask, render_template, request
 
 from app.engine.session import Session, UserFeedback
 from collection.models.document import Document
+from utils.env import get_env
 from utils.logger import LOGGER
 
 # global initialization
@@ -22,28 +23,59 @@ session = Session()
 # parser
 parser = Parser()
 
+# memory, segment, segmented, impact or db
+serving_mode = get_env("BM25_SERVING_MODE").lower()
+
+# BM25F weight of each field, as "field:weight,..."
+field_weights = {field.strip(): float(weight) for field, weight in (
+    item.split(":") for item in get_env("BM25_FIELD_WEIGHTS").split(",") if item.strip())}
+
+# correct misspelled query words, unless a query sets "fuzzy"
+fuzzy_queries = get_env("QUERY_FUZZY").lower() == "true"
+
 # indexer
-indexer = Indexer(parser)
+indexer = Indexer(parser,
+                  build_workers=int(get_env("INDEX_BUILD_WORKERS")),
+                  build_memory_budget=int(get_env("INDEX_BUILD_MEMORY_BUDGET")),
+                  segment=serving_mode == "segment",
+                  impacts=serving_mode == "impact",
+                  impact_bits=int(get_env("BM25_IMPACT_BITS")),
+                  postings_cache_size=int(get_env("POSTINGS_CACHE_SIZE")),
+                  document_cache_size=int(get_env("DOCUMENT_CACHE_SIZE")),
+                  positions=get_env("INDEX_POSITIONS").lower() == "true",
+                  facets=serving_mode in ("memory", "segment", "impact"),
+                  fields=serving_mode in ("memory", "segment") and any(
+                      weight > 0 for field, weight in field_weights.items() if field != "body"),
+                  suggestions=get_env("INDEX_SUGGESTIONS").lower() == "true",
+                  spelling=fuzzy_queries)
 
 # BM25
-bm25 = BM25(indexer)
+bm25 = BM25(indexer, serving_mode=serving_mode,
+            ingest_interval=int(get_env("SEGMENTED_INGEST_INTERVAL")),
+            dynamic_pruning=get_env("BM25_DYNAMIC_PRUNING").lower() == "true",
+            cache_size=int(get_env("QUERY_CACHE_SIZE")),
+            cache_ttl=float(get_env("QUERY_CACHE_TTL")),
+            cursor_depth=int(get_env("QUERY_CURSOR_DEPTH")),
+            cursor_ttl=float(get_env("QUERY_CURSOR_TTL")),
+            field_weights=field_weights)
+# score documents holding every query word only, unless a query sets "conjunctive"
+conjunctive_queries = get_env("QUERY_CONJUNCTIVE").lower() == "true"
 LOGGER.info("App Initialized")
 
 
 @app.route('/')
 def index():
-    return render_template('index.html', items=[])
-
-
-@app.route('/query', methods=["POST"])
-def query():
-    body = request.get_json()
+    # snippets are read from positions, the page asks for them when loaded
+    return render_template('index.html', items=[], snippets=bm25.position_index is not None)
 
-    if not isinstance(body["query"], str):
-        return "Missing \"query\" field", 400
-
-    LOGGER.info(f"body: {body}")
 
+def query_parameters(body: dict) -> tuple[list[str], int, str | None, str | None, str | None, list[str], list[tuple[list[str], int]], bool]:
+    """
+    Query words, number of documents, filters, phrases and whether every
+    word must match of a query body, with defaults. Phrases are written
+    within double quotes in the query, misspelled words are corrected if
+    "fuzzy" is true, phrase words too
+    """
     n = body["documents"] if (
         "documents" in body and isinstance(body["documents"], int)) else 30
     platform = body["platform"] if (
@@ -54,16 +86,105 @@ def query():
         "status" in body and isinstance(body["status"], str)) else None
     tags = body["tags"] if (
         "tags" in body and isinstance(body["tags"], list)) else []
+    fuzzy = body["fuzzy"] if (
+        "fuzzy" in body and isinstance(body["fuzzy"], bool)) else fuzzy_queries
+    conjunctive = body["conjunctive"] if (
+        "conjunctive" in body and isinstance(body["conjunctive"], bool)) else conjunctive_queries
+
+    words, phrases = parser.parse_query(body["query"])
+    if fuzzy:
+        words = bm25.expand_words(words)
+        phrases = [(bm25.expand_words(phrase), slop)
+                   for phrase, slop in phrases]
+    return words, n, platform, category, status, tags, phrases, conjunctive
+
+
+def dump_documents(items: list[tuple[tuple[str, int], Document]], words: list[str], snippets: bool) -> list[dict]:
+    """
+    Documents of a query response, given along with their (collection_name,
+    index). With snippets each one holds the best matching part of its text
+    with characters of the query words, instead of its whole text
+    """
+    if not snippets:
+        return [doc.model_dump() for _, doc in items]
+    documents = []
+    for (_, doc), snippet in zip(items, bm25.snippets(words, items)):
+        document = doc.model_dump()
+        document["metadata"]["text"] = ""
+        document["snippet"] = snippet
+        documents.append(document)
+    return documents
+
+
+@app.route('/query', methods=["POST"])
+def query():
+    body = request.get_json()
+
+    if not isinstance(body["query"], str):
+        return "Missing \"query\" field", 400
+
+    LOGGER.info(f"body: {body}")
+
+    parameters = query_parameters(body)
+    # snippets with highlights instead of whole texts
+    snippets = body.get("snippets", False) is True
+    if snippets and bm25.position_index is None:
+        return "Snippets need positions, set INDEX_POSITIONS outside of segmented mode", 400
+
+    # paginated when a cursor is given, null for the first page
+    if "cursor" in body:
+        if body["cursor"] is not None and not isinstance(body["cursor"], str):
+            return "Wrong \"cursor\" field", 400
+        if parameters[1] <= 0:
+            return "Wrong \"documents\" field, pages hold one document at least", 400
+        page = bm25.query_page_sources_documents(
+            *parameters, cursor=body["cursor"])
+        if page is None:
+            return "Cursor expired, query again", 410
+        items, cursor = page
+        return {"documents": dump_documents(items, parameters[0], snippets), "cursor": cursor}, 200
+
+    items = bm25.query_sources_documents(*parameters)
+    return dump_documents(items, parameters[0], snippets), 200
+
+
+@app.route('/query/batch', methods=["POST"])
+def query_batch():
+    body = request.get_json()
+
+    if not isinstance(body.get("queries", None), list):
+        return "Missing \"queries\" field", 400
+
+    for i, q in enumerate(body["queries"]):
+        if not isinstance(q, dict) or not isinstance(q.get("query", None), str):
+            return f"Missing \"query\" field in query {i}", 400
+
+    LOGGER.info(f"batch of {len(body['queries'])} queries")
+
+    results = bm25.query_batch_sources_documents(
+        [query_parameters(q) for q in body["queries"]])
+    return [[doc.model_dump() for _, doc in items] for items in results], 200
+
+
+@app.route('/query/cache', methods=["GET"])
+def query_cache():
+    return {
+        "queries": bm25.query_cache.stats(),
+        "postings": indexer.postings_cache.stats(),
+        "documents": indexer.document_store.cache.stats(),
+    }, 200
+
+
+@app.route('/suggest', methods=["GET"])
+def suggest():
+    # ?q=hollow kn
+    q = request.args.get('q', '')
+    # ?n=8
+    n = request.args.get('n', 8, type=int)
 
-    items = bm25.query_sources_documents(
-        parser.parse_text_to_words(body["query"]),
-        n,
-        platform,
-        category,
-        status,
-        tags
-    )
-    return [doc.model_dump() for doc in items], 200
+    if bm25.suggest_index is None:
+        return {"titles": [], "words": []}, 200
+    return bm25.suggest_index.suggest(q, n), 200
 
 
 @app.route('/render/documents', methods=["POST"])
@@ -84,8 +205,9 @@ def render_documents():
         LOGGER.warn(f"Unexpected error: {e}")
         return "Failed to parse documents", 400
 
-    # we then render
-    return render_template('components/card.html', documents=[doc.model_dump() for doc in items])
+    # we then render, along with snippets of the query response
+    return render_template('components/card.html', documents=[
+        {**doc.model_dump(), "snippet": d.get("snippet", None)} for doc, d in zip(items, body["documents"])])
 
 
 @app.route('/document', methods=["GET"])
@@ -48,6 +48,7 @@ async function search(event) {
 					status,
 					category,
 					platform,
+					snippets: SNIPPETS,
 				}),
 			});
 
@@ -95,6 +96,41 @@ async function search(event) {
 	}
 }
 
+let SUGGEST_TIMEOUT;
+
+async function suggest(event) {
+	// wait for typing to pause, not a request per keystroke
+	clearTimeout(SUGGEST_TIMEOUT);
+	const query = event.target.value;
+
+	SUGGEST_TIMEOUT = setTimeout(async () => {
+		const datalist = document.getElementById('search-suggestions');
+		if (!query) {
+			datalist.replaceChildren();
+			return;
+		}
+
+		try {
+			const response = await fetch(
+				`/suggest?q=${encodeURIComponent(query)}&n=8`,
+			);
+			if (!response.ok) throw new Error('API error');
+
+			// titles first, then completions of the last word
+			const { titles, words } = await response.json();
+			datalist.replaceChildren(
+				...[...titles, ...words].map((value) => {
+					const option = document.createElement('option');
+					option.value = value;
+					return option;
+				}),
+			);
+		} catch (err) {
+			console.error(err);
+		}
+	}, 100);
+}
+
 function triggerSearch() {
 	const ev = new KeyboardEvent('keypress', { key: 'Enter' });
 	search(ev);
@@ -1,5 +1,6 @@
 function highlightWords(query) {
-	// highlights all words within query in items-container
+	// highlights all words within query in items-container, titles, tags and
+	// descriptions of the results
 	const container = document.getElementById('items-container');
 	if (!container) {
 		console.error("The element with ID 'items-container' was not found.");
@@ -18,10 +19,16 @@ function highlightWords(query) {
 	const replacement = '<span class="highlight-match">$&</span>';
 
 	// collect all nodes with words
+	// snippets come highlighted from the server
 	const walker = document.createTreeWalker(
 		container,
 		NodeFilter.SHOW_TEXT,
-		null,
+		{
+			acceptNode: (node) =>
+				node.parentElement.closest('.snippet')
+					? NodeFilter.FILTER_REJECT
+					: NodeFilter.FILTER_ACCEPT,
+		},
 		false,
 	);
 
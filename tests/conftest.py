@@ -0,0 +1,111 @@
+import json
+import os
+import random
+from pathlib import Path
+
+import pytest
+
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from utils.logger import LOGGER
+
+
+WORDS = "space shooter puzzle platformer horror pixel retro adventure rpg strategy racing zombie farm dungeon magic sword cat dog city survival".split()
+# names a few titles start with, rarer than words
+NAMES = ["hollow knight", "elden ring", "flappy bird"]
+SOURCES = ("itch", "steam")
+
+
+def make_document(source: str, i: int, rng: random.Random) -> dict:
+    """
+    Collection document of source, with random words of WORDS as title,
+    tags and text, where words of the title are the most frequent. One
+    title in ten starts with one of NAMES
+    """
+    theme = rng.sample(WORDS, 2)
+    title = " ".join(theme).title() + f" {i}"
+    if rng.random() < 0.1:
+        title = f"{rng.choice(NAMES).title()} {title}"
+    description = " ".join(rng.choices(WORDS, weights=[
+        8 if word in theme else 1 for word in WORDS], k=rng.randint(5, 40)))
+    return {
+        "id": f"{source}-{i}",
+        "source": {"name": source, "url": f"https://{source}.com/{i}"},
+        "metadata": {
+            "title": title,
+            "description": description,
+            "videos": None,
+            "images": None,
+            "price": None,
+            "author": rng.choice(["ada", "bob", "eve"]),
+            "status": rng.choice(["Released", "beta"]),
+            "category": rng.choice(["game", "tool"]),
+            "genre": [rng.choice(WORDS)],
+            "rating": None,
+            "tags": rng.sample(WORDS, 3),
+            "platforms": rng.sample(["Windows", "linux", "html5"], 2),
+            "published": None,
+            "extra_data": {},
+            "text": f"{title}. {description}",
+        },
+    }
+
+
+def write_collection(folder: Path, documents_number: int, seed: int = 0, sources: tuple[str, ...] = SOURCES) -> dict[str, list[dict]]:
+    """
+    Writes a collection file of documents_number documents per source
+    under folder/collection, returns documents by source
+    """
+    rng = random.Random(seed)
+    collection = {source: [make_document(source, i, rng) for i in range(
+        documents_number)] for source in sources}
+    write_collection_documents(folder, collection)
+    return collection
+
+
+def write_collection_documents(folder: Path, collection: dict[str, list[dict]]):
+    """
+    Writes documents of each source to its collection file, along with the
+    folder of the log the app writes to
+    """
+    (folder / Indexer.COLLECTION_FOLDER).mkdir(parents=True, exist_ok=True)
+    Path(folder, LOGGER.LOG_FILE).parent.mkdir(parents=True, exist_ok=True)
+    for source, documents in collection.items():
+        (folder / Indexer.COLLECTION_FOLDER /
+         f"{source}.json").write_text(json.dumps(documents))
+
+
+@pytest.fixture(scope="session")
+def parser() -> Parser:
+    return Parser()
+
+
+@pytest.fixture(scope="session")
+def indexer(parser: Parser, tmp_path_factory: pytest.TempPathFactory):
+    """
+    Indexer of a collection built once for every test, with every feature.
+    Paths of the indexer are relative, so tests run from the folder of the
+    collection
+    """
+    folder = tmp_path_factory.mktemp("sgames")
+    write_collection(folder, 150)
+    cwd = os.getcwd()
+    os.chdir(folder)
+    try:
+        yield Indexer(parser, segment=True, positions=True, impacts=True, facets=True,
+                      fields=True, suggestions=True, spelling=True)
+    finally:
+        os.chdir(cwd)
+
+
+@pytest.fixture(scope="session")
+def client(indexer: Indexer):
+    """
+    Test client of the app, which indexes the collection of indexer again
+    at import, with positions and spelling
+    """
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.setenv("INDEX_POSITIONS", "true")
+        monkeypatch.setenv("QUERY_FUZZY", "true")
+        from app.main import app
+    return app.test_client()
@@ -0,0 +1,225 @@
+import numpy as np
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from collection.models.document import Document
+
+
+QUERIES = [["sword"], ["rpg", "dungeon"], ["hollow", "platform"],
+           ["hollow", "race"], ["space", "shooter", "pixel", "retro"]]
+
+
+def keys(documents: list[tuple[tuple[str, int], Document]]) -> list[tuple[str, int]]:
+    return [key for key, _ in documents]
+
+
+def assert_same_ranking(ranked: list[tuple[tuple[str, int], float]], expected: list[tuple[tuple[str, int], float]]):
+    """
+    Same documents with the same scores, in any order among ties
+    """
+    assert len(ranked) == len(expected)
+    assert dict(ranked).keys() == dict(expected).keys()
+    for key, score in expected:
+        assert dict(ranked)[key] == pytest.approx(score)
+
+
+@pytest.mark.parametrize("serving_mode", ["memory", "segment", "impact", "db"])
+@pytest.mark.parametrize("words", QUERIES)
+def test_first_cursor_page_is_query_top_n_when_conjunctive(indexer: Indexer, serving_mode: str, words: list[str]):
+    bm25 = BM25(indexer, serving_mode=serving_mode, cursor_depth=300)
+    for n in (5, 30):
+        top = bm25.query_sources_documents(
+            words, n, None, None, None, [], None, True)
+        page, _ = bm25.query_page_sources_documents(
+            words, n, None, None, None, [], None, True)
+        assert keys(page) == keys(top)
+
+
+@pytest.mark.parametrize("words", QUERIES)
+def test_body_weight_alone_is_plain_bm25(indexer: Indexer, words: list[str]):
+    plain = BM25(indexer, serving_mode="memory")
+    body = BM25(indexer, serving_mode="memory", field_weights={"body": 1})
+    assert body.field_index is None
+    assert body.rank_documents(words, 20, None, None, None, []) == plain.rank_documents(
+        words, 20, None, None, None, [])
+
+
+@pytest.mark.parametrize("filters", [("WINDOWS", None, None, []), (None, "Game", "released", ["Sword", "rpg"]), ("Linux", None, "Beta", ["DUNGEON"])])
+def test_filters_match_the_same_documents_in_db_bitmaps_and_store(indexer: Indexer, filters: tuple):
+    platform, category, status, tags = filters
+    words = ["sword", "rpg", "dungeon", "space"]
+    db = BM25(indexer, serving_mode="db")
+    memory = BM25(indexer, serving_mode="memory")
+    assert memory.facet_index is not None
+
+    unfiltered = dict(db.rank_documents(words, 1000, None, None, None, []))
+    expected = set()
+    for key in unfiltered:
+        metadata = indexer.document_store.get(*key).metadata
+        if platform and platform.lower() not in [p.lower() for p in metadata.platforms]:
+            continue
+        if category and category.lower() != metadata.category.lower():
+            continue
+        if status and status.lower() != metadata.status.lower():
+            continue
+        if not {tag.lower() for tag in tags} <= {tag.lower() for tag in metadata.tags}:
+            continue
+        expected.add(key)
+    assert len(expected) > 0
+
+    assert set(dict(db.rank_documents(words, 1000, *filters))) == expected
+    assert set(dict(memory.rank_documents(words, 1000, *filters))) == expected
+    assert set(indexer.filter_documents_in_store(
+        unfiltered, *db.normalize_filters(*filters))) == expected
+
+
+@pytest.mark.parametrize("words", QUERIES)
+def test_memory_ranking_is_db_ranking(indexer: Indexer, words: list[str]):
+    db = BM25(indexer, serving_mode="db")
+    memory = BM25(indexer, serving_mode="memory")
+    assert memory.memory_index is not None
+    # every matching document, whatever ties at the cutoff
+    assert_same_ranking(memory.rank_documents(words, 1000, None, None, None, []),
+                        db.rank_documents(words, 1000, None, None, None, []))
+
+
+@pytest.mark.parametrize("field_weights", [None, {"body": 1, "title": 3, "tags": 1.5, "author": 1.5}])
+@pytest.mark.parametrize("serving_mode", ["memory", "segment"])
+@pytest.mark.parametrize("words", QUERIES)
+def test_pruned_top_k_is_exhaustive_top_k(indexer: Indexer, serving_mode: str, words: list[str], field_weights: dict | None):
+    exhaustive = BM25(indexer, serving_mode=serving_mode,
+                      field_weights=field_weights)
+    pruned = BM25(indexer, serving_mode=serving_mode,
+                  field_weights=field_weights, dynamic_pruning=True)
+    for n, filters in [(1, (None, None, None, [])), (10, (None, None, None, [])), (10, ("linux", None, "beta", []))]:
+        expected = exhaustive.rank_documents(words, 1000, *filters)
+        ranked = pruned.rank_documents(words, n, *filters)
+        # same scores as the n best, whatever ties at the cutoff
+        assert [score for _, score in ranked] == pytest.approx(
+            [score for _, score in expected[:n]])
+        assert all(dict(expected)[key] == pytest.approx(score)
+                   for key, score in ranked)
+
+
+@pytest.mark.parametrize("impact_bits", [8, 16])
+@pytest.mark.parametrize("words", QUERIES)
+def test_impact_scores_are_quantized_bm25(indexer: Indexer, words: list[str], impact_bits: int):
+    exact = dict(BM25(indexer, serving_mode="memory").rank_documents(
+        words, 1000, None, None, None, []))
+    indexer.impact_bits = impact_bits
+    try:
+        indexer.refresh_impacts()
+        impact = BM25(indexer, serving_mode="impact")
+        assert impact.impact_index.bits == impact_bits
+
+        ranked = impact.rank_documents(words, 1000, None, None, None, [])
+        assert dict(ranked).keys() == exact.keys()
+        # each impact rounds a score to the nearest step, the lowest one up
+        for key, score in ranked:
+            assert abs(score - exact[key]) <= len(words) * \
+                impact.impact_index.scale
+
+        # stopping early keeps the quantized top k
+        for n in (1, 10):
+            assert [score for _, score in impact.rank_documents(words, n, None, None, None, [])] == \
+                [score for _, score in ranked[:n]]
+    finally:
+        indexer.impact_bits = 8
+        indexer.refresh_impacts()
+
+
+@pytest.mark.parametrize("serving_mode,dynamic_pruning", [("db", False), ("memory", False), ("memory", True), ("impact", False)])
+def test_batch_is_single_queries(indexer: Indexer, serving_mode: str, dynamic_pruning: bool):
+    bm25 = BM25(indexer, serving_mode=serving_mode,
+                dynamic_pruning=dynamic_pruning)
+    queries = [(words, 10, None, None, None, [], [], False) for words in QUERIES]
+    queries += [(["dungeon", "rpg"], 10, "Linux", None, None, ["sword"], [], False),
+                (["hollow", "knight"], 5, None, None, None, [], [(["hollow", "knight"], 0)], False),
+                (["space", "shooter"], 10, None, None, None, [], [], True),
+                # asked for twice
+                (["sword"], 10, None, None, None, [], [], False)]
+    expected = [keys(bm25.query_sources_documents(*query)) for query in queries]
+    assert [keys(documents) for documents in bm25.query_batch_sources_documents(queries)] == expected
+
+
+@pytest.mark.parametrize("serving_mode", ["memory", "db"])
+@pytest.mark.parametrize("words", QUERIES)
+def test_cursor_pages_are_query_slices(indexer: Indexer, serving_mode: str, words: list[str], monkeypatch: pytest.MonkeyPatch):
+    # pages past the first ranking rank deeper
+    bm25 = BM25(indexer, serving_mode=serving_mode, cursor_depth=20)
+    expected = keys(bm25.query_sources_documents(
+        words, 1000, None, None, None, []))
+    pages: list[tuple[str, int]] = []
+    page, cursor = bm25.query_page_sources_documents(
+        words, 7, None, None, None, [])
+    while True:
+        assert len(page) == 7 or cursor is None
+        pages.extend(keys(page))
+        if cursor is None:
+            break
+        # query words are the ones of the cursor
+        page, cursor = bm25.query_page_sources_documents(
+            ["ignored"], 7, None, None, None, [], cursor=cursor)
+    assert pages == expected
+
+    assert bm25.query_page_sources_documents(
+        words, 7, None, None, None, [], cursor="bad") is None
+    _, cursor = bm25.query_page_sources_documents(
+        words, 7, None, None, None, [])
+    monkeypatch.setattr(indexer, "collection_hash", "changed")
+    assert bm25.query_page_sources_documents(
+        words, 7, None, None, None, [], cursor=cursor) is None
+
+
+@pytest.mark.parametrize("field_weights", [{"body": 1, "title": 3, "tags": 1.5, "author": 1.5}, {"title": 1, "tags": 2}])
+def test_field_scores_are_bm25f(indexer: Indexer, parser: Parser, field_weights: dict[str, float]):
+    bm25 = BM25(indexer, serving_mode="memory", field_weights=field_weights)
+    assert bm25.field_index is not None
+
+    # words of each field of every document
+    documents_fields: dict[tuple[str, int], dict[str, list[str]]] = {}
+    for key in bm25.memory_index.doc_keys:
+        document = indexer.document_store.get(*key)
+        fields = {"body": document.metadata.text,
+                  **indexer.document_fields(document)}
+        documents_fields[key] = {field: parser.parse_text_to_words(
+            text) for field, text in fields.items()}
+    average_lengths = {field: np.mean([len(fields[field]) for fields in documents_fields.values()])
+                       for field in ("body", "title", "tags", "author")}
+
+    for words in QUERIES:
+        expected: dict[tuple[str, int], float] = {}
+        for word in words:
+            holding = [key for key, fields in documents_fields.items()
+                       if any(word in field_words for field_words in fields.values())]
+            idf = bm25.compute_idf(len(holding))
+            for key in holding:
+                frequency = sum(weight * documents_fields[key][field].count(word) / (1 - bm25.b + bm25.b * len(
+                    documents_fields[key][field]) / average_lengths[field]) for field, weight in field_weights.items())
+                if frequency > 0:
+                    expected[key] = expected.get(key, 0) + idf * \
+                        frequency * (bm25.k1 + 1) / (frequency + bm25.k1)
+        assert_same_ranking(bm25.rank_documents(words, 1000, None, None, None, []),
+                            sorted(expected.items(), key=lambda match: -match[1]))
+
+
+@pytest.mark.parametrize("serving_mode,dynamic_pruning", [("memory", False), ("memory", True), ("segment", True), ("impact", False), ("db", False)])
+@pytest.mark.parametrize("words", QUERIES[1:])
+def test_conjunctive_is_any_word_ranking_of_documents_holding_every_word(indexer: Indexer, serving_mode: str, dynamic_pruning: bool, words: list[str]):
+    bm25 = BM25(indexer, serving_mode=serving_mode,
+                dynamic_pruning=dynamic_pruning)
+    index = BM25(indexer, serving_mode="memory").memory_index
+    holding = set.intersection(*(set(index.doc_keys[i] for i in index.postings(word)[0].tolist())
+                                 for word in words))
+    for filters in [(None, None, None, []), ("windows", None, None, [])]:
+        ranked = bm25.rank_documents(words, 1000, *filters)
+        every_word = [(key, score) for key, score in ranked if key in holding]
+        for n in (3, 10, 40):
+            conjunctive = bm25.rank_documents(words, n, *filters, None, True)
+            # any word ranking when too few documents hold every word
+            expected = every_word if len(every_word) >= n else ranked
+            assert [score for _, score in conjunctive] == pytest.approx(
+                [score for _, score in expected[:n]])
+            assert all(key in dict(expected) for key, _ in conjunctive)
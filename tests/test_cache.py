@@ -0,0 +1,117 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.cache import DocumentCache, PostingsCache, QueryCache
+from app.engine.indexer import Indexer
+from app.engine.store import DocumentStore
+from utils.logger import LOGGER
+
+
+def test_query_cache_evicts_least_recently_used_and_expired(monkeypatch: pytest.MonkeyPatch):
+    now = [0.0]
+    monkeypatch.setattr("app.engine.cache.time.monotonic", lambda: now[0])
+    cache = QueryCache(2, ttl=10)
+    assert cache.get("a", 1) is None
+    cache.put("a", 1, "A")
+    cache.put("b", 1, "B")
+    assert cache.get("a", 1) == "A"
+    cache.put("c", 1, "C")
+    assert cache.get("b", 1) is None
+    assert cache.get("a", 1) == "A"
+
+    now[0] = 11
+    assert cache.get("a", 1) is None
+    cache.put("d", 1, "D")
+    # another generation drops every entry
+    assert cache.get("d", 2) is None
+    assert cache.stats()["size"] == 0
+    assert cache.get("d", 1) is None
+    assert QueryCache(0).get("a", 1) is None
+
+
+def test_normalized_queries_are_served_from_cache(indexer: Indexer, monkeypatch: pytest.MonkeyPatch):
+    bm25 = BM25(indexer, serving_mode="memory", cache_size=8)
+    documents = bm25.query_sources_documents(
+        ["rpg", "dungeon"], 10, "Linux", None, "BETA", ["Sword"])
+    assert len(documents) > 0
+    assert bm25.query_sources_documents(
+        ["dungeon", "rpg"], 10, "linux", None, "beta", ["sword"]) == documents
+    assert bm25.query_cache.stats()["hits"] == 1
+
+    # other number of documents, then other index
+    bm25.query_sources_documents(
+        ["dungeon", "rpg"], 5, "linux", None, "beta", ["sword"])
+    monkeypatch.setattr(indexer, "collection_hash", "changed")
+    bm25.query_sources_documents(
+        ["dungeon", "rpg"], 10, "linux", None, "beta", ["sword"])
+    assert bm25.query_cache.stats()["hits"] == 1
+    assert bm25.query_cache.stats()["size"] == 1
+
+
+def test_postings_cache_keeps_words_looked_up_the_most():
+    def postings(n: int) -> tuple[np.ndarray, ...]:
+        return (np.zeros(n, dtype=np.int8),)
+
+    cache = PostingsCache(100)
+    for word, lookups in (("hot", 3), ("warm", 2), ("cold", 1)):
+        for _ in range(lookups):
+            cache.get(word)
+        cache.put(word, postings(40))
+    # cold would evict words looked up more often
+    assert list(cache.entries) == ["hot", "warm"]
+
+    # looked up as often as warm, evicts it
+    for _ in range(2):
+        cache.get("new")
+    cache.put("new", postings(40))
+    assert list(cache.entries) == ["hot", "new"]
+    assert cache.stats()["bytes"] == 80
+    cache.put("huge", postings(101))
+    assert "huge" not in cache.entries
+
+def test_db_ranking_with_postings_cache(indexer: Indexer, monkeypatch: pytest.MonkeyPatch):
+    expected = BM25(indexer, serving_mode="db").rank_documents(
+        ["rpg", "dungeon", "missing"], 20, None, None, None, [])
+    monkeypatch.setattr(indexer, "postings_cache", PostingsCache(1 << 20))
+    bm25 = BM25(indexer, serving_mode="db")
+    for _ in range(2):
+        assert bm25.rank_documents(["rpg", "dungeon", "missing"], 20,
+                                   None, None, None, []) == expected
+    # missing words are read again
+    assert indexer.postings_cache.stats()["hits"] == 2
+    assert indexer.postings_cache.stats()["size"] == 2
+
+
+def test_document_cache_evicts_least_recently_used_bytes():
+    cache = DocumentCache(100)
+    cache.put("a", 1, 40, "A")
+    cache.put("b", 1, 40, "B")
+    assert cache.get("a", 1) == "A"
+    cache.put("c", 1, 40, "C")
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.stats()["bytes"] == 80
+    # entries of a store file written again are dropped
+    assert cache.get("a", 2) is None
+    assert list(cache.entries) == ["c"]
+    cache.put("d", 1, 101, "D")
+    assert cache.get("d", 1) is None
+
+
+def test_store_documents_are_parsed_once(indexer: Indexer, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    documents = [indexer.document_store.get("itch", i) for i in range(5)]
+    Path(tmp_path, LOGGER.LOG_FILE).parent.mkdir(parents=True)
+    monkeypatch.chdir(tmp_path)
+    store = DocumentStore(1 << 20)
+    store.write("itch", documents, "first")
+    document = store.get("itch", 3)
+    assert store.get("itch", 3) is document
+    assert store.cache.stats()["hits"] == 1
+    assert document == documents[3]
+
+    # written again, parsed again
+    documents[3] = documents[3].model_copy(update={"id": "itch-changed"})
+    store.write("itch", documents, "second")
+    assert store.get("itch", 3).id == "itch-changed"
@@ -0,0 +1,232 @@
+from collections import Counter
+import os
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.memory import MemoryIndex
+from app.engine.parser import Parser
+from conftest import write_collection, write_collection_documents
+
+
+def build(parser: Parser, folder: Path, monkeypatch: pytest.MonkeyPatch, **kwargs) -> tuple[MemoryIndex, list[tuple]]:
+    """
+    Index arrays and fields postings of the collection of folder, built
+    with kwargs
+    """
+    monkeypatch.chdir(folder)
+    indexer = Indexer(parser, **kwargs)
+    index = MemoryIndex(indexer.connection)
+    fields = indexer.connection.execute(
+        "SELECT field, word, document_id, frequency FROM field_postings ORDER BY ALL").fetchall()
+    indexer.connection.close()
+    return index, fields
+
+
+def assert_same_index(index: MemoryIndex, expected: MemoryIndex):
+    """
+    Same documents and postings of each word, whatever the ids of words
+    """
+    assert index.doc_keys == expected.doc_keys
+    assert np.array_equal(index.doc_lengths, expected.doc_lengths)
+    assert index.words.keys() == expected.words.keys()
+    for word in expected.words:
+        doc_ids, frequencies = index.postings(word)
+        expected_doc_ids, expected_frequencies = expected.postings(word)
+        assert np.array_equal(doc_ids, expected_doc_ids)
+        assert np.array_equal(frequencies, expected_frequencies)
+
+
+def documents_postings(index: MemoryIndex) -> tuple[dict[tuple[str, int], float], dict[str, dict[tuple[str, int], int]]]:
+    """
+    Length of each document and postings of each word by document key, as
+    documents updated in place get new ids
+    """
+    lengths = dict(zip(index.doc_keys, index.doc_lengths.tolist()))
+    postings = {}
+    for word in index.words:
+        doc_ids, frequencies = index.postings(word)
+        if len(doc_ids) > 0:
+            postings[word] = {index.doc_keys[doc_id]: frequency for doc_id,
+                              frequency in zip(doc_ids.tolist(), frequencies.tolist())}
+    return lengths, postings
+
+
+@pytest.mark.parametrize("build_workers", [1, 2])
+def test_spimi_build_streams_files_into_same_index(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch, build_workers: int):
+    write_collection(tmp_path / "memory", 120)
+    write_collection(tmp_path / "spimi", 120)
+    expected, expected_fields = build(parser, tmp_path / "memory", monkeypatch)
+
+    def read_whole_collection(*args):
+        raise AssertionError("collection read at once")
+    monkeypatch.setattr(Indexer, "read_collection_files",
+                        read_whole_collection)
+    # a run every few chunks
+    monkeypatch.setattr(Indexer, "BUILD_CHUNK_SIZE", 16)
+    monkeypatch.setattr(Indexer, "SPIMI_POSTING_BYTES", 1024)
+    index, fields = build(parser, tmp_path / "spimi", monkeypatch,
+                          build_memory_budget=1, build_workers=build_workers)
+
+    assert_same_index(index, expected)
+    assert fields == expected_fields
+
+
+def test_tables_hold_parsed_words_of_every_document(indexer: Indexer, parser: Parser):
+    rows = indexer.connection.execute("""
+SELECT d.collection_name, d.index, d.words_length, l.word, p.word_frequency_within_document
+FROM postings p
+JOIN lexicon l ON l.word_id = p.lexicon_id
+JOIN documents d ON d.document_id = p.document_id
+""").fetchall()
+    documents: dict[tuple[str, int], tuple[int, dict[str, int]]] = {}
+    for collection_name, index, words_length, word, frequency in rows:
+        documents.setdefault((collection_name, index), (words_length, {}))[
+            1][word] = frequency
+
+    assert len(documents) == 300
+    for key, (words_length, frequencies) in documents.items():
+        words = parser.parse_text_to_words(
+            indexer.document_store.get(*key).metadata.text)
+        assert words_length == len(words)
+        assert frequencies == Counter(words)
+
+
+def test_incremental_update_is_full_build(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path / "updated", 60)
+    build(parser, tmp_path / "updated", monkeypatch)
+
+    # change, add and remove documents of one file
+    collection["steam"][5]["metadata"]["text"] = "Elden Ring. sword magic sword"
+    collection["steam"].append(
+        {**collection["steam"][1], "id": "steam-new"})
+    del collection["steam"][20]
+    write_collection_documents(tmp_path / "updated", collection)
+    write_collection_documents(tmp_path / "full", collection)
+    expected, _ = build(parser, tmp_path / "full", monkeypatch)
+
+    def rebuild(*args):
+        raise AssertionError("index rebuilt")
+    monkeypatch.setattr(Indexer, "build_inverted_index", rebuild)
+    index, _ = build(parser, tmp_path / "updated", monkeypatch)
+
+    assert documents_postings(index) == documents_postings(expected)
+
+
+def test_manifest_reads_only_files_touched_since_last_build(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    write_collection(tmp_path, 20)
+    build(parser, tmp_path, monkeypatch)
+
+    hashed: list[str] = []
+    hash_file = Indexer.hash_file
+
+    def count_hashed(self, path: Path) -> str:
+        hashed.append(path.name)
+        return hash_file(self, path)
+
+    def rebuild(*args):
+        raise AssertionError("collection indexed again")
+    monkeypatch.setattr(Indexer, "hash_file", count_hashed)
+    monkeypatch.setattr(Indexer, "build_inverted_index", rebuild)
+    monkeypatch.setattr(Indexer, "update_inverted_index", rebuild)
+
+    build(parser, tmp_path, monkeypatch)
+    assert hashed == []
+
+    # touched but unchanged, hashed once then trusted again
+    path = tmp_path / Indexer.COLLECTION_FOLDER / "itch.json"
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
+    build(parser, tmp_path, monkeypatch)
+    build(parser, tmp_path, monkeypatch)
+    assert hashed == ["itch.json"]
+
+
+def test_parallel_build_is_single_process_build(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    write_collection(tmp_path / "single", 120)
+    write_collection(tmp_path / "parallel", 120)
+    expected, expected_fields = build(parser, tmp_path / "single", monkeypatch)
+
+    # chunks of both files parsed by both workers
+    monkeypatch.setattr(Indexer, "BUILD_CHUNK_SIZE", 16)
+    index, fields = build(parser, tmp_path / "parallel", monkeypatch,
+                          build_workers=2)
+
+    assert_same_index(index, expected)
+    assert fields == expected_fields
+
+
+def test_lexicon_frequencies_follow_incremental_updates(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path, 40)
+    monkeypatch.chdir(tmp_path)
+    Indexer(parser).connection.close()
+
+    collection["itch"][0]["metadata"]["text"] = "Flappy Bird. cat cat dog"
+    del collection["itch"][1]
+    del collection["steam"]
+    (tmp_path / Indexer.COLLECTION_FOLDER / "steam.json").unlink()
+    write_collection_documents(tmp_path, collection)
+    indexer = Indexer(parser)
+
+    lexicon = indexer.connection.execute("""
+SELECT l.word, l.collection_frequency, l.document_frequency, COALESCE(SUM(p.word_frequency_within_document), 0), COUNT(p.document_id)
+FROM lexicon l
+LEFT JOIN postings p ON p.lexicon_id = l.word_id
+GROUP BY ALL
+""").fetchall()
+    for word, collection_frequency, document_frequency, frequencies, documents in lexicon:
+        assert (collection_frequency, document_frequency) == (frequencies, documents), word
+    bm25 = BM25(indexer, serving_mode="db")
+    documents_holding = {word: documents for word, *_, documents in lexicon}
+    assert bm25.idf("cat") == pytest.approx(
+        bm25.compute_idf(documents_holding["cat"]))
+    indexer.connection.close()
+
+
+def test_attribute_tables_follow_incremental_updates(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path, 30)
+    monkeypatch.chdir(tmp_path)
+    Indexer(parser).connection.close()
+
+    metadata = collection["itch"][4]["metadata"]
+    metadata["platforms"], metadata["category"], metadata["tags"] = [
+        "Android"], "Tool", ["Farm", "zombie"]
+    del collection["itch"][0]
+    write_collection_documents(tmp_path, collection)
+    indexer = Indexer(parser)
+
+    keys = {(source, idx): 1 for source, documents in collection.items()
+            for idx in range(len(documents))}
+    for filters in [("android", None, None, []), (None, "tool", None, ["farm", "zombie"]), ("windows", "game", "beta", [])]:
+        in_db = indexer.filter_documents(keys, *filters)
+        assert in_db == indexer.filter_documents_in_store(keys, *filters)
+        assert len(in_db) > 0
+    assert ("itch", 3) in indexer.filter_documents(
+        keys, "android", "tool", None, ["farm"])
+    indexer.connection.close()
+
+
+def test_side_files_are_written_for_enabled_features_only(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    write_collection(tmp_path, 20)
+    monkeypatch.chdir(tmp_path)
+    paths = [Path(path) for path in (Indexer.FACETS_PATH, Indexer.FIELDS_PATH,
+                                     Indexer.SUGGEST_PATH, Indexer.SPELLING_PATH, Indexer.IMPACTS_PATH)]
+    indexer = Indexer(parser)
+    assert not any(path.exists() for path in paths)
+    bm25 = BM25(indexer, serving_mode="memory",
+                field_weights={"body": 1, "title": 2})
+    assert (bm25.facet_index, bm25.field_index,
+            bm25.suggest_index, bm25.spelling_index) == (None, None, None, None)
+    indexer.connection.close()
+
+    indexer = Indexer(parser, facets=True, fields=True,
+                      suggestions=True, spelling=True, impacts=True)
+    assert all(path.exists() for path in paths)
+    bm25 = BM25(indexer, serving_mode="memory",
+                field_weights={"body": 1, "title": 2})
+    assert None not in (bm25.facet_index, bm25.field_index,
+                        bm25.suggest_index, bm25.spelling_index)
+    indexer.connection.close()
@@ -0,0 +1,35 @@
+from flask.testing import FlaskClient
+
+
+def test_cursor_pages_reject_empty_pages(client: FlaskClient):
+    for documents in (0, -1):
+        response = client.post(
+            "/query", json={"query": "sword", "documents": documents, "cursor": None})
+        assert response.status_code == 400
+
+
+def test_batch_answers_as_queries(client: FlaskClient):
+    queries = [{"query": "sword rpg"}, {"query": "\"hollow knight\"", "documents": 5},
+               {"query": "dungeon", "platform": "Linux", "tags": ["Sword"]}]
+    response = client.post("/query/batch", json={"queries": queries})
+    assert response.status_code == 200
+    assert response.get_json() == [client.post(
+        "/query", json=query).get_json() for query in queries]
+    assert client.post("/query/batch", json={"queries": [{"documents": 5}]}).status_code == 400
+
+
+def test_cursor_pages_are_query_slices(client: FlaskClient):
+    body = {"query": "dungeon sword", "platform": "linux"}
+    documents = []
+    cursor = None
+    for _ in range(3):
+        response = client.post(
+            "/query", json={**body, "documents": 10, "cursor": cursor})
+        assert response.status_code == 200
+        documents.extend(response.get_json()["documents"])
+        cursor = response.get_json()["cursor"]
+    assert len(documents) == 30
+    assert documents == client.post(
+        "/query", json={**body, "documents": 30}).get_json()
+    assert client.post(
+        "/query", json={**body, "cursor": "bad"}).status_code == 410
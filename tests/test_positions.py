@@ -0,0 +1,113 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+import app.engine.indexer
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.positions import PositionIndex, read_positions_hash, words_hold_phrase
+from conftest import write_collection, write_collection_documents
+
+
+def documents_positions(folder: Path) -> dict[tuple[str, int], tuple[list[str], list[list[int]]]]:
+    """
+    Words and characters of every document of the positions of folder, by
+    document key, as doc ids depend on the order documents were indexed in
+    """
+    position_index = PositionIndex(folder / Indexer.POSITIONS_PATH)
+    words, terms, starts = position_index.documents_terms()
+    return {key: ([words[t] for t in terms[starts[doc_id]:starts[doc_id + 1]]], position_index.word_offsets(doc_id).tolist())
+            for doc_id, key in enumerate(position_index.doc_keys)}
+
+
+def test_incremental_positions_are_full_build_positions(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path / "updated", 60, seed=1)
+    monkeypatch.chdir(tmp_path / "updated")
+    Indexer(parser, positions=True).connection.close()
+
+    # change, add and remove documents of one file only
+    collection["itch"][3]["metadata"]["text"] = "Hollow Knight. zombie city farm"
+    collection["itch"].append({**collection["itch"][0], "id": "itch-new"})
+    del collection["itch"][10]
+    write_collection_documents(tmp_path / "updated", collection)
+
+    parsed: list[int] = []
+    parse_chunks = Indexer.parse_chunks
+
+    def count_parsed(self, chunks, *args):
+        chunks = list(chunks)
+        parsed.extend(doc_id for chunk in chunks for doc_id, *_ in chunk)
+        return parse_chunks(self, chunks, *args)
+    monkeypatch.setattr(Indexer, "parse_chunks", count_parsed)
+    Indexer(parser, positions=True).connection.close()
+    # only documents of the changed file are parsed
+    assert len(parsed) == len(collection["itch"])
+
+    write_collection_documents(tmp_path / "full", collection)
+    monkeypatch.chdir(tmp_path / "full")
+    Indexer(parser, positions=True).connection.close()
+
+    assert documents_positions(
+        tmp_path / "updated") == documents_positions(tmp_path / "full")
+
+
+def test_positions_failure_does_not_stop_indexer(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    write_collection(tmp_path, 20)
+    monkeypatch.chdir(tmp_path)
+
+    def fail(*args):
+        raise Exception("disk full")
+    monkeypatch.setattr(app.engine.indexer, "write_positions", fail)
+    indexer = Indexer(parser, positions=True)
+
+    assert read_positions_hash(Path(Indexer.POSITIONS_PATH)) is None
+    bm25 = BM25(indexer, serving_mode="memory")
+    assert bm25.position_index is None
+    words, phrases = parser.parse_query('"hollow knight"')
+    expected = bm25.rank_documents(words, 100, None, None, None, [])
+    assert all(key in dict(expected) for key, _ in bm25.rank_documents(
+        words, 100, None, None, None, [], phrases))
+    indexer.connection.close()
+
+
+def test_words_hold_phrase():
+    words = ["open", "world", "rpg", "open", "sword", "world"]
+    assert words_hold_phrase(words, ["open", "world"])
+    assert not words_hold_phrase(words, ["world", "open"])
+    assert not words_hold_phrase(words, ["open", "rpg"])
+    assert words_hold_phrase(words, ["open", "rpg"], 1)
+    assert words_hold_phrase(words, ["open", "world", "open"], 1)
+    assert not words_hold_phrase(words, ["rpg", "world"], 1)
+    assert words_hold_phrase(words, ["rpg", "world"], 2)
+    assert words_hold_phrase(words, ["open", "open"], 2)
+    assert not words_hold_phrase(words, ["open", "open"], 1)
+
+
+@pytest.mark.parametrize("phrase,slop", [("hollow knight", 0), ("knight hollow", 0), ("sword dungeon", 0), ("sword dungeon", 2), ("rpg rpg", 1), ("space shooter pixel", 3)])
+def test_phrase_documents_are_documents_holding_phrase(indexer: Indexer, parser: Parser, phrase: str, slop: int):
+    position_index = PositionIndex(Path(indexer.POSITIONS_PATH))
+    words = parser.parse_text_to_words(phrase)
+    expected = [doc_id for doc_id, key in enumerate(position_index.doc_keys) if words_hold_phrase(
+        parser.parse_text_to_words(indexer.document_store.get(*key).metadata.text), words, slop)]
+    assert position_index.phrase_documents(words, slop).tolist() == expected
+    candidates = np.arange(0, position_index.documents_number, 3)
+    assert position_index.phrase_documents(words, slop, candidates).tolist() == [
+        doc_id for doc_id in expected if doc_id % 3 == 0]
+
+
+def test_phrase_queries_match_with_and_without_positions(indexer: Indexer, parser: Parser):
+    words, phrases = parser.parse_query('"Hollow Knight" rpg "sword  dungeon"~2 "race"')
+    assert phrases == [(["hollow", "knight"], 0), (["sword", "dungeon"], 2)]
+    assert words == ["hollow", "knight", "rpg", "sword", "dungeon", "race"]
+
+    words, phrases = parser.parse_query('"hollow knight" race')
+    with_positions = BM25(indexer, serving_mode="memory")
+    assert with_positions.position_index is not None
+    without_positions = BM25(indexer, serving_mode="memory")
+    without_positions.position_index = None
+    ranked = with_positions.rank_documents(words, 1000, None, None, None, [], phrases)
+    assert len(ranked) > 0
+    assert ranked == without_positions.rank_documents(
+        words, 1000, None, None, None, [], phrases)
@@ -0,0 +1,38 @@
+from pathlib import Path
+
+import numpy as np
+
+from app.engine.indexer import Indexer
+from app.engine.memory import MemoryIndex
+from app.engine.segment import Segment, decode_varints, encode_varints
+
+
+def test_varints_round_trip():
+    rng = np.random.default_rng(0)
+    values = np.concatenate((np.arange(300), rng.integers(
+        0, 2**40, 1000), [2**63 - 1])).astype(np.uint64)
+    encoded, n_bytes = encode_varints(values)
+    # 7 bits per byte
+    assert n_bytes.tolist() == [max(1, -(-v.bit_length() // 7))
+                                for v in values.tolist()]
+    assert np.array_equal(decode_varints(encoded).astype(np.uint64), values)
+
+
+def test_segment_is_memory_index(indexer: Indexer):
+    index = MemoryIndex(indexer.connection)
+    segment = Segment(Path(indexer.SEGMENT_PATH))
+    assert segment.collection_hash == indexer.collection_hash
+
+    assert segment.doc_keys == index.doc_keys
+    assert np.array_equal(segment.doc_lengths, index.doc_lengths)
+    assert segment.words == index.words
+    assert np.array_equal(segment.document_frequencies,
+                          index.document_frequencies)
+    for word in index.words:
+        doc_ids, frequencies = segment.postings(word)
+        expected_doc_ids, expected_frequencies = index.postings(word)
+        assert np.array_equal(doc_ids, expected_doc_ids)
+        assert np.array_equal(frequencies, expected_frequencies)
+    for array, expected in zip(segment.all_postings(), index.all_postings()):
+        assert np.array_equal(array, expected)
+    assert segment.postings("missing") is None
@@ -0,0 +1,99 @@
+import os
+from pathlib import Path
+import random
+
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.segmented import SegmentedIndex
+from conftest import make_document, write_collection, write_collection_documents
+
+
+WORDS = ["sword", "rpg", "dungeon", "hollow", "space", "cat"]
+
+
+def full_build_scores(parser: Parser, folder: Path, collection: dict[str, list[dict]], monkeypatch: pytest.MonkeyPatch) -> dict[str, dict[tuple[str, int], float]]:
+    """
+    Scores of every document holding each of WORDS, served from memory
+    after building collection from scratch in folder
+    """
+    write_collection_documents(folder, collection)
+    monkeypatch.chdir(folder)
+    indexer = Indexer(parser)
+    bm25 = BM25(indexer, serving_mode="memory")
+    scores = {word: dict(bm25.rank_documents([word], 1000, None, None, None, []))
+              for word in WORDS}
+    indexer.connection.close()
+    return scores
+
+
+def test_segmented_index_is_full_build_after_ingests_and_merges(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(SegmentedIndex, "MIN_SEGMENT_DOCUMENTS", 2)
+    collection = write_collection(tmp_path / "segmented", 30)
+    monkeypatch.chdir(tmp_path / "segmented")
+    indexer = Indexer(parser)
+    bm25 = BM25(indexer, serving_mode="segmented", ingest_interval=3600)
+    segmented = bm25.segmented_index
+    # maintenance is run by hand
+    segmented.stop()
+
+    rng = random.Random(1)
+    for step in range(6):
+        # change, add and remove a few documents of one file
+        source = ("itch", "steam")[step % 2]
+        collection[source][step] = make_document(source, 100 + step, rng)
+        collection[source].append(make_document(source, 200 + step, rng))
+        del collection[source][10 + step]
+        expected = full_build_scores(
+            parser, tmp_path / "full", collection, monkeypatch)
+
+        monkeypatch.chdir(tmp_path / "segmented")
+        write_collection_documents(tmp_path / "segmented", collection)
+        # size may not change, mtime must
+        path = Path(Indexer.COLLECTION_FOLDER, f"{source}.json")
+        os.utime(path, ns=(path.stat().st_atime_ns,
+                 path.stat().st_mtime_ns + (step + 1) * 10**9))
+        before = segmented.snapshot()[0]
+        masks = [live.deleted.copy() for live in before]
+        segmented.ingest()
+        # ingesting never changes the segments a query may be reading
+        assert all((live.deleted == mask).all()
+                   for live, mask in zip(before, masks))
+        for merging in (False, True):
+            while merging and segmented.merge_next():
+                pass
+            for word in WORDS:
+                scores = dict(bm25.rank_documents(
+                    [word], 1000, None, None, None, []))
+                assert scores.keys() == expected[word].keys()
+                for key, score in expected[word].items():
+                    assert scores[key] == pytest.approx(score)
+
+    # segments were merged, dropping deleted documents
+    assert len(segmented.segments) < segmented.next_segment
+    assert segmented.documents_number == sum(
+        len(documents) for documents in collection.values())
+    indexer.connection.close()
+
+
+def test_segmented_conjunctive_is_memory_conjunctive(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    monkeypatch.setattr(SegmentedIndex, "MIN_SEGMENT_DOCUMENTS", 2)
+    write_collection(tmp_path, 30)
+    monkeypatch.chdir(tmp_path)
+    indexer = Indexer(parser)
+    memory = BM25(indexer, serving_mode="memory")
+    segmented = BM25(indexer, serving_mode="segmented", ingest_interval=3600)
+    segmented.segmented_index.stop()
+
+    for words in (["sword", "rpg"], ["dungeon", "space", "cat"]):
+        for filters in [(None, None, None, []), ("windows", None, None, [])]:
+            for n in (3, 10, 40):
+                expected = memory.rank_documents(
+                    words, n, *filters, None, True)
+                ranked = segmented.rank_documents(
+                    words, n, *filters, None, True)
+                assert [score for _, score in ranked] == pytest.approx(
+                    [score for _, score in expected])
+    indexer.connection.close()
@@ -0,0 +1,90 @@
+from pathlib import Path
+
+from flask.testing import FlaskClient
+import numpy as np
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.snippets import make_snippet
+from conftest import write_collection, write_collection_documents
+
+
+def test_snippets_are_read_from_positions(indexer: Indexer, parser: Parser):
+    bm25 = BM25(indexer, serving_mode="memory")
+    assert bm25.position_index is not None
+    words = parser.parse_text_to_words("hollow sword dungeon")
+    items = bm25.query_sources_documents(words, 30, None, None, None, [])
+    for (_, doc), snippet in zip(items, bm25.snippets(words, items)):
+        assert len(snippet["highlights"]) > 0
+        for start, end in snippet["highlights"]:
+            assert parser.parse_text_to_words(
+                snippet["text"][start:end])[0] in words
+
+    # documents are never parsed again
+    bm25.position_index = None
+    with pytest.raises(Exception):
+        bm25.snippets(words, items)
+
+
+def test_snippets_of_documents_sharing_an_id(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path, 20)
+    collection["itch"][1]["id"] = collection["itch"][0]["id"]
+    collection["itch"][0]["metadata"]["text"] = "Space farm. Cozy farm with cats"
+    collection["itch"][1]["metadata"]["text"] = "Space race. Race cars in space, farm optional"
+    write_collection_documents(tmp_path, collection)
+    monkeypatch.chdir(tmp_path)
+    indexer = Indexer(parser, positions=True)
+
+    bm25 = BM25(indexer, serving_mode="memory")
+    words = parser.parse_text_to_words("farm")
+    items = [item for item in bm25.query_sources_documents(
+        words, 40, None, None, None, []) if item[0] in (("itch", 0), ("itch", 1))]
+    assert len(items) == 2
+    for (_, doc), snippet in zip(items, bm25.snippets(words, items)):
+        assert doc.metadata.text.startswith(snippet["text"])
+    indexer.connection.close()
+
+
+def test_snippet_is_window_holding_most_query_words(parser: Parser):
+    text = "Sword intro. " + "filler " * 30 + "A dungeon with a sword and a dungeon boss. " + "more " * 30
+    words, offsets = parser.parse_text_to_words_offsets(text)
+    query = parser.parse_text_to_words("sword dungeon")
+    positions = np.array([i for i, word in enumerate(words) if word in query])
+    indexes = np.array([query.index(words[i]) for i in positions.tolist()])
+
+    snippet = make_snippet(text, np.array(offsets), positions, indexes, 10)
+    assert snippet["text"].startswith("filler")
+    assert "dungeon boss" in snippet["text"]
+    assert [snippet["text"][start:end] for start, end in snippet["highlights"]] == [
+        "dungeon", "sword", "dungeon"]
+    # no match, text starts the snippet
+    assert make_snippet(text, np.array(offsets), np.zeros(0, dtype=np.int64), np.zeros(
+        0, dtype=np.int64), 10)["text"].startswith("Sword intro")
+
+
+def test_query_returns_snippets_instead_of_texts(client: FlaskClient, parser: Parser):
+    response = client.post(
+        "/query", json={"query": "dungeon sword", "documents": 5, "snippets": True})
+    assert response.status_code == 200
+    documents = response.get_json()
+    assert len(documents) == 5
+    for document in documents:
+        assert document["metadata"]["text"] == ""
+        snippet = document["snippet"]
+        assert len(snippet["highlights"]) > 0
+        for start, end in snippet["highlights"]:
+            assert parser.parse_text_to_words(
+                snippet["text"][start:end]) in (["dungeon"], ["sword"])
+
+
+def test_snippets_without_positions_are_rejected(client: FlaskClient, monkeypatch: pytest.MonkeyPatch):
+    import app.main
+    assert b"const SNIPPETS = true" in client.get("/").data
+    monkeypatch.setattr(app.main.bm25, "position_index", None)
+    assert b"const SNIPPETS = false" in client.get("/").data
+    response = client.post(
+        "/query", json={"query": "dungeon sword", "snippets": True})
+    assert response.status_code == 400
+    assert client.post("/query", json={"query": "dungeon sword"}).status_code == 200
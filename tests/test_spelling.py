@@ -0,0 +1,101 @@
+from itertools import combinations
+from pathlib import Path
+import random
+
+from flask.testing import FlaskClient
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.spelling import SpellingIndex, character_bits, deletes, edit_distance
+
+
+def test_expand_words_replaces_missing_words_only(indexer: Indexer, parser: Parser):
+    bm25 = BM25(indexer, serving_mode="memory")
+    words = parser.parse_text_to_words("eldn ring holow knight")
+    assert bm25.expand_words(words) == parser.parse_text_to_words(
+        "elden ring hollow knight")
+    # words of the lexicon are searched as typed
+    words = parser.parse_text_to_words("sword dungeon")
+    assert bm25.expand_words(words) == words
+
+
+def test_corrected_query_is_query_as_meant(indexer: Indexer, parser: Parser):
+    bm25 = BM25(indexer, serving_mode="memory")
+    meant = parser.parse_text_to_words("elden ring")
+    typed = bm25.expand_words(parser.parse_text_to_words("eldn ring"))
+    for conjunctive in (False, True):
+        assert bm25.rank_documents(typed, 10, None, None, None, [], None, conjunctive) == bm25.rank_documents(
+            meant, 10, None, None, None, [], None, conjunctive)
+
+
+def test_phrase_words_are_corrected(client: FlaskClient):
+    typed = client.post(
+        "/query", json={"query": "\"holow knight\"", "documents": 10, "fuzzy": True})
+    meant = client.post(
+        "/query", json={"query": "\"hollow knight\"", "documents": 10, "fuzzy": False})
+    assert len(meant.get_json()) > 0
+    assert typed.get_json() == meant.get_json()
+
+
+def optimal_string_alignment(a: str, b: str) -> int:
+    """
+    Distance of a and b computed over the whole matrix
+    """
+    d = [[i + j if i == 0 or j == 0 else 0 for j in range(len(b) + 1)]
+         for i in range(len(a) + 1)]
+    for i in range(1, len(a) + 1):
+        for j in range(1, len(b) + 1):
+            d[i][j] = min(d[i - 1][j] + 1, d[i][j - 1] + 1,
+                          d[i - 1][j - 1] + (a[i - 1] != b[j - 1]))
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                d[i][j] = min(d[i][j], d[i - 2][j - 2] + 1)
+    return d[len(a)][len(b)]
+
+
+def test_edit_distance_is_optimal_string_alignment():
+    rng = random.Random(0)
+    for _ in range(3000):
+        a = "".join(rng.choices("abcd", k=rng.randint(0, 9)))
+        b = "".join(rng.choices("abcd", k=rng.randint(0, 9)))
+        expected = optimal_string_alignment(a, b)
+        for max_distance in (1, 2, 3):
+            assert edit_distance(a, b, max_distance) == min(
+                expected, max_distance + 1), (a, b)
+            assert edit_distance(a, b, max_distance, character_bits(
+                a)) == min(expected, max_distance + 1)
+    # a transposed pair isn't edited again, unlike Damerau-Levenshtein
+    assert edit_distance("ca", "abc", 3) == 3
+
+
+def test_deletes_are_strings_made_by_deleting_characters():
+    word = "hollow"
+    expected: dict[str, int] = {}
+    for level in range(3):
+        for kept in combinations(range(len(word)), len(word) - level):
+            expected.setdefault("".join(word[i] for i in kept), level)
+    assert deletes(word, 2) == expected
+
+
+def test_correction_is_nearest_word_of_lexicon(indexer: Indexer):
+    spelling = SpellingIndex(Path(indexer.SPELLING_PATH))
+    lexicon = dict(indexer.connection.execute(
+        "SELECT word, collection_frequency FROM lexicon").fetchall())
+    rng = random.Random(0)
+    typos = ["eldn", "holow", "knigth", "sowrd", "dungoen", "shoter", "platfomer", "zzzzzz", "ca"]
+    for word in rng.sample(sorted(lexicon), 40):
+        i = rng.randrange(len(word))
+        typos.append(word[:i] + word[i + 1:])
+        typos.append(word[:i] + rng.choice("aeiou") + word[i:])
+
+    for typo in typos:
+        expected = None
+        if typo not in lexicon and len(typo) >= SpellingIndex.MIN_LENGTH:
+            max_distance = 1 if len(typo) <= SpellingIndex.SHORT_LENGTH else SpellingIndex.MAX_DISTANCE
+            distances = {word: optimal_string_alignment(
+                typo, word) for word in lexicon}
+            nearest = min(distances.values())
+            if nearest <= max_distance:
+                expected = min((word for word, distance in distances.items() if distance == nearest),
+                               key=lambda word: (-lexicon[word], word))
+        assert spelling.correction(typo) == expected, typo
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+import pytest
+
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.store import DocumentStore
+from conftest import write_collection, write_collection_documents
+
+
+def test_store_documents_are_collection_documents(indexer: Indexer):
+    collection = indexer.read_collection_files()
+    assert len(collection) > 0
+    for name, documents in collection.items():
+        for idx, document in enumerate(documents):
+            assert indexer.document_store.get(name, idx) == document
+        assert indexer.document_store.get(name, len(documents)) is None
+        assert indexer.document_store.get_by_id(
+            name, documents[7].id) == documents[7]
+    assert indexer.document_store.get("missing", 0) is None
+
+
+def test_store_writes_changed_files_only(parser: Parser, tmp_path: Path, monkeypatch: pytest.MonkeyPatch):
+    collection = write_collection(tmp_path, 20)
+    monkeypatch.chdir(tmp_path)
+    Indexer(parser).connection.close()
+
+    written: list[str] = []
+    write = DocumentStore.write
+
+    def count_written(self, name, *args):
+        written.append(name)
+        return write(self, name, *args)
+    monkeypatch.setattr(DocumentStore, "write", count_written)
+
+    collection["steam"][2]["metadata"]["title"] = "Hollow Knight"
+    write_collection_documents(tmp_path, collection)
+    indexer = Indexer(parser)
+    assert written == ["steam"]
+    assert indexer.document_store.get(
+        "steam", 2).metadata.title == "Hollow Knight"
+    indexer.connection.close()
@@ -0,0 +1,61 @@
+from collections import Counter
+
+import pytest
+
+from app.engine.bm25 import BM25
+from app.engine.indexer import Indexer
+from app.engine.parser import Parser
+from app.engine.suggest import SuggestIndex
+
+
+PREFIXES = ["h", "hol", "knight", "Elden R", "sw", "space sh", "dungeons", "adventuring", "zz"]
+
+
+def expected_suggestions(indexer: Indexer, parser: Parser, text: str, n: int) -> dict[str, list[str]]:
+    """
+    Completions of text found by scanning every title and word
+    """
+    words = parser.tokenizer(text)
+    titles: dict[str, Counter] = {}
+    for (title,) in indexer.connection.execute("SELECT title FROM documents").fetchall():
+        titles.setdefault(" ".join(parser.tokenizer(title)), Counter())[
+            " ".join(title.split())] += 1
+    # a title ranks at its first key starting with text
+    keys = sorted((-sum(titles[title].values()), " ".join(title.split(" ")[i:]), title)
+                  for title in titles for i in range(len(title.split(" ")))
+                  if " ".join(title.split(" ")[i:]).startswith(" ".join(words)))
+    expected_titles = list(dict.fromkeys(
+        sorted(titles[title].items(), key=lambda t: (-t[1], t[0]))[0][0] for _, _, title in keys))
+
+    # words as written most often within titles and tags, for each stem
+    lexicon = dict(indexer.connection.execute(
+        "SELECT word, collection_frequency FROM lexicon").fetchall())
+    forms: dict[str, Counter] = {}
+    for (text,) in indexer.connection.execute(
+            "SELECT title FROM documents UNION ALL SELECT tag FROM document_tags").fetchall():
+        for word in parser.stopwords_removal(parser.tokenizer(text)):
+            forms.setdefault(parser.stemmer.stem(word), Counter())[word] += 1
+    written = [(min(forms[stem].items(), key=lambda form: (-form[1], form[0]))[0], frequency)
+               for stem, frequency in lexicon.items() if stem in forms]
+    completions = [(word, frequency) for word, frequency in written if word.startswith(words[-1])] or \
+        [(word, frequency) for word, frequency in written if word.startswith(
+            parser.stemmer.stem(words[-1]))]
+    head = " ".join(words[:-1] + [""])
+    return {"titles": expected_titles[:n],
+            "words": [head + word for word, _ in sorted(completions, key=lambda c: (-c[1], c[0]))[:n]]}
+
+
+@pytest.mark.parametrize("large_range", [SuggestIndex.LARGE_RANGE, 2])
+def test_suggestions_are_best_titles_and_words_starting_with_text(indexer: Indexer, parser: Parser, monkeypatch: pytest.MonkeyPatch, large_range: int):
+    monkeypatch.setattr(SuggestIndex, "LARGE_RANGE", large_range)
+    suggest_index = BM25(indexer).suggest_index
+    assert suggest_index is not None
+    for text in PREFIXES:
+        for n in (1, 8):
+            # twice, the second time from kept positions
+            for _ in range(2):
+                assert suggest_index.suggest(text, n) == expected_suggestions(
+                    indexer, parser, text, n)
+    assert suggest_index.suggest("  ", 8) == {"titles": [], "words": []}
+    # stems are never shown
+    assert suggest_index.suggest("adventur", 8)["words"] == ["adventure"]
@@ -5,6 +5,40 @@ load_dotenv()
 
 DEFAULTS = {
     "COLLECTION_BASE_PATH": "./",
+    # where queries are served from: memory, segment, segmented, impact or db
+    "BM25_SERVING_MODE": "db",
+    # bits of the quantized scores of the impact serving mode, 8 or 16
+    "BM25_IMPACT_BITS": "8",
+    # skip documents that can't make the top k, memory and segment modes only
+    "BM25_DYNAMIC_PRUNING": "false",
+    # BM25F weights of body, title, tags and author fields, memory and segment modes only, the body alone is plain BM25
+    "BM25_FIELD_WEIGHTS": "body:1",
+    # queries results kept in cache, 0 disables it
+    "QUERY_CACHE_SIZE": "1024",
+    # seconds a cached query result is served for, 0 until evicted
+    "QUERY_CACHE_TTL": "300",
+    # score documents holding every query word only, any of them when fewer than asked for do, unless a query sets "conjunctive"
+    "QUERY_CONJUNCTIVE": "false",
+    # replace query words missing from the lexicon by their nearest word, unless a query sets "fuzzy", spelling is only indexed when true
+    "QUERY_FUZZY": "false",
+    # documents ranked at once for paginated queries
+    "QUERY_CURSOR_DEPTH": "300",
+    # seconds a paginated query can be scrolled for
+    "QUERY_CURSOR_TTL": "600",
+    # MB of posting lists cached when serving from db, 0 disables it
+    "POSTINGS_CACHE_SIZE": "64",
+    # MB of JSON records of documents kept parsed, 0 disables it
+    "DOCUMENT_CACHE_SIZE": "32",
+    # seconds between collection scans of the segmented serving mode
+    "SEGMENTED_INGEST_INTERVAL": "30",
+    # processes used to build the inverted index, 0 uses all cores
+    "INDEX_BUILD_WORKERS": "1",
+    # keep words positions within documents, to match phrases without reading documents
+    "INDEX_POSITIONS": "false",
+    # keep completions of words and titles for the search box
+    "INDEX_SUGGESTIONS": "true",
+    # MB of postings kept in memory while building the index, 0 is unbounded
+    "INDEX_BUILD_MEMORY_BUDGET": "0",
 }
 
 